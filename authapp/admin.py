@@ -1,3 +1,218 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import connection
+from django.utils import timezone
+from django.utils.functional import cached_property
 
-# Register your models here.
+from . import bulk
+from .models import (
+    CustomUser, FraudFlag, LedgerRollup, MpesaTransaction, Notification, Survey, Task, Transaction, UserSurvey,
+    Watermark, WithdrawalRequest,
+)
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that never runs an unbounded COUNT(*).
+
+    Unfiltered changelists on PostgreSQL use the planner's row estimate
+    from pg_class once it is above ``count_cap``; smaller tables and
+    filtered result sets count at most ``count_cap`` rows, so they are
+    exact up to there and deep filtered result sets show "10000".
+    """
+
+    count_cap = 10000
+
+    def estimate(self):
+        """Planner row estimate for the unfiltered table, or None"""
+        if connection.vendor != 'postgresql' or self.object_list.query.where:
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE relname = %s',
+                [self.object_list.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        # reltuples is -1 until the table has been analyzed
+        return row[0] if row and row[0] > 0 else None
+
+    @cached_property
+    def count(self):
+        estimate = self.estimate()
+        if estimate is not None and estimate > self.count_cap:
+            return estimate
+        return self.object_list.order_by()[:self.count_cap].count()
+
+
+class FastChangeListAdmin(admin.ModelAdmin):
+    """Defaults for changelists over large tables; only filter on indexed columns"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+
+
+@admin.register(CustomUser)
+class CustomUserAdmin(FastChangeListAdmin):
+    list_display = ('phone_number', 'first_name', 'is_premium', 'balance', 'total_earned',
+                    'downline_count', 'is_staff', 'date_joined')
+    list_filter = ('is_premium',)
+    search_fields = ('=phone_number', '=referral_code')
+    date_hierarchy = 'date_joined'
+    ordering = ('-date_joined',)
+    raw_id_fields = ('referred_by',)
+    readonly_fields = ('pin', 'password', 'last_login', 'referral_path', 'downline_count')
+    filter_horizontal = ('groups', 'user_permissions')
+    actions = ['grant_premium']
+
+    @admin.action(description='Grant premium (with activation bonus)')
+    def grant_premium(self, request, queryset):
+        granted = bulk.grant_premium(queryset.values_list('pk', flat=True))
+        self.message_user(request, f'Granted premium to {granted} users.', messages.SUCCESS)
+
+
+@admin.register(Transaction)
+class TransactionAdmin(FastChangeListAdmin):
+    list_display = ('user', 'transaction_type', 'amount', 'status', 'mpesa_receipt', 'created_at')
+    list_select_related = ('user',)
+    list_filter = ('transaction_type', 'status')
+    search_fields = ('=mpesa_receipt', '=user__phone_number')
+    date_hierarchy = 'created_at'
+    ordering = ('-created_at',)
+    raw_id_fields = ('user',)
+
+
+@admin.register(MpesaTransaction)
+class MpesaTransactionAdmin(FastChangeListAdmin):
+    list_display = ('checkout_request_id', 'user', 'phone_number', 'amount', 'status', 'mpesa_receipt', 'created_at')
+    list_select_related = ('user',)
+    list_filter = ('status',)
+    search_fields = ('=checkout_request_id', '=mpesa_receipt', '=phone_number')
+    date_hierarchy = 'created_at'
+    ordering = ('-created_at',)
+    raw_id_fields = ('user',)
+    actions = ['reconcile_completed', 'retry_failed']
+
+    @admin.action(description='Grant premium for completed payments that were not applied')
+    def reconcile_completed(self, request, queryset):
+        granted = bulk.reconcile_completed_payments(queryset)
+        self.message_user(request, f'Activated premium for {granted} users.', messages.SUCCESS)
+
+    @admin.action(description='Retry failed/cancelled payments (new STK push)')
+    def retry_failed(self, request, queryset):
+        sent, errors = bulk.retry_failed_payments(queryset)
+        level = messages.WARNING if errors else messages.SUCCESS
+        self.message_user(request, f'Sent {sent} new payment requests, {errors} failed.', level)
+
+
+@admin.register(WithdrawalRequest)
+class WithdrawalRequestAdmin(FastChangeListAdmin):
+    list_display = ('user', 'amount', 'mpesa_phone', 'status', 'created_at', 'processed_at')
+    list_select_related = ('user',)
+    list_filter = ('status',)
+    search_fields = ('=mpesa_phone', '=user__phone_number')
+    date_hierarchy = 'created_at'
+    ordering = ('-created_at',)
+    raw_id_fields = ('user',)
+    actions = ['approve']
+
+    @admin.action(description='Approve selected withdrawals')
+    def approve(self, request, queryset):
+        approved, failed = bulk.approve_withdrawals(queryset)
+        level = messages.WARNING if failed else messages.SUCCESS
+        self.message_user(request, f'Approved {approved} withdrawals; {failed} failed for insufficient balance.', level)
+
+
+@admin.register(Survey)
+class SurveyAdmin(admin.ModelAdmin):
+    list_display = ('title', 'category', 'difficulty', 'reward_amount', 'is_active', 'is_premium_only', 'created_at')
+    list_filter = ('is_active', 'is_premium_only', 'category', 'difficulty')
+    search_fields = ('title',)
+
+
+@admin.register(UserSurvey)
+class UserSurveyAdmin(FastChangeListAdmin):
+    list_display = ('user', 'survey', 'status', 'earnings', 'assigned_at', 'completed_at')
+    list_select_related = ('user', 'survey')
+    list_filter = ('status',)
+    search_fields = ('=user__phone_number',)
+    ordering = ('-assigned_at',)
+    raw_id_fields = ('user', 'survey')
+    actions = ['settle']
+
+    @admin.action(description='Pay out rewards for selected completed responses')
+    def settle(self, request, queryset):
+        from . import settlement
+        totals = settlement.settle(queryset)
+        self.message_user(request, f"Settled {totals['rows']} responses (Ksh {totals['amount']}).", messages.SUCCESS)
+
+
+@admin.register(LedgerRollup)
+class LedgerRollupAdmin(admin.ModelAdmin):
+    """Read-only: rows are maintained by manage.py rollup_ledger"""
+    list_display = ('day', 'transaction_type', 'total_amount', 'transaction_count', 'updated_at')
+    list_filter = ('transaction_type',)
+    date_hierarchy = 'day'
+    ordering = ('-day', 'transaction_type')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Watermark)
+class WatermarkAdmin(admin.ModelAdmin):
+    list_display = ('name', 'position', 'updated_at')
+
+
+@admin.register(FraudFlag)
+class FraudFlagAdmin(FastChangeListAdmin):
+    list_display = ('user', 'score', 'reasons', 'status', 'created_at', 'updated_at')
+    list_select_related = ('user',)
+    list_filter = ('status',)
+    search_fields = ('=user__phone_number',)
+    ordering = ('-score',)
+    raw_id_fields = ('user',)
+    actions = ['clear', 'confirm']
+
+    @admin.action(description='Clear selected flags (not fraud)')
+    def clear(self, request, queryset):
+        updated = queryset.filter(status='open').update(status='cleared')
+        self.message_user(request, f'Cleared {updated} flags.', messages.SUCCESS)
+
+    @admin.action(description='Confirm selected flags as fraud')
+    def confirm(self, request, queryset):
+        updated = queryset.filter(status='open').update(status='confirmed')
+        self.message_user(request, f'Confirmed {updated} flags.', messages.SUCCESS)
+
+
+@admin.register(Task)
+class TaskAdmin(FastChangeListAdmin):
+    list_display = ('name', 'status', 'attempts', 'max_attempts', 'run_after', 'locked_until', 'updated_at')
+    list_filter = ('status',)
+    ordering = ('run_after',)
+    readonly_fields = ('name', 'args', 'kwargs', 'attempts', 'locked_until', 'last_error', 'created_at', 'updated_at')
+    actions = ['retry']
+
+    @admin.action(description='Retry selected failed tasks now')
+    def retry(self, request, queryset):
+        updated = queryset.filter(status='failed').update(
+            status='queued', attempts=0, run_after=timezone.now(), locked_until=None)
+        self.message_user(request, f'Queued {updated} tasks for retry.', messages.SUCCESS)
+
+
+@admin.register(Notification)
+class NotificationAdmin(FastChangeListAdmin):
+    """Read-only: rows are written by manage.py dispatch_notifications"""
+    list_display = ('user', 'kind', 'title', 'created_at', 'read_at')
+    list_select_related = ('user',)
+    search_fields = ('=user__phone_number',)
+    ordering = ('-id',)
+    raw_id_fields = ('user',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -1,35 +1,40 @@
 # authapp/backends.py
+import logging
+
 from django.contrib.auth.backends import BaseBackend
 from .models import CustomUser
 
+logger = logging.getLogger(__name__)
+
 class PhoneAuthBackend(BaseBackend):
     def authenticate(self, request, phone_number=None, pin=None, **kwargs):
+        # The admin login form sends username/password
+        phone_number = phone_number or kwargs.get('username')
+        pin = pin or kwargs.get('password')
+        if not phone_number or not pin:
+            return None
+        formatted_phone = phone_number
         try:
-            print(f"🔑 Backend authentication attempt - Phone: {phone_number}, PIN: {pin}")
-            
             # Use the same phone normalization as the manager
             formatted_phone = CustomUser.objects.normalize_phone_number(phone_number)
-            print(f"🔑 Backend formatted phone: {formatted_phone}")
             
             user = CustomUser.objects.get(phone_number=formatted_phone)
-            print(f"🔑 Backend found user: {user.phone_number}")
             
             if user.check_pin(pin):
-                print(f"🔑 Backend PIN validation SUCCESS")
+                logger.debug("Backend PIN validation SUCCESS for %s", formatted_phone)
                 return user
             else:
-                print(f"🔑 Backend PIN validation FAILED")
+                logger.debug("Backend PIN validation FAILED for %s", formatted_phone)
                 return None
                 
         except CustomUser.DoesNotExist:
-            print(f"🔑 Backend user not found: {formatted_phone}")
+            logger.debug("Backend user not found: %s", formatted_phone)
             return None
         except Exception as e:
-            print(f"🔑 Backend error: {e}")
+            logger.warning("Backend error: %s", e)
             return None
     
     def get_user(self, user_id):
-        try:
-            return CustomUser.objects.get(pk=user_id)
-        except CustomUser.DoesNotExist:
-            return None
\ No newline at end of file
+        # Runs on every authenticated request; served from a short-lived cache
+        from . import usercache
+        return usercache.get(user_id)
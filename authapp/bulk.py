@@ -0,0 +1,256 @@
+# authapp/bulk.py
+"""
+Set-wise versions of the per-object balance operations on the models.
+
+``CustomUser.withdraw``/``activate_premium`` save the whole row and
+insert ledger rows one at a time; the functions here do the same work
+for many rows at once: one UPDATE per table with F() expressions and
+one ``bulk_create`` for the ledger, inside a transaction per batch.
+"""
+from collections import defaultdict
+from decimal import Decimal
+from functools import partial
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Value, When
+from django.utils import timezone
+
+from . import notifications, usercache
+from .models import CustomUser, MpesaTransaction, Transaction, WithdrawalRequest
+
+BATCH_SIZE = 2000
+PREMIUM_BONUS = Decimal('500.00')
+
+
+def batched(ids, size=BATCH_SIZE):
+    ids = list(ids)
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def supports_update_from(connection):
+    """UPDATE ... FROM is available on PostgreSQL and SQLite 3.33+"""
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor == 'sqlite':
+        import sqlite3
+        return sqlite3.sqlite_version_info >= (3, 33)
+    return False
+
+
+def increment_users(deltas, columns):
+    """
+    Add per-user deltas to several ``CustomUser`` columns at once.
+
+    ``deltas`` maps user id to a tuple aligned with ``columns``. Runs one
+    ``UPDATE ... FROM (VALUES ...)`` joined on the primary key, or a
+    CASE/WHEN update on backends without UPDATE ... FROM. Returns the
+    number of users updated.
+    """
+    from django.db import connections, router
+
+    if not deltas:
+        return 0
+    usercache.invalidate(deltas)
+    connection = connections[router.db_for_write(CustomUser)]
+
+    if not supports_update_from(connection):
+        changes = {}
+        for index, column in enumerate(columns):
+            delta = Case(*[When(pk=pk, then=Value(row[index])) for pk, row in deltas.items()],
+                         output_field=CustomUser._meta.get_field(column))
+            changes[column] = F(column) + delta
+        return CustomUser.objects.filter(pk__in=deltas).update(**changes)
+
+    qn = connection.ops.quote_name
+    table = qn(CustomUser._meta.db_table)
+    casts = ['BIGINT'] + [
+        'NUMERIC' if isinstance(CustomUser._meta.get_field(column), DecimalField) else 'INTEGER'
+        for column in columns
+    ]
+    row_sql = '(' + ', '.join(f'CAST(%s AS {cast})' for cast in casts) + ')'
+    names = ', '.join(qn(f'd_{column}') for column in columns)
+    assignments = ', '.join(f'{qn(c)} = {table}.{qn(c)} + v.{qn("d_" + c)}' for c in columns)
+    sql = (
+        f'WITH v (id, {names}) AS (VALUES {", ".join([row_sql] * len(deltas))}) '
+        f'UPDATE {table} SET {assignments} FROM v WHERE {table}.{qn("id")} = v.id'
+    )
+    params = [value for pk, row in deltas.items() for value in (pk, *(str(d) for d in row))]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+def adjust_balances(amounts, **fields):
+    """
+    Add ``amounts`` ({user_id: Decimal}) to ``balance`` and to any extra
+    counter columns named in ``fields`` (``total_earned=True`` etc.) with
+    a single UPDATE. Negative amounts debit.
+    """
+    columns = ['balance'] + [name for name, enabled in fields.items() if enabled]
+    return increment_users({pk: (amount,) * len(columns) for pk, amount in amounts.items()}, columns)
+
+
+def approve_withdrawals(queryset, batch_size=BATCH_SIZE):
+    """
+    Complete pending withdrawal requests, debiting balances and writing
+    'withdrawal' ledger rows. Requests the user can no longer cover are
+    marked failed. Returns (approved, failed).
+    """
+    ids = queryset.filter(status__in=['pending', 'processing']).order_by('pk').values_list('pk', flat=True)
+    approved_total = failed_total = 0
+
+    for batch in batched(ids, batch_size):
+        with transaction.atomic():
+            requests = list(
+                WithdrawalRequest.objects.select_for_update()
+                .filter(pk__in=batch, status__in=['pending', 'processing'])
+                .order_by('pk')
+                .values('pk', 'user_id', 'amount', 'mpesa_phone')
+            )
+            balances = dict(
+                CustomUser.objects.select_for_update()
+                .filter(pk__in={r['user_id'] for r in requests})
+                .values_list('pk', 'balance')
+            )
+
+            approved, failed, debits = [], [], defaultdict(Decimal)
+            for request in requests:
+                remaining = balances.get(request['user_id'], Decimal('0')) - debits[request['user_id']]
+                if request['amount'] <= remaining:
+                    approved.append(request)
+                    debits[request['user_id']] += request['amount']
+                else:
+                    failed.append(request)
+
+            now = timezone.now()
+            WithdrawalRequest.objects.filter(pk__in=[r['pk'] for r in approved]).update(
+                status='completed', processed_at=now
+            )
+            WithdrawalRequest.objects.filter(pk__in=[r['pk'] for r in failed]).update(status='failed', processed_at=now)
+            adjust_balances({pk: -amount for pk, amount in debits.items()})
+            Transaction.objects.bulk_create([
+                Transaction(
+                    user_id=r['user_id'],
+                    amount=r['amount'],
+                    transaction_type='withdrawal',
+                    description='M-Pesa Withdrawal',
+                    mpesa_phone=r['mpesa_phone'],
+                )
+                for r in approved
+            ])
+            notifications.emit_many(
+                [(r['user_id'], 'payout_completed', {'amount': str(r['amount'])}) for r in approved]
+                + [(r['user_id'], 'payout_failed', {'amount': str(r['amount'])}) for r in failed]
+            )
+
+        approved_total += len(approved)
+        failed_total += len(failed)
+
+    return approved_total, failed_total
+
+
+def queue_referral_bonuses(user_ids):
+    """Queue the upline bonus of each newly premium user"""
+    from .referrals import propagate_bonus_task
+    for pk in user_ids:
+        propagate_bonus_task.delay(pk)
+
+
+def grant_premium(user_ids, batch_size=BATCH_SIZE):
+    """
+    Activate premium for users who don't have it yet, crediting the
+    activation bonus and writing the same ledger rows as
+    ``CustomUser.activate_premium``. Once each batch commits, the referral
+    bonus for every granted user with an upline is queued, as
+    ``activate_premium`` does. Returns the number of users upgraded.
+    """
+    granted = 0
+    for batch in batched(user_ids, batch_size):
+        with transaction.atomic():
+            rows = list(
+                CustomUser.objects.select_for_update()
+                .filter(pk__in=batch, is_premium=False)
+                .values_list('pk', 'referral_path')
+            )
+            pending = [pk for pk, path in rows]
+            referred = [pk for pk, path in rows if path]
+            usercache.invalidate(pending)
+            CustomUser.objects.filter(pk__in=pending).update(
+                is_premium=True,
+                premium_activated_date=timezone.now(),
+                balance=F('balance') + PREMIUM_BONUS,
+            )
+            Transaction.objects.bulk_create(
+                [
+                    Transaction(user_id=pk, amount=PREMIUM_BONUS, transaction_type='bonus',
+                                description='Premium Activation Bonus')
+                    for pk in pending
+                ] + [
+                    Transaction(user_id=pk, amount=Decimal('0.00'), transaction_type='premium',
+                                description='Premium Membership Activation')
+                    for pk in pending
+                ]
+            )
+            notifications.emit_many([(pk, 'premium_activated', {}) for pk in pending])
+            transaction.on_commit(partial(queue_referral_bonuses, referred))
+        granted += len(pending)
+    return granted
+
+
+def reconcile_completed_payments(queryset):
+    """Grant premium to users whose M-Pesa payment completed but who never got it"""
+    user_ids = (
+        queryset.filter(status='COMPLETED', user__is_premium=False)
+        .values_list('user_id', flat=True)
+        .distinct()
+    )
+    return grant_premium(user_ids)
+
+
+def retry_failed_payments(queryset, concurrency=8):
+    """
+    Re-send the STK push for failed or cancelled payments, once per user
+    and only for users still without premium. The pushes run on a small
+    thread pool, each worker with its own HTTP session; the new PENDING
+    rows are written with one bulk insert.
+    Returns (sent, errors).
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    from . import journal
+    from .mpesa import get_gateway
+    from .payments import build_push, push_record
+
+    latest = {}
+    for payment in (
+        queryset.filter(status__in=['FAILED', 'CANCELLED'], user__is_premium=False)
+        .order_by('created_at')
+        .only('pk', 'user_id', 'phone_number', 'amount', 'account_reference', 'transaction_desc')
+    ):
+        latest[payment.user_id] = payment
+    payments = list(latest.values())
+
+    gateway = get_gateway()
+
+    def push(payment):
+        return gateway.initiate_stk_push(
+            phone_number=payment.phone_number,
+            amount=payment.amount,
+            account_reference=payment.account_reference,
+            transaction_desc=payment.transaction_desc,
+        )
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(push, payments))
+
+    records = [
+        push_record(payment.user_id, payment.phone_number, payment.amount,
+                    payment.account_reference, payment.transaction_desc, response)
+        for payment, (response, error) in zip(payments, results)
+        if response
+    ]
+    journal.record_many('stk_push', records)
+    retries = [build_push(record) for record in records]
+    MpesaTransaction.objects.bulk_create(retries)
+    return len(retries), len(payments) - len(retries)
@@ -0,0 +1,154 @@
+# authapp/callbacks.py
+"""
+Parser for Daraja STK push callbacks.
+
+``parse`` turns a raw request body into an ``StkCallback`` or raises
+``CallbackError``. Malformed bodies are rejected before anything is
+logged or looked up. Metadata items are applied through ``ITEM_SETTERS``,
+a table from item name to setter, and items we don't use (such as
+``Balance``) are skipped.
+
+A successful callback (``ResultCode`` 0) must carry the amount and the
+M-Pesa receipt. Any other result code marks the payment failed;
+``RESULT_CODES`` lists the ones Daraja documents.
+"""
+import json
+import re
+from decimal import Decimal, InvalidOperation
+
+# Daraja STK result codes and what they mean for the customer
+RESULT_CODES = {
+    0: 'The service request is processed successfully.',
+    1: 'The balance is insufficient for the transaction.',
+    1001: 'Unable to lock subscriber, a transaction is already in process for the current subscriber.',
+    1019: 'Transaction has expired.',
+    1025: 'An error occurred while sending a push request.',
+    1032: 'Request cancelled by user.',
+    1037: 'DS timeout user cannot be reached.',
+    2001: 'The initiator information is invalid.',
+    9999: 'An error occurred while sending a push request.',
+}
+
+MAX_BODY = 16 * 1024
+MAX_AMOUNT = Decimal('99999999.99')  # MpesaTransaction.amount holds 10 digits
+MAX_RESULT_CODE = 2 ** 31 - 1
+RESULT_CODE = re.compile(r'^\d{1,9}$', re.ASCII)
+REQUEST_ID = re.compile(r'^[\w-]{1,100}$', re.ASCII)
+RECEIPT = re.compile(r'^[A-Z0-9]{6,50}$')
+TRANSACTION_DATE = re.compile(r'^\d{14}$')
+PHONE = re.compile(r'^254\d{9}$')
+
+
+class CallbackError(ValueError):
+    """The callback body is not a well-formed STK callback"""
+
+
+class StkCallback:
+    __slots__ = ('merchant_request_id', 'checkout_request_id', 'result_code', 'result_desc',
+                 'amount', 'receipt', 'transaction_date', 'phone_number')
+
+    def __init__(self, merchant_request_id, checkout_request_id, result_code, result_desc):
+        self.merchant_request_id = merchant_request_id
+        self.checkout_request_id = checkout_request_id
+        self.result_code = result_code
+        self.result_desc = result_desc
+        self.amount = None
+        self.receipt = None
+        self.transaction_date = None
+        self.phone_number = None
+
+    @property
+    def succeeded(self):
+        return self.result_code == 0
+
+    @property
+    def status(self):
+        """MpesaTransaction status this callback leads to"""
+        return 'COMPLETED' if self.succeeded else 'FAILED'
+
+    def __repr__(self):
+        return f'<StkCallback {self.checkout_request_id} result={self.result_code}>'
+
+
+def _set_amount(callback, value):
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise CallbackError('Amount must be a number')
+    try:
+        amount = Decimal(str(value))
+    except InvalidOperation:
+        raise CallbackError('Amount must be a number') from None
+    if not amount.is_finite() or not 0 < amount <= MAX_AMOUNT:
+        raise CallbackError('Amount out of range')
+    callback.amount = amount
+
+
+def _matching(attribute, pattern):
+    """Setter storing the value as text if it matches ``pattern``"""
+    def setter(callback, value):
+        if isinstance(value, bool) or not isinstance(value, (int, str)) or not pattern.match(str(value)):
+            raise CallbackError(f'Invalid {attribute}')
+        setattr(callback, attribute, str(value))
+    return setter
+
+
+ITEM_SETTERS = {
+    'Amount': _set_amount,
+    'MpesaReceiptNumber': _matching('receipt', RECEIPT),
+    'TransactionDate': _matching('transaction_date', TRANSACTION_DATE),
+    'PhoneNumber': _matching('phone_number', PHONE),
+}
+
+
+def _request_id(data, key):
+    value = data.get(key)
+    if not isinstance(value, str) or not REQUEST_ID.match(value):
+        raise CallbackError(f'Invalid {key}')
+    return value
+
+
+def parse(body):
+    """StkCallback from a raw callback body (bytes or str); raises CallbackError"""
+    if len(body) > MAX_BODY:
+        raise CallbackError('Callback body too large')
+    try:
+        data = json.loads(body)
+    except (ValueError, TypeError, RecursionError):
+        raise CallbackError('Callback body is not JSON') from None
+
+    stk = data.get('Body') if isinstance(data, dict) else None
+    stk = stk.get('stkCallback') if isinstance(stk, dict) else None
+    if not isinstance(stk, dict):
+        raise CallbackError('Missing Body.stkCallback')
+
+    result_code = stk.get('ResultCode')
+    if isinstance(result_code, str) and RESULT_CODE.match(result_code):
+        result_code = int(result_code)
+    if isinstance(result_code, bool) or not isinstance(result_code, int) or not 0 <= result_code <= MAX_RESULT_CODE:
+        raise CallbackError('Invalid ResultCode')
+    result_desc = stk.get('ResultDesc', RESULT_CODES.get(result_code, ''))
+    if not isinstance(result_desc, str):
+        raise CallbackError('Invalid ResultDesc')
+
+    callback = StkCallback(
+        _request_id(stk, 'MerchantRequestID'),
+        _request_id(stk, 'CheckoutRequestID'),
+        result_code,
+        result_desc[:500],
+    )
+    if not callback.succeeded:
+        return callback
+
+    metadata = stk.get('CallbackMetadata')
+    items = metadata.get('Item') if isinstance(metadata, dict) else None
+    if not isinstance(items, list):
+        raise CallbackError('Missing CallbackMetadata.Item')
+    for item in items:
+        if not isinstance(item, dict):
+            raise CallbackError('Invalid CallbackMetadata item')
+        setter = ITEM_SETTERS.get(item.get('Name'))
+        if setter is not None and 'Value' in item:
+            setter(callback, item['Value'])
+
+    if callback.amount is None or callback.receipt is None:
+        raise CallbackError('Successful callback without Amount or MpesaReceiptNumber')
+    return callback
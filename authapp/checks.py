@@ -0,0 +1,49 @@
+# authapp/checks.py
+"""System checks (``manage.py check``) for deployment settings the app relies on."""
+import os
+
+from django.conf import settings
+from django.core import checks
+
+
+@checks.register()
+def check_payment_journal(app_configs, **kwargs):
+    """Warn when payment events would not be journaled for replay_payments"""
+    from . import journal
+
+    path = journal.directory()
+    if not path:
+        if getattr(settings, 'PROFILE', None) == 'production':
+            return [checks.Warning(
+                'Payment journaling is off, so lost payments cannot be rebuilt with replay_payments.',
+                hint='Set PAYMENT_JOURNAL_DIR to a writable, persistent directory.',
+                id='authapp.W001',
+            )]
+        return []
+
+    # The directory is created on first write; check the nearest existing parent
+    existing = os.path.abspath(path)
+    while not os.path.exists(existing):
+        existing = os.path.dirname(existing)
+    if not os.path.isdir(existing) or not os.access(existing, os.W_OK):
+        return [checks.Warning(
+            f'PAYMENT_JOURNAL_DIR {path} is not writable; payment events will not be journaled.',
+            hint='Point PAYMENT_JOURNAL_DIR at a writable, persistent directory, or set it empty.',
+            id='authapp.W002',
+        )]
+    return []
+
+
+@checks.register()
+def check_task_consumer(app_configs, **kwargs):
+    """Warn when queued tasks have nothing to run them"""
+    if getattr(settings, 'PROFILE', None) != 'production' or getattr(settings, 'TASK_QUEUE_EAGER', False):
+        return []
+    if not getattr(settings, 'CRON_SECRET', ''):
+        return [checks.Warning(
+            'TASK_QUEUE_EAGER is off and CRON_SECRET is unset, so the Vercel cron cannot run queued tasks.',
+            hint='Set CRON_SECRET in the Vercel project, run manage.py run_workers elsewhere, '
+                 'or set TASK_QUEUE_EAGER=1.',
+            id='authapp.W003',
+        )]
+    return []
@@ -0,0 +1,145 @@
+# authapp/circuit.py
+"""
+Circuit breakers for outbound M-Pesa calls.
+
+Each Daraja endpoint has its own breaker. Its state lives in the default
+cache, so every worker sharing the cache sees the same state:
+- closed: calls go through. Failures and slow calls (over
+  ``CIRCUIT_SLOW_CALL_SECONDS``) are counted per ``CIRCUIT_WINDOW``
+  seconds. Once at least ``CIRCUIT_MIN_CALLS`` were made and the failure
+  rate reaches ``CIRCUIT_FAILURE_RATE``, the breaker opens.
+- open: calls fail immediately with ``CircuitOpen``, so workers don't
+  sit out gateway timeouts during an outage.
+- half-open: once ``CIRCUIT_OPEN_SECONDS`` have passed, one caller at a
+  time is let through as a trial. Success closes the breaker; failure
+  opens it for another period.
+
+``snapshot`` reports every breaker for the staff metrics endpoint.
+"""
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+ENDPOINTS = ('oauth', 'stk_push')
+
+# Shown to users while the gateway is unavailable
+DEGRADED_MESSAGE = 'M-Pesa is not responding right now. Please try again in a minute.'
+
+KEY = 'circuit:{name}:{part}'
+
+
+class CircuitOpen(Exception):
+    """The endpoint's breaker is open; the call was not made"""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f'Circuit for {name} is open')
+        self.name = name
+        self.retry_after = retry_after
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class CircuitBreaker:
+    def __init__(self, name):
+        self.name = name
+        self.window = _setting('CIRCUIT_WINDOW', 60)
+        self.min_calls = _setting('CIRCUIT_MIN_CALLS', 5)
+        self.failure_rate = _setting('CIRCUIT_FAILURE_RATE', 0.5)
+        self.slow_call = _setting('CIRCUIT_SLOW_CALL_SECONDS', 5)
+        self.open_seconds = _setting('CIRCUIT_OPEN_SECONDS', 30)
+        # A trial holds the probe for as long as its request may take
+        timeout = _setting('MPESA_TIMEOUT', (3.05, 10))
+        self.probe_seconds = math.ceil(sum(timeout) if isinstance(timeout, (tuple, list)) else timeout) + 1
+
+    def _key(self, part):
+        return KEY.format(name=self.name, part=part)
+
+    def _bucket(self, part, now=None):
+        return self._key(f'{part}:{int((now or time.time()) // self.window)}')
+
+    def _incr(self, key):
+        if not cache.add(key, 1, self.window * 2):
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, 1, self.window * 2)
+
+    def opened_at(self):
+        return cache.get(self._key('opened_at'))
+
+    def state(self):
+        opened_at = self.opened_at()
+        if opened_at is None:
+            return 'closed'
+        return 'open' if time.time() - opened_at < self.open_seconds else 'half_open'
+
+    def before_call(self):
+        """Raise CircuitOpen unless this call may go ahead; returns True for a half-open trial"""
+        opened_at = self.opened_at()
+        if opened_at is None:
+            return False
+        remaining = self.open_seconds - (time.time() - opened_at)
+        if remaining > 0:
+            raise CircuitOpen(self.name, int(remaining) + 1)
+        # Half-open: a single trial call at a time
+        if not cache.add(self._key('probe'), 1, self.probe_seconds):
+            raise CircuitOpen(self.name, self.open_seconds)
+        return True
+
+    def record(self, ok, seconds, trial=False):
+        """Account for a finished call"""
+        ok = ok and seconds < self.slow_call
+        if trial:
+            cache.delete(self._key('probe'))
+            if ok:
+                self.reset()
+            else:
+                self.trip()
+            return
+        if self.opened_at() is not None:
+            # Started before another worker opened the breaker
+            return
+
+        now = time.time()
+        self._incr(self._bucket('calls', now))
+        if ok:
+            return
+        self._incr(self._bucket('failures', now))
+        calls, failures = self.counts(now)
+        if calls >= self.min_calls and failures / calls >= self.failure_rate:
+            self.trip()
+
+    def counts(self, now=None):
+        """(calls, failures) in the current window"""
+        values = cache.get_many([self._bucket('calls', now), self._bucket('failures', now)])
+        return values.get(self._bucket('calls', now), 0), values.get(self._bucket('failures', now), 0)
+
+    def trip(self):
+        cache.set(self._key('opened_at'), time.time(), None)
+
+    def reset(self):
+        cache.delete_many([self._key('opened_at'), self._key('probe'),
+                           self._bucket('calls'), self._bucket('failures')])
+
+    def snapshot(self):
+        calls, failures = self.counts()
+        opened_at = self.opened_at()
+        return {
+            'state': self.state(),
+            'calls': calls,
+            'failures': failures,
+            'failure_rate': round(failures / calls, 3) if calls else 0.0,
+            'opened_at': opened_at,
+        }
+
+
+def breaker(name):
+    return CircuitBreaker(name)
+
+
+def snapshot():
+    return {name: breaker(name).snapshot() for name in ENDPOINTS}
@@ -0,0 +1,37 @@
+# authapp/fragments.py
+"""
+Versions for ``{% cache %}`` template fragments.
+
+A fragment is keyed by the values that decide its content; bumping a
+version here changes the key, so stale fragments are simply never read
+again and expire on their own. The survey catalogue has one global
+version, each user's survey progress has their own, and ``BUILD_ID``
+retires every fragment on deploy.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+SURVEYS_KEY = 'fragments:surveys'
+USER_KEY = 'fragments:user:{pk}'
+
+
+def _bump(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+def bump_surveys():
+    _bump(SURVEYS_KEY)
+
+
+def bump_user(user_id):
+    _bump(USER_KEY.format(pk=user_id))
+
+
+def version(user):
+    """Cache-key component for fragments rendered for ``user``"""
+    user_key = USER_KEY.format(pk=user.pk)
+    versions = cache.get_many([SURVEYS_KEY, user_key])
+    return f"{settings.BUILD_ID}.{versions.get(SURVEYS_KEY, 0)}.{versions.get(user_key, 0)}"
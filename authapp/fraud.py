@@ -0,0 +1,201 @@
+# authapp/fraud.py
+"""
+Incremental fraud scoring.
+
+Three insert streams are followed past their own ``Watermark``: ledger
+rows, sign-ups and withdrawal requests. Each new row marks a user for
+rescoring: the row's owner, or for a sign-up the referrer. The users
+touched in a batch are rescored together. A handful of queries fetch
+their recent survey timings, direct referrals, credits and withdrawal
+requests as flat columns, and the features are computed over those
+columns in one pass per feature. Accounts scoring ``FRAUD_FLAG_SCORE`` or
+more get an open ``FraudFlag`` for review (``manage.py score_fraud``).
+
+Features, over the last ``WINDOW``:
+- fast completions: share of completed surveys finished in under
+  ``FAST_FRACTION`` of the survey's estimated time;
+- referral burst: direct referrals that signed up in the last day;
+- referral cluster: largest share of direct referrals whose numbers
+  fall in one 100-number block (bulk-bought SIMs);
+- quick cash-outs: withdrawal requests made within ``CASHOUT_WINDOW``
+  of a bonus or referral credit.
+"""
+import time
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .bulk import batched
+from .models import CustomUser, FraudFlag, Transaction, UserSurvey, Watermark, WithdrawalRequest
+
+# watermark name: (model, column naming the user to rescore)
+STREAMS = {
+    'fraud_ledger': (Transaction, 'user_id'),
+    'fraud_signups': (CustomUser, 'referred_by_id'),
+    'fraud_withdrawals': (WithdrawalRequest, 'user_id'),
+}
+STREAM_TIME = {Transaction: 'created_at', CustomUser: 'date_joined', WithdrawalRequest: 'created_at'}
+
+BATCH_SIZE = 10000
+FEATURE_CHUNK = 2000  # Users per feature query, within backend parameter limits
+DEFAULT_LAG = 30
+WINDOW = timedelta(days=30)
+FAST_FRACTION = 0.25
+MIN_COMPLETIONS = 3
+BURST_WINDOW = timedelta(days=1)
+BURST_REFERRALS = 10
+MIN_CLUSTER_REFERRALS = 5
+CASHOUT_WINDOW = timedelta(hours=1)
+CREDIT_TYPES = ('bonus', 'referral')
+
+
+def flag_score():
+    return getattr(settings, 'FRAUD_FLAG_SCORE', 50)
+
+
+def features(user_ids, now=None):
+    """{user_id: {feature: value}} for ``user_ids``"""
+    now = now or timezone.now()
+    since = now - WINDOW
+    result = {pk: {'completions': 0, 'fast_ratio': 0.0, 'referrals_24h': 0, 'direct_referrals': 0,
+                   'cluster_ratio': 0.0, 'quick_cashouts': 0} for pk in user_ids}
+
+    # Survey speed: duration against the survey's own estimate
+    users, started, completed, estimate = _columns(
+        UserSurvey.objects.filter(user_id__in=user_ids, status='completed', completed_at__gte=since,
+                                  started_at__isnull=False),
+        'user_id', 'started_at', 'completed_at', 'survey__estimated_time',
+    )
+    limits = [minutes * 60 * FAST_FRACTION for minutes in estimate]
+    durations = [(end - start).total_seconds() for start, end in zip(started, completed)]
+    done, fast = Counter(users), Counter(u for u, d, lim in zip(users, durations, limits) if d < lim)
+    for pk, count in done.items():
+        result[pk]['completions'] = count
+        if count >= MIN_COMPLETIONS:
+            result[pk]['fast_ratio'] = round(fast[pk] / count, 3)
+
+    # Referral graph: burst of recent sign-ups and number-range clustering
+    referrers, phones, joined = _columns(
+        CustomUser.objects.filter(referred_by_id__in=user_ids, date_joined__gte=since),
+        'referred_by_id', 'phone_number', 'date_joined',
+    )
+    burst_since = now - BURST_WINDOW
+    direct = Counter(referrers)
+    recent = Counter(r for r, j in zip(referrers, joined) if j >= burst_since)
+    blocks = Counter(zip(referrers, (phone[:-2] for phone in phones)))
+    largest = defaultdict(int)
+    for (referrer, _), count in blocks.items():
+        largest[referrer] = max(largest[referrer], count)
+    for pk, count in direct.items():
+        result[pk]['direct_referrals'] = count
+        result[pk]['referrals_24h'] = recent[pk]
+        if count >= MIN_CLUSTER_REFERRALS:
+            result[pk]['cluster_ratio'] = round(largest[pk] / count, 3)
+
+    # Withdrawal requested soon after a credit
+    credits = defaultdict(list)
+    for pk, at in zip(*_columns(
+        Transaction.objects.filter(user_id__in=user_ids, transaction_type__in=CREDIT_TYPES, created_at__gte=since),
+        'user_id', 'created_at',
+    )):
+        credits[pk].append(at)
+    for pk, at in zip(*_columns(
+        WithdrawalRequest.objects.filter(user_id__in=credits, created_at__gte=since), 'user_id', 'created_at',
+    )):
+        if any(timedelta(0) <= at - credit <= CASHOUT_WINDOW for credit in credits[pk]):
+            result[pk]['quick_cashouts'] += 1
+
+    return result
+
+
+def _columns(queryset, *fields):
+    """Rows of ``fields`` as one list per column"""
+    rows = list(queryset.values_list(*fields))
+    return [list(column) for column in zip(*rows)] if rows else [[] for _ in fields]
+
+
+def score(feature):
+    """(0-100 score, contributing features) for one user's features"""
+    points = {
+        'fast_ratio': 60 * feature['fast_ratio'],
+        'referrals_24h': 20 if feature['referrals_24h'] >= BURST_REFERRALS else 0,
+        'cluster_ratio': 30 * feature['cluster_ratio'],
+        'quick_cashouts': min(50, 25 * feature['quick_cashouts']),
+    }
+    reasons = {name: feature[name] for name, value in points.items() if value}
+    return min(100, round(sum(points.values()))), reasons
+
+
+def flag(scores):
+    """Open or refresh flags for users at or above the threshold; returns how many"""
+    flagged = {pk: result for pk, result in scores.items() if result[0] >= flag_score()}
+    if not flagged:
+        return 0
+
+    existing = {f.user_id: f for f in FraudFlag.objects.filter(user_id__in=flagged, status='open')}
+    updated, now = [], timezone.now()
+    for pk, (points, reasons) in flagged.items():
+        if pk in existing:
+            existing[pk].score, existing[pk].reasons, existing[pk].updated_at = points, reasons, now
+            updated.append(existing[pk])
+    FraudFlag.objects.bulk_update(updated, ['score', 'reasons', 'updated_at'])
+    FraudFlag.objects.bulk_create([
+        FraudFlag(user_id=pk, score=points, reasons=reasons)
+        for pk, (points, reasons) in flagged.items() if pk not in existing
+    ])
+    return len(flagged)
+
+
+def _next_chunk(name, model, column, cutoff, batch_size):
+    """(watermark moved to the chunk's end, users it touches, rows read); no watermark once drained"""
+    mark = Watermark.objects.select_for_update().get(name=name)
+    rows = list(
+        model.objects.filter(pk__gt=mark.position, **{f'{STREAM_TIME[model]}__lt': cutoff})
+        .order_by('pk').values_list('pk', column)[:batch_size]
+    )
+    if not rows:
+        return None, set(), 0
+    mark.position = rows[-1][0]
+    return mark, {pk for _, pk in rows if pk is not None}, len(rows)
+
+
+def advance(batch_size=BATCH_SIZE, lag=DEFAULT_LAG, on_batch=None):
+    """Score everyone touched since the watermarks; returns totals"""
+    for name in STREAMS:
+        Watermark.objects.get_or_create(name=name)
+    totals = {'batches': 0, 'rows': 0, 'users': 0, 'flagged': 0, 'seconds': 0.0}
+    cutoff = timezone.now() - timedelta(seconds=lag)
+
+    while True:
+        started = time.perf_counter()
+        with transaction.atomic():
+            marks, users, rows = [], set(), 0
+            for name, (model, column) in STREAMS.items():
+                mark, touched, read = _next_chunk(name, model, column, cutoff, batch_size)
+                if mark is not None:
+                    marks.append(mark)
+                users |= touched
+                rows += read
+            if not marks:
+                break
+
+            flagged = 0
+            for chunk in batched(users, FEATURE_CHUNK):
+                flagged += flag({pk: score(f) for pk, f in features(chunk).items()})
+            for mark in marks:
+                mark.save(update_fields=['position', 'updated_at'])
+
+        elapsed = time.perf_counter() - started
+        batch = {'rows': rows, 'users': len(users), 'flagged': flagged, 'seconds': elapsed,
+                 'rows_per_second': rows / elapsed if elapsed else 0.0}
+        if on_batch:
+            on_batch(batch)
+        totals['batches'] += 1
+        for key in ('rows', 'users', 'flagged', 'seconds'):
+            totals[key] += batch[key]
+
+    totals['rows_per_second'] = totals['rows'] / totals['seconds'] if totals['seconds'] else 0.0
+    return totals
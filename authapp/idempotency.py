@@ -0,0 +1,28 @@
+# authapp/idempotency.py
+"""
+Client-supplied idempotency keys for payment requests.
+
+The key is stored on the ``MpesaTransaction`` the request creates, which
+is unique per user and key and is inserted before the STK push is sent
+(see ``views._start_premium_payment``). A repeat of the key (a double
+tap or a client retry) gets the original transaction's response back
+instead of a second push; one that arrives while the first is still
+waiting on Daraja is told so. A failed push deletes its row, so the
+same attempt can be retried.
+
+Keys are scoped per user, so one user can't replay or block another's
+request.
+"""
+import re
+
+VALID_KEY = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+
+
+def key_from(request, data):
+    """The request's key from the Idempotency-Key header or the JSON body; raises ValueError if malformed"""
+    key = request.headers.get('Idempotency-Key') or data.get('idempotency_key')
+    if key is None:
+        return None
+    if not VALID_KEY.match(str(key)):
+        raise ValueError('Invalid idempotency key')
+    return key
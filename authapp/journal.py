@@ -0,0 +1,220 @@
+# authapp/journal.py
+"""
+Append-only journal of payment events, for rebuilding payment state
+after database loss (``manage.py replay_payments``).
+
+Each event is one JSON line: ``{"ts", "kind", "data"}``. Two kinds are
+written:
+- ``callback``: the raw Daraja callback body, recorded before it is
+  parsed;
+- ``stk_push``: an accepted STK push, with what is needed to recreate
+  its ``MpesaTransaction``.
+
+Every process writes its own segment files in ``PAYMENT_JOURNAL_DIR``,
+so no cross-process locking is needed. A segment is rotated after
+``PAYMENT_JOURNAL_SEGMENT_BYTES``. Appends are handed to a writer
+thread, which writes everything queued since its last pass and fsyncs
+once for the whole group. ``record`` waits for that fsync, so a
+callback is on disk before Daraja is told it was received, while
+concurrent requests share one fsync. An empty ``PAYMENT_JOURNAL_DIR``
+turns journaling off; that is the production default, since the
+deployed bundle is read-only. ``authapp.checks`` warns when production
+runs without a journal or with a directory it cannot write.
+"""
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'payments-'
+SUFFIX = '.jsonl'
+KINDS = ('callback', 'stk_push')
+
+
+def directory():
+    return getattr(settings, 'PAYMENT_JOURNAL_DIR', '')
+
+
+class _Pending:
+    __slots__ = ('line', 'done', 'ok')
+
+    def __init__(self, line):
+        self.line = line
+        self.done = threading.Event()
+        self.ok = False
+
+    def wait(self, timeout=2.0):
+        """Whether the event reached disk within ``timeout`` seconds"""
+        return self.done.wait(timeout) and self.ok
+
+
+class Journal:
+    def __init__(self, path, segment_bytes, commit_delay):
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.commit_delay = commit_delay
+        self._cond = threading.Condition()
+        self._queue = []
+        self._thread = None
+        self._file = None
+        self._size = 0
+
+    def append(self, kind, data):
+        """Queue one event; returns a handle to ``wait`` on for its fsync"""
+        if kind not in KINDS:
+            raise ValueError(f'Unknown journal event kind: {kind}')
+        line = json.dumps({'ts': time.time(), 'kind': kind, 'data': data},
+                          separators=(',', ':'), default=str) + '\n'
+        pending = _Pending(line.encode())
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='payment-journal', daemon=True)
+                self._thread.start()
+            self._queue.append(pending)
+            self._cond.notify()
+        return pending
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+            if self.commit_delay:
+                # Let concurrent appends join this group
+                time.sleep(self.commit_delay)
+            with self._cond:
+                group, self._queue = self._queue, []
+            ok = self._commit(b''.join(p.line for p in group))
+            for pending in group:
+                pending.ok = ok
+                pending.done.set()
+
+    def _commit(self, payload):
+        try:
+            if self._file is None or self._size + len(payload) > self.segment_bytes:
+                self._rotate()
+            self._file.write(payload)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._size += len(payload)
+            return True
+        except OSError as e:
+            logger.error("Payment journal write failed: %s", e)
+            self._close()
+            return False
+
+    def _rotate(self):
+        self._close()
+        os.makedirs(self.path, exist_ok=True)
+        stamp = datetime.now(dt_timezone.utc).strftime('%Y%m%dT%H%M%S%f')
+        name = os.path.join(self.path, f'{PREFIX}{stamp}-{os.getpid()}{SUFFIX}')
+        self._file = open(name, 'ab')
+        self._size = self._file.tell()
+        # Make the new file's directory entry durable too
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _close(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+        self._file = None
+        self._size = 0
+
+
+_journal = None
+_pid = None
+_lock = threading.Lock()
+
+
+def get_journal():
+    """This process's journal, or None when ``PAYMENT_JOURNAL_DIR`` is empty"""
+    global _journal, _pid
+    if not directory():
+        return None
+    with _lock:
+        # Worker processes forked after first use get their own writer and segments
+        if _journal is None or _pid != os.getpid() or _journal.path != directory():
+            _journal = Journal(
+                directory(),
+                getattr(settings, 'PAYMENT_JOURNAL_SEGMENT_BYTES', 64 * 1024 * 1024),
+                getattr(settings, 'PAYMENT_JOURNAL_COMMIT_DELAY', 0.002),
+            )
+            _pid = os.getpid()
+    return _journal
+
+
+def reset_journal():
+    """Drop the shared journal so the next append picks up changed settings"""
+    global _journal
+    with _lock:
+        _journal = None
+
+
+def record(kind, data):
+    """Journal one event if journaling is on; never raises, returns whether it is on disk"""
+    return record_many(kind, [data])
+
+
+def record_many(kind, items):
+    """Journal several events, waiting once for all of them; never raises"""
+    journal = get_journal()
+    if journal is None or not items:
+        return False
+    try:
+        handles = [journal.append(kind, data) for data in items]
+    except Exception as e:
+        logger.error("Payment journal append failed: %s", e)
+        return False
+    if not all(handle.wait() for handle in handles):
+        logger.error("Payment journal did not confirm %s %s event(s) on disk", len(items), kind)
+        return False
+    return True
+
+
+def segments(path=None):
+    """Segment files grouped by writing process, each group oldest first"""
+    path = path or directory()
+    by_pid = {}
+    for name in sorted(os.listdir(path)) if os.path.isdir(path) else []:
+        if name.startswith(PREFIX) and name.endswith(SUFFIX):
+            stamp, pid = name[len(PREFIX):-len(SUFFIX)].rsplit('-', 1)
+            started = datetime.strptime(stamp, '%Y%m%dT%H%M%S%f').replace(tzinfo=dt_timezone.utc)
+            by_pid.setdefault(pid, []).append((started.timestamp(), os.path.join(path, name)))
+    return list(by_pid.values())
+
+
+def _events(files, since):
+    for _, name in files:
+        with open(name, 'rb') as f:
+            for number, line in enumerate(f, start=1):
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    # A torn final line from a crash mid-write
+                    logger.warning("Skipping unreadable journal line %s:%s", name, number)
+                    continue
+                if event['ts'] >= since:
+                    yield event['ts'], event['kind'], event['data']
+
+
+def read(since=0.0, path=None):
+    """Yield (ts, kind, data) for events at or after ``since`` (epoch seconds), in time order"""
+    streams = []
+    for files in segments(path):
+        # A segment ends where the same process's next one starts, so skip segments that ended before ``since``
+        keep = [seg for seg, following in zip(files, files[1:] + [(float('inf'), None)]) if following[0] >= since]
+        streams.append(_events(keep, since))
+    return heapq.merge(*streams, key=lambda event: event[0])
@@ -0,0 +1,156 @@
+# authapp/leaderboard.py
+"""
+Cached top-K leaderboards for referrers and earners.
+
+Both scores (``referral_bonus_earned`` and ``total_earned``) only ever
+grow, so a bounded list kept up to date on every balance change stays
+exact: a user who drops off the list can only come back by earning more,
+which goes through ``record`` again.
+
+``top`` only reads the cache and never queries the users table; a board
+that has not been built yet reads as empty. The write hooks rebuild the
+boards from the database (after commit) when they are missing or older
+than ``LEADERBOARD_MAX_AGE`` seconds, one rebuild at a time per cache, and
+``manage.py rebuild_leaderboard`` forces one on a schedule. The rebuild
+reads the two score indexes, not the whole table. With the default
+per-process LocMemCache every worker keeps its own copy, so use a shared
+``CACHE_BACKEND`` for one board across workers.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from myproject import metrics
+from .models import CustomUser
+
+BOARDS = {
+    'referrers': 'referral_bonus_earned',
+    'earners': 'total_earned',
+}
+
+# Columns needed to build an entry, for callers that fetch users themselves
+ENTRY_FIELDS = ('id', 'first_name', 'phone_number') + tuple(BOARDS.values())
+
+CACHE_KEY = 'leaderboard:{board}'
+LOCK_KEY = 'leaderboard:{board}:lock'
+REBUILT_AT_KEY = 'leaderboard:rebuilt_at'
+REBUILD_LOCK_KEY = 'leaderboard:rebuild:lock'
+
+
+def board_size():
+    return getattr(settings, 'LEADERBOARD_SIZE', 20)
+
+
+def max_age():
+    return getattr(settings, 'LEADERBOARD_MAX_AGE', 300)
+
+
+def _display_name(row):
+    """Same public name as CustomUser.display_name, without the phone number"""
+    if row['first_name']:
+        return row['first_name']
+    return f"User {row['phone_number'][-4:]}"
+
+
+def _entry(row, field):
+    return {'id': row['id'], 'name': _display_name(row), 'score': float(row[field])}
+
+
+def _acquire(key, attempts=5):
+    for _ in range(attempts):
+        if cache.add(key, 1, timeout=5):
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def record(rows):
+    """
+    Merge fresh scores for a few users into every cached board.
+
+    ``rows`` are dicts carrying ``ENTRY_FIELDS`` (e.g. from ``.values()``).
+    Missing or stale boards are rebuilt instead, which picks the rows up.
+    """
+    rows = list(rows)
+    if not rows or refresh():
+        return
+
+    size = board_size()
+    for board, field in BOARDS.items():
+        key, lock = CACHE_KEY.format(board=board), LOCK_KEY.format(board=board)
+        if not _acquire(lock):
+            # Contended: the next update or rebuild will catch up
+            continue
+        try:
+            entries = cache.get(key)
+            if entries is None:
+                continue
+
+            by_id = {entry['id']: entry for entry in entries}
+            floor = entries[-1]['score'] if len(entries) >= size else 0
+            changed = False
+            for row in rows:
+                entry = _entry(row, field)
+                if entry['score'] > 0 and (entry['id'] in by_id or entry['score'] > floor):
+                    by_id[entry['id']] = entry
+                    changed = True
+
+            if changed:
+                entries = sorted(by_id.values(), key=lambda e: (-e['score'], e['id']))[:size]
+                cache.set(key, entries, timeout=None)
+        finally:
+            cache.delete(lock)
+
+
+def record_user(user):
+    """Merge a single in-memory user's current scores into the boards"""
+    record([{field: getattr(user, field) for field in ENTRY_FIELDS}])
+
+
+def record_users(user_ids):
+    """Fetch the current scores for ``user_ids`` and merge them into the boards"""
+    record(CustomUser.objects.filter(pk__in=user_ids).values(*ENTRY_FIELDS))
+
+
+def rebuild():
+    """Recompute every board from the database"""
+    size = board_size()
+    for board, field in BOARDS.items():
+        rows = (
+            CustomUser.objects.filter(**{f'{field}__gt': 0})
+            .order_by(f'-{field}', 'id')
+            .values(*ENTRY_FIELDS)[:size]
+        )
+        cache.set(CACHE_KEY.format(board=board), [_entry(row, field) for row in rows], timeout=None)
+    cache.set(REBUILT_AT_KEY, time.time(), timeout=None)
+
+
+def refresh(force=False):
+    """Rebuild the boards if missing, stale (or ``force``) and no rebuild is already running"""
+    keys = [CACHE_KEY.format(board=board) for board in BOARDS] + [REBUILT_AT_KEY]
+    cached = cache.get_many(keys)
+    built = cached.get(REBUILT_AT_KEY)
+    if not force and len(cached) == len(keys) and time.time() - built < max_age():
+        return False
+    if not cache.add(REBUILD_LOCK_KEY, 1, timeout=60):
+        return False
+    try:
+        rebuild()
+    finally:
+        cache.delete(REBUILD_LOCK_KEY)
+    return True
+
+
+def top(board):
+    """Cached board entries, ranked; empty until a write or rebuild_leaderboard builds the board"""
+    entries = cache.get(CACHE_KEY.format(board=board))
+    metrics.record_cache(entries is not None)
+    return [
+        {'rank': rank, 'name': entry['name'], 'score': entry['score']}
+        for rank, entry in enumerate(entries or [], start=1)
+    ]
+
+
+def rebuilt_at():
+    return cache.get(REBUILT_AT_KEY)
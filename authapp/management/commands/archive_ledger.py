@@ -0,0 +1,153 @@
+import gzip
+import json
+import os
+from datetime import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils import timezone
+
+from authapp import partitions
+from authapp.models import MpesaTransaction, Transaction
+
+MODELS = {
+    'transaction': Transaction,
+    'mpesa': MpesaTransaction,
+}
+
+class ArchiveEncoder(DjangoJSONEncoder):
+    """DjangoJSONEncoder, but keeping full microsecond precision so restores are exact"""
+    def default(self, o):
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super().default(o)
+
+def parse_month(value):
+    try:
+        parsed = datetime.strptime(value, '%Y-%m')
+    except ValueError:
+        raise CommandError(f"Invalid month '{value}', expected YYYY-MM")
+    return parsed.year, parsed.month
+
+class Command(BaseCommand):
+    help = (
+        'Archive whole months of ledger/payment rows to compressed files and drop them from the '
+        'database (detaching partitions on PostgreSQL), or restore archived months on demand'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', help='Archive every month before YYYY-MM (default: keep --keep-months)')
+        parser.add_argument('--keep-months', type=int, default=12, help='Months kept online when --before is not given')
+        parser.add_argument('--restore', help='Restore YYYY-MM or a YYYY-MM:YYYY-MM range (inclusive)')
+        parser.add_argument('--table', choices=[*MODELS, 'all'], default='all')
+        parser.add_argument('--dry-run', action='store_true', help='List the months that would be archived')
+
+    def handle(self, *args, **options):
+        self.archive_dir = getattr(settings, 'LEDGER_ARCHIVE_DIR', os.path.join(settings.BASE_DIR, 'archive'))
+        models = MODELS.values() if options['table'] == 'all' else [MODELS[options['table']]]
+        
+        if options['restore']:
+            first, _, last = options['restore'].partition(':')
+            start, end = parse_month(first), parse_month(last or first)
+            for model in models:
+                self.restore(model, start, end)
+            return
+        
+        if options['before']:
+            cutoff = parse_month(options['before'])
+        else:
+            today = timezone.now()
+            cutoff = partitions.add_months(today.year, today.month, -options['keep_months'])
+        
+        for model in models:
+            table = model._meta.db_table
+            partitioned = partitions.is_partitioned(connection, table)
+            if partitioned:
+                partitions.ensure_future_partitions(connection, table)
+            
+            for year, month in self.months_before(model, cutoff, partitioned):
+                if options['dry_run']:
+                    self.stdout.write(f'Would archive {table} {year:04d}-{month:02d}')
+                else:
+                    self.archive(model, year, month, partitioned)
+
+    def path_for(self, model, year, month):
+        return os.path.join(self.archive_dir, model._meta.db_table, f'{year:04d}-{month:02d}.jsonl.gz')
+
+    def month_range(self, year, month):
+        return partitions.month_start(year, month), partitions.month_start(*partitions.add_months(year, month, 1))
+
+    def months_before(self, model, cutoff, partitioned):
+        if partitioned:
+            return [m for m in partitions.month_partitions(connection, model._meta.db_table) if m < cutoff]
+        months = model.objects.filter(created_at__lt=partitions.month_start(*cutoff)).dates('created_at', 'month')
+        return [(d.year, d.month) for d in months]
+
+    def archive(self, model, year, month, partitioned):
+        table = model._meta.db_table
+        start, end = self.month_range(year, month)
+        rows = model.objects.filter(created_at__gte=start, created_at__lt=end).order_by('pk')
+        
+        path = self.path_for(model, year, month)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            raise CommandError(f'{path} already exists; restore or move it before archiving again')
+        
+        # Write to a temporary file first so a crash never leaves a partial archive
+        written = 0
+        with gzip.open(path + '.tmp', 'wt', encoding='utf-8') as handle:
+            for row in rows.values().iterator(chunk_size=5000):
+                handle.write(json.dumps(row, cls=ArchiveEncoder))
+                handle.write('\n')
+                written += 1
+        os.replace(path + '.tmp', path)
+        
+        with transaction.atomic():
+            if partitioned:
+                partitions.drop_partition(connection, table, year, month)
+            else:
+                rows.delete()
+        
+        self.stdout.write(self.style.SUCCESS(f'Archived {written} rows of {table} {year:04d}-{month:02d} to {path}'))
+
+    def restore(self, model, start, end):
+        table = model._meta.db_table
+        partitioned = partitions.is_partitioned(connection, table)
+        fields = [f for f in model._meta.concrete_fields]
+        columns = ', '.join(connection.ops.quote_name(f.column) for f in fields)
+        placeholders = ', '.join(['%s'] * len(fields))
+        sql = f'INSERT INTO {connection.ops.quote_name(table)} ({columns}) VALUES ({placeholders}) ON CONFLICT DO NOTHING'
+        
+        year, month = start
+        while (year, month) <= end:
+            path = self.path_for(model, year, month)
+            if not os.path.exists(path):
+                self.stdout.write(f'No archive for {table} {year:04d}-{month:02d}')
+                year, month = partitions.add_months(year, month, 1)
+                continue
+            
+            restored = 0
+            with transaction.atomic():
+                if partitioned:
+                    partitions.ensure_partition(connection, table, year, month)
+                with gzip.open(path, 'rt', encoding='utf-8') as handle, connection.cursor() as cursor:
+                    batch = []
+                    for line in handle:
+                        row = json.loads(line)
+                        # Raw INSERT keeps the archived created_at (auto_now_add would overwrite it)
+                        batch.append([
+                            f.get_db_prep_value(f.to_python(row[f.attname]), connection) for f in fields
+                        ])
+                        if len(batch) >= 5000:
+                            cursor.executemany(sql, batch)
+                            restored += len(batch)
+                            batch = []
+                    if batch:
+                        cursor.executemany(sql, batch)
+                        restored += len(batch)
+            
+            os.replace(path, path + '.restored')
+            self.stdout.write(self.style.SUCCESS(f'Restored {restored} rows of {table} {year:04d}-{month:02d}'))
+            year, month = partitions.add_months(year, month, 1)
@@ -0,0 +1,92 @@
+import json
+import logging
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from authapp.mpesa import reset_gateway
+from benchmarks import fixtures, runner
+from benchmarks.fake_daraja import FakeDaraja
+
+class Command(BaseCommand):
+    help = 'Benchmark every view end to end against a seeded throwaway database and a fake Daraja server'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--surveys', type=int, default=50)
+        parser.add_argument('--transactions', type=int, default=10000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--iterations', type=int, default=200, help='Measured requests per view')
+        parser.add_argument('--warmup', type=int, default=10, help='Unmeasured requests per view')
+        parser.add_argument(
+            '--views',
+            default=','.join(runner.VIEWS),
+            help=f"Comma-separated subset of: {', '.join(runner.VIEWS)}",
+        )
+        parser.add_argument('--output', help='Write results as JSON to this path')
+        parser.add_argument('--compare', help='Print changes against a previously saved JSON result')
+        parser.add_argument(
+            '--with-logging',
+            action='store_true',
+            help='Keep INFO logging on during the run (off by default to keep output readable)',
+        )
+
+    def handle(self, *args, **options):
+        views = [v.strip() for v in options['views'].split(',') if v.strip()]
+        unknown = set(views) - set(runner.VIEWS)
+        if unknown:
+            raise CommandError(f"Unknown views: {', '.join(sorted(unknown))}")
+        if options['compare'] and not os.path.exists(options['compare']):
+            raise CommandError(f"No such result file: {options['compare']}")
+        
+        if not options['with_logging']:
+            logging.disable(logging.INFO)
+        
+        # Never touch the real database: run against a fresh test database
+        test_db = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with FakeDaraja() as daraja, override_settings(MPESA_API_BASE_URL=daraja.base_url):
+                reset_gateway()
+                self.stdout.write(f"Seeding {options['users']} users, {options['surveys']} surveys, "
+                                  f"{options['transactions']} transactions...")
+                seeded = fixtures.seed(
+                    users=options['users'],
+                    surveys=options['surveys'],
+                    transactions=options['transactions'],
+                    seed=options['seed'],
+                )
+                suite = runner.Suite(daraja, seeded_users=options['users'])
+                results = suite.run(views, options['iterations'], options['warmup'])
+        finally:
+            reset_gateway()
+            connection.creation.destroy_test_db(test_db, verbosity=0)
+            logging.disable(logging.NOTSET)
+        
+        self.stdout.write('')
+        self.stdout.write(f"{'view':<22}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}{'errors':>8}")
+        for view, metrics in results.items():
+            self.stdout.write(
+                f"{view:<22}{metrics['rps']:>9}{metrics['p50_ms']:>9}{metrics['p95_ms']:>9}"
+                f"{metrics['p99_ms']:>9}{metrics['queries_per_request']:>9}{metrics['errors']:>8}"
+            )
+        
+        if options['compare']:
+            self.stdout.write('')
+            self.stdout.write(f"Compared with {options['compare']}:")
+            for view, metric, before, after, change in runner.compare(results, options['compare']):
+                self.stdout.write(f"  {view:<22}{metric:<22}{before:>10} -> {after:<10} ({change:+.1f}%)")
+        
+        if options['output']:
+            report = {
+                'meta': runner.metadata(
+                    seeded=seeded,
+                    iterations=options['iterations'],
+                    warmup=options['warmup'],
+                ),
+                'views': results,
+            }
+            with open(options['output'], 'w') as handle:
+                json.dump(report, handle, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results saved to {options['output']}"))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from authapp import notifications
+
+class Command(BaseCommand):
+    help = 'Deliver queued notification events to the in-app feed and SMS'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--channel', action='append', choices=list(notifications.CHANNELS),
+                            help='Only deliver to this channel (repeatable)')
+        parser.add_argument('--batch-size', type=int, default=notifications.BATCH_SIZE,
+                            help='Outbox events per database transaction')
+        parser.add_argument('--coalesce', type=int, default=None,
+                            help='Leave events younger than this many seconds for the next run '
+                                 '(default: NOTIFICATION_COALESCE_SECONDS)')
+
+    def handle(self, *args, **options):
+        def report(batch):
+            self.stdout.write(
+                f"  {batch['channel']}: {batch['events']} events -> {batch['messages']} messages "
+                f"in {batch['seconds'] * 1000:.0f} ms"
+            )
+        
+        results = notifications.dispatch(options['channel'], batch_size=options['batch_size'],
+                                         coalesce_for=options['coalesce'], on_batch=report)
+        for channel, totals in results.items():
+            if 'error' in totals:
+                self.stdout.write(self.style.ERROR(f"{channel}: failed ({totals['error']}); will retry next run"))
+            else:
+                self.stdout.write(self.style.SUCCESS(
+                    f"{channel}: {totals['events']} events delivered as {totals['messages']} messages"
+                ))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from authapp import partitions
+
+class Command(BaseCommand):
+    help = 'Convert the ledger tables to monthly partitions on PostgreSQL (what migration 0006 runs)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Print the DDL instead of running it')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Partitioning needs PostgreSQL; other backends keep plain tables')
+        
+        for table in partitions.PARTITIONED_TABLES:
+            if partitions.is_partitioned(connection, table):
+                self.stdout.write(f'{table} is already partitioned')
+                continue
+            try:
+                statements = partitions.convert_to_partitioned(connection, table, dry_run=options['dry_run'])
+            except ValueError as e:
+                raise CommandError(str(e))
+            
+            if options['dry_run']:
+                with connection.cursor() as cursor:
+                    for sql, params in statements:
+                        sql = cursor.mogrify(sql, params)
+                        self.stdout.write((sql.decode() if isinstance(sql, bytes) else sql) + ';')
+            else:
+                self.stdout.write(self.style.SUCCESS(f'Partitioned {table} ({len(statements)} statements)'))
@@ -1,44 +1,39 @@
-from django.core.management.base import BaseCommand
-from authapp.models import Survey
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from authapp import synthetic
 
 class Command(BaseCommand):
+    help = 'Generate sample surveys and, optionally, production-scale synthetic users and ledger rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=0, help='Synthetic users to create')
+        parser.add_argument('--surveys', type=int, default=3,
+                            help='Surveys to create; the first three are the curated samples')
+        parser.add_argument('--transactions', type=int, default=0, help='Ledger rows to create')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed; the same seed gives the same data')
+        parser.add_argument('--copy', action='store_true',
+                            help='Load ledger rows with COPY (PostgreSQL only)')
+
     def handle(self, *args, **options):
-        surveys = [
-            {
-                'title': 'Mobile Banking App Experience',
-                'description': 'Share your experience with mobile banking apps in Kenya',
-                'reward_amount': 200.00,
-                'estimated_time': 8,
-                'category': 'finance',
-                'difficulty': 'medium',
-                'questions_count': 12,
-                'is_premium_only': False
-            },
-            {
-                'title': 'Consumer Preferences - Soft Drinks',
-                'description': 'Tell us about your soft drink preferences and buying habits',
-                'reward_amount': 150.00,
-                'estimated_time': 5,
-                'category': 'consumer',
-                'difficulty': 'easy',
-                'questions_count': 8,
-                'is_premium_only': False
-            },
-            {
-                'title': 'Premium: Luxury Car Brands Survey',
-                'description': 'Exclusive survey about luxury car brand preferences',
-                'reward_amount': 500.00,
-                'estimated_time': 12,
-                'category': 'automotive',
-                'difficulty': 'premium',
-                'questions_count': 15,
-                'is_premium_only': True
-            },
-        ]
+        if min(options['users'], options['surveys'], options['transactions']) < 0:
+            raise CommandError('Counts must not be negative')
         
-        for survey_data in surveys:
-            Survey.objects.create(**survey_data)
+        started = time.perf_counter()
+        try:
+            counts = synthetic.populate(
+                users=options['users'],
+                surveys=options['surveys'],
+                transactions=options['transactions'],
+                seed=options['seed'],
+                copy=options['copy'],
+                log=lambda message: self.stdout.write(f'  {message}'),
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
         
+        elapsed = time.perf_counter() - started
+        summary = ', '.join(f'{n} {table}' for table, n in counts.items())
         self.stdout.write(
-            self.style.SUCCESS('Successfully created 3 sample surveys!')
-        )
\ No newline at end of file
+            self.style.SUCCESS(f'Created {summary} in {elapsed:.1f}s (synthetic users sign in with PIN {synthetic.PIN})')
+        )
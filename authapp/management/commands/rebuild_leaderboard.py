@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from authapp import leaderboard
+
+class Command(BaseCommand):
+    help = 'Rebuild the cached referrer and earner leaderboards from the database'
+
+    def handle(self, *args, **options):
+        leaderboard.rebuild()
+        
+        self.stdout.write(
+            self.style.SUCCESS(f'Rebuilt {len(leaderboard.BOARDS)} leaderboards (top {leaderboard.board_size()})')
+        )
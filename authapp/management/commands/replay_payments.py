@@ -0,0 +1,53 @@
+from datetime import datetime, time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from authapp import journal, payments
+
+class Command(BaseCommand):
+    help = 'Re-apply journaled M-Pesa pushes and callbacks to the database (safe to repeat)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='since',
+                            help='Only events at or after this date or ISO datetime (default: the whole journal)')
+        parser.add_argument('--dir', default=None,
+                            help='Journal directory (default: PAYMENT_JOURNAL_DIR)')
+        parser.add_argument('--batch-size', type=int, default=payments.REPLAY_BATCH_SIZE,
+                            help='Events applied per database transaction')
+
+    def handle(self, *args, **options):
+        since = 0.0
+        if options['since']:
+            moment = parse_datetime(options['since'])
+            if moment is None:
+                day = parse_date(options['since'])
+                if day is None:
+                    raise CommandError(f"--from must be a date or ISO datetime, got '{options['since']}'")
+                moment = datetime.combine(day, time.min)
+            if timezone.is_naive(moment):
+                moment = timezone.make_aware(moment)
+            since = moment.timestamp()
+        
+        path = options['dir'] or journal.directory()
+        if not path:
+            raise CommandError('No journal directory; set PAYMENT_JOURNAL_DIR or pass --dir')
+        
+        def report(batch):
+            self.stdout.write(
+                f"  {batch['events']} events: {batch['pushes']} pushes, {batch['applied']} callbacks applied, "
+                f"{batch['skipped']} already settled in {batch['seconds'] * 1000:.0f} ms "
+                f"({batch['events_per_second']:.0f} events/s)"
+            )
+        
+        totals = payments.replay(since, path, batch_size=options['batch_size'], on_batch=report)
+        
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Replayed {totals['events']} events in {totals['batches']} batches: "
+                f"{totals['pushes']} pushes, {totals['applied']} callbacks applied, "
+                f"{totals['skipped']} already settled, {totals['rejected']} malformed, "
+                f"{totals['missing']} without a user or payment "
+                f"({totals['events_per_second']:.0f} events/s)"
+            )
+        )
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from authapp import rollups
+
+class Command(BaseCommand):
+    help = 'Fold new ledger transactions into the daily rollup table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=rollups.DEFAULT_CHUNK,
+                            help='Ledger rows folded per database transaction')
+        parser.add_argument('--lag', type=int, default=rollups.DEFAULT_LAG,
+                            help='Leave rows younger than this many seconds for the next run')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Drop the rollups and refold the whole ledger')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            folded = rollups.rebuild()
+        else:
+            folded = rollups.advance(chunk_size=options['chunk_size'], lag=options['lag'])
+        
+        self.stdout.write(
+            self.style.SUCCESS(f'Folded {folded} ledger rows (watermark at id {rollups.watermark()})')
+        )
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from authapp import tasks
+
+class Command(BaseCommand):
+    help = 'Run queued background tasks on a pool of worker threads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help='Worker threads (each holds its own database connection)')
+        parser.add_argument('--poll', type=float, default=1.0,
+                            help='Seconds an idle worker waits before checking the queue again')
+        parser.add_argument('--burst', action='store_true',
+                            help='Exit once no task is ready instead of waiting for more')
+
+    def handle(self, *args, **options):
+        done = {'ok': 0, 'failed': 0}
+        verbosity = options['verbosity']
+        
+        def report(task, ok, seconds):
+            done['ok' if ok else 'failed'] += 1
+            if verbosity > 1:
+                self.stdout.write(f"  {task.name} #{task.pk} attempt {task.attempts}: "
+                                  f"{'ok' if ok else 'failed'} in {seconds * 1000:.0f} ms")
+        
+        self.stdout.write(f"Starting {options['concurrency']} workers")
+        tasks.run_workers(options['concurrency'], poll=options['poll'], burst=options['burst'], on_task=report)
+        
+        self.stdout.write(
+            self.style.SUCCESS(f"Workers stopped: {done['ok']} tasks done, {done['failed']} failed attempts")
+        )
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from authapp import fraud
+
+class Command(BaseCommand):
+    help = 'Score users touched by new ledger rows, sign-ups and withdrawal requests, flagging suspicious accounts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=fraud.BATCH_SIZE,
+                            help='Rows read from each stream per batch')
+        parser.add_argument('--lag', type=int, default=fraud.DEFAULT_LAG,
+                            help='Leave rows younger than this many seconds for the next run')
+
+    def handle(self, *args, **options):
+        def report(batch):
+            self.stdout.write(
+                f"  {batch['rows']} rows / {batch['users']} users / {batch['flagged']} flagged "
+                f"in {batch['seconds'] * 1000:.0f} ms ({batch['rows_per_second']:.0f} rows/s)"
+            )
+        
+        totals = fraud.advance(batch_size=options['batch_size'], lag=options['lag'], on_batch=report)
+        
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Scored {totals['users']} users from {totals['rows']} new rows, "
+                f"{totals['flagged']} at or above the flag score ({totals['rows_per_second']:.0f} rows/s)"
+            )
+        )
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from authapp import settlement
+from authapp.models import UserSurvey
+
+class Command(BaseCommand):
+    help = 'Pay out rewards for completed, unsettled survey responses in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--survey', type=int, action='append',
+                            help='Only settle responses to this survey id (repeatable)')
+        parser.add_argument('--batch-size', type=int, default=settlement.BATCH_SIZE,
+                            help='Responses paid per database transaction')
+
+    def handle(self, *args, **options):
+        queryset = UserSurvey.objects.all()
+        if options['survey']:
+            queryset = queryset.filter(survey_id__in=options['survey'])
+        
+        def report(batch):
+            self.stdout.write(
+                f"  {batch['rows']} responses / {batch['users']} users / Ksh {batch['amount']} "
+                f"in {batch['seconds'] * 1000:.0f} ms ({batch['rows_per_second']:.0f} rows/s)"
+            )
+        
+        totals = settlement.settle(queryset, batch_size=options['batch_size'], on_batch=report)
+        
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Settled {totals['rows']} responses for {totals['users']} user payouts, "
+                f"Ksh {totals['amount']} in {totals['batches']} batches "
+                f"({totals['rows_per_second']:.0f} rows/s)"
+            )
+        )
@@ -0,0 +1,77 @@
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+class Command(BaseCommand):
+    help = 'Profile cold-start imports of the application entry point (python -X importtime)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--module',
+            default=settings.ASGI_APPLICATION.rsplit('.', 1)[0],
+            help='Entry-point module to import (default: the ASGI application module)',
+        )
+        parser.add_argument('--runs', type=int, default=5, help='Number of cold starts to sample')
+        parser.add_argument('--limit', type=int, default=25, help='Number of modules to list')
+
+    def _cold_start(self, code):
+        """Run ``code`` in a fresh interpreter; return (wall seconds, importtime stderr)"""
+        started = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', code],
+            capture_output=True,
+            text=True,
+            env=os.environ.copy(),
+            cwd=settings.BASE_DIR,
+        )
+        elapsed = time.perf_counter() - started
+        if result.returncode != 0:
+            raise CommandError(f'Cold start failed:\n{result.stderr[-2000:]}')
+        return elapsed, result.stderr
+
+    def _parse(self, stderr):
+        """Map module -> (self us, cumulative us) from -X importtime output"""
+        timings = {}
+        for line in stderr.splitlines():
+            if not line.startswith('import time:') or 'self [us]' in line:
+                continue
+            self_us, cumulative_us, name = line[len('import time:'):].split('|')
+            timings[name.strip()] = (int(self_us), int(cumulative_us))
+        return timings
+
+    def handle(self, *args, **options):
+        runs = max(1, options['runs'])
+        module = options['module']
+        
+        baseline = [self._cold_start('pass')[0] for _ in range(runs)]
+        
+        walls, samples = [], {}
+        for _ in range(runs):
+            elapsed, stderr = self._cold_start(f'import {module}')
+            walls.append(elapsed)
+            for name, timing in self._parse(stderr).items():
+                samples.setdefault(name, []).append(timing)
+        
+        # Median per module across runs
+        modules = sorted(
+            (
+                (name, statistics.median(t[0] for t in timing), statistics.median(t[1] for t in timing))
+                for name, timing in samples.items()
+            ),
+            key=lambda row: row[2],
+            reverse=True,
+        )
+        
+        self.stdout.write(f"Cold start of '{module}' over {runs} runs")
+        self.stdout.write(f"  p50 wall:        {statistics.median(walls) * 1000:8.1f} ms")
+        self.stdout.write(f"  p50 interpreter: {statistics.median(baseline) * 1000:8.1f} ms")
+        self.stdout.write(f"  p50 app import:  {(statistics.median(walls) - statistics.median(baseline)) * 1000:8.1f} ms")
+        self.stdout.write('')
+        self.stdout.write(f"{'self ms':>10} {'cumul ms':>10}  module")
+        for name, self_us, cumulative_us in modules[:options['limit']]:
+            self.stdout.write(f"{self_us / 1000:10.1f} {cumulative_us / 1000:10.1f}  {name}")
@@ -0,0 +1,21 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from authapp import sweeper
+
+class Command(BaseCommand):
+    help = 'Mark survey responses that were started but not finished in time as abandoned'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float,
+                            help='Abandon responses in flight longer than this (default SURVEY_ABANDON_AFTER_HOURS)')
+        parser.add_argument('--batch-size', type=int, default=sweeper.BATCH_SIZE,
+                            help='Rows expired per UPDATE')
+        parser.add_argument('--dry-run', action='store_true', help='Only count stale responses')
+
+    def handle(self, *args, **options):
+        older_than = timedelta(hours=options['hours']) if options['hours'] is not None else None
+        swept = sweeper.sweep(older_than, batch_size=options['batch_size'], dry_run=options['dry_run'])
+        
+        verb = 'Would abandon' if options['dry_run'] else 'Abandoned'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {swept} stale survey responses'))
@@ -0,0 +1,54 @@
+# Generated by Django 4.2.18 on 2026-10-19 09:12
+
+from django.db import migrations, models
+
+
+def backfill_referral_paths(apps, schema_editor):
+    CustomUser = apps.get_model('authapp', 'CustomUser')
+    parents = dict(CustomUser.objects.values_list('id', 'referred_by_id'))
+
+    paths = {}
+
+    def path_of(pk):
+        if pk not in paths:
+            chain, seen = [], {pk}
+            parent = parents.get(pk)
+            while parent is not None and parent not in seen:
+                chain.append(parent)
+                seen.add(parent)
+                parent = parents.get(parent)
+            paths[pk] = '/' + ''.join(f'{a}/' for a in reversed(chain)) if chain else ''
+        return paths[pk]
+
+    downline = {}
+    for pk in parents:
+        for ancestor in path_of(pk).strip('/').split('/'):
+            if ancestor:
+                downline[int(ancestor)] = downline.get(int(ancestor), 0) + 1
+
+    users = list(CustomUser.objects.only('id'))
+    for user in users:
+        user.referral_path = path_of(user.id)
+        user.downline_count = downline.get(user.id, 0)
+    CustomUser.objects.bulk_update(users, ['referral_path', 'downline_count'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authapp', '0003_mpesatransaction'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='downline_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='referral_path',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.RunPython(backfill_referral_paths, migrations.RunPython.noop),
+    ]
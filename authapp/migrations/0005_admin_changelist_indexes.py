@@ -0,0 +1,49 @@
+# Generated by Django 4.2.18 on 2026-10-19 06:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authapp', '0004_customuser_referral_path_downline_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(fields=['-date_joined'], name='authapp_cus_date_jo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(fields=['is_premium', '-date_joined'], name='authapp_cus_is_prem_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mpesatransaction',
+            index=models.Index(fields=['-created_at'], name='authapp_mpe_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mpesatransaction',
+            index=models.Index(fields=['status', '-created_at'], name='authapp_mpe_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['-created_at'], name='authapp_tra_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['transaction_type', '-created_at'], name='authapp_tra_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['status', '-created_at'], name='authapp_tra_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usersurvey',
+            index=models.Index(fields=['status', '-assigned_at'], name='authapp_usr_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='withdrawalrequest',
+            index=models.Index(fields=['status', '-created_at'], name='authapp_wit_status_idx'),
+        ),
+    ]
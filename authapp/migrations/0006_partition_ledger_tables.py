@@ -0,0 +1,28 @@
+# Generated by Django 4.2.18 on 2026-10-19 07:05
+
+from django.db import migrations
+
+
+def partition_ledger_tables(apps, schema_editor):
+    # Monthly range partitions on PostgreSQL only; other backends keep
+    # plain tables and archive_ledger falls back to ranged deletes
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+
+    from authapp.partitions import PARTITIONED_TABLES, convert_to_partitioned, is_partitioned
+
+    for table in PARTITIONED_TABLES:
+        if not is_partitioned(connection, table):
+            convert_to_partitioned(connection, table)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authapp', '0005_admin_changelist_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_ledger_tables, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.18 on 2026-10-19 06:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authapp', '0006_partition_ledger_tables'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('transaction_type', models.CharField(choices=[('earning', 'Survey Earnings'), ('withdrawal', 'Withdrawal'), ('bonus', 'Bonus'), ('referral', 'Referral Bonus'), ('premium', 'Premium Activation')], max_length=20)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('transaction_count', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Ledger Rollup',
+                'verbose_name_plural': 'Ledger Rollups',
+                'ordering': ['-day', 'transaction_type'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Watermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('position', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Watermark',
+                'verbose_name_plural': 'Watermarks',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='ledgerrollup',
+            constraint=models.UniqueConstraint(fields=('day', 'transaction_type'), name='authapp_rollup_day_type_uniq'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.18 on 2026-10-19 06:39
+
+from django.db import migrations, models
+from django.db.models import F
+from django.db.models.functions import Coalesce, Now
+
+
+def mark_existing_settled(apps, schema_editor):
+    # Completions from before the settlement engine are not paid again
+    UserSurvey = apps.get_model('authapp', 'UserSurvey')
+    UserSurvey.objects.filter(status='completed').update(settled_at=Coalesce(F('completed_at'), Now()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authapp', '0007_watermark_ledgerrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usersurvey',
+            name='settled_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(mark_existing_settled, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='usersurvey',
+            index=models.Index(condition=models.Q(('settled_at__isnull', True), ('status', 'completed')), fields=['id'], name='authapp_usr_unsettled_idx'),
+        ),
+    ]
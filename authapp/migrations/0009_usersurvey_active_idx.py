@@ -0,0 +1,17 @@
+# Generated by Django 4.2.18 on 2026-10-19 06:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authapp', '0008_usersurvey_settled_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='usersurvey',
+            index=models.Index(condition=models.Q(('status__in', ['started', 'in_progress'])), fields=['started_at'], name='authapp_usr_active_idx'),
+        ),
+    ]
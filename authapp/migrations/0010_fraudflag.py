@@ -0,0 +1,37 @@
+# Generated by Django 4.2.18 on 2026-10-19 06:41
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authapp', '0009_usersurvey_active_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FraudFlag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.IntegerField()),
+                ('reasons', models.JSONField(default=dict)),
+                ('status', models.CharField(choices=[('open', 'Open'), ('cleared', 'Cleared'), ('confirmed', 'Confirmed Fraud')], default='open', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fraud_flags', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Fraud Flag',
+                'verbose_name_plural': 'Fraud Flags',
+                'ordering': ['-score', '-created_at'],
+                'indexes': [models.Index(fields=['status', '-score'], name='authapp_fra_status_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='fraudflag',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'open')), fields=('user',), name='authapp_fraud_one_open_uniq'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.18 on 2026-10-19 06:51
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authapp', '0010_fraudflag'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Task',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200)),
+                ('args', models.JSONField(default=list)),
+                ('kwargs', models.JSONField(default=dict)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('failed', 'Failed')], default='queued', max_length=20)),
+                ('attempts', models.IntegerField(default=0)),
+                ('max_attempts', models.IntegerField(default=5)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now)),
+                ('locked_until', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Task',
+                'verbose_name_plural': 'Tasks',
+                'ordering': ['run_after'],
+                'indexes': [models.Index(condition=models.Q(('status', 'queued')), fields=['run_after'], name='authapp_task_ready_idx'), models.Index(condition=models.Q(('status', 'running')), fields=['locked_until'], name='authapp_task_running_idx')],
+            },
+        ),
+    ]
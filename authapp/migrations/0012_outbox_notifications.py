@@ -0,0 +1,47 @@
+# Generated by Django 4.2.18 on 2026-10-19 06:56
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authapp', '0011_task'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('premium_activated', 'Premium Activated'), ('earning_posted', 'Earning Posted'), ('payout_completed', 'Payout Completed'), ('payout_failed', 'Payout Failed')], max_length=30)),
+                ('payload', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='outbox_events', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Outbox Event',
+                'verbose_name_plural': 'Outbox Events',
+            },
+        ),
+        migrations.CreateModel(
+            name='Notification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('premium_activated', 'Premium Activated'), ('earning_posted', 'Earning Posted'), ('payout_completed', 'Payout Completed'), ('payout_failed', 'Payout Failed')], max_length=30)),
+                ('title', models.CharField(max_length=100)),
+                ('body', models.CharField(max_length=300)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('read_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Notification',
+                'verbose_name_plural': 'Notifications',
+                'ordering': ['-id'],
+                'indexes': [models.Index(fields=['user', '-id'], name='authapp_not_feed_idx'), models.Index(condition=models.Q(('read_at__isnull', True)), fields=['user'], name='authapp_not_unread_idx')],
+            },
+        ),
+    ]
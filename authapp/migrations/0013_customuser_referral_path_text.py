@@ -0,0 +1,18 @@
+# Generated by Django 4.2.18 on 2026-10-19 07:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authapp', '0012_outbox_notifications'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='customuser',
+            name='referral_path',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
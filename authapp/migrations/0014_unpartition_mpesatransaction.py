@@ -0,0 +1,27 @@
+# Generated by Django 4.2.18 on 2026-10-19 07:10
+
+from django.db import migrations
+
+
+def unpartition_payments(apps, schema_editor):
+    # 0006 used to partition authapp_mpesatransaction too, which left
+    # checkout_request_id unique only per (checkout_request_id, created_at)
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+
+    from authapp.partitions import convert_to_plain, is_partitioned
+
+    if is_partitioned(connection, 'authapp_mpesatransaction'):
+        convert_to_plain(connection, 'authapp_mpesatransaction')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authapp', '0013_customuser_referral_path_text'),
+    ]
+
+    operations = [
+        migrations.RunPython(unpartition_payments, migrations.RunPython.noop),
+    ]
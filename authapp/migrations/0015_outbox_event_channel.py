@@ -0,0 +1,55 @@
+# Generated by Django 4.2.18 on 2026-10-19 07:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+# Channels each kind was delivered on when 0012 was written
+ROUTES = {
+    'premium_activated': ('in_app', 'sms'),
+    'earning_posted': ('in_app',),
+    'payout_completed': ('in_app', 'sms'),
+    'payout_failed': ('in_app', 'sms'),
+}
+
+
+def split_by_channel(apps, schema_editor):
+    # One row per undelivered (event, channel), replacing the per-channel watermarks
+    OutboxEvent = apps.get_model('authapp', 'OutboxEvent')
+    Watermark = apps.get_model('authapp', 'Watermark')
+    positions = dict(Watermark.objects.filter(name__in=['notify_in_app', 'notify_sms']).values_list('name', 'position'))
+    enabled = {'in_app', 'sms'} if getattr(settings, 'SMS_PROVIDER', '') else {'in_app'}
+
+    copies, done = [], []
+    for event in OutboxEvent.objects.order_by('pk').iterator():
+        pending = [c for c in ROUTES[event.kind] if c in enabled and event.pk > positions.get(f'notify_{c}', 0)]
+        if not pending:
+            done.append(event.pk)
+            continue
+        event.channel = pending[0]
+        event.save(update_fields=['channel'])
+        copies += [OutboxEvent(user_id=event.user_id, kind=event.kind, channel=c, payload=event.payload)
+                   for c in pending[1:]]
+    OutboxEvent.objects.filter(pk__in=done).delete()
+    OutboxEvent.objects.bulk_create(copies)
+    Watermark.objects.filter(name__in=['notify_in_app', 'notify_sms']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authapp', '0014_unpartition_mpesatransaction'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxevent',
+            name='channel',
+            field=models.CharField(choices=[('in_app', 'In-app'), ('sms', 'SMS')], default='in_app', max_length=20),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='outboxevent',
+            index=models.Index(fields=['channel', 'id'], name='authapp_outbox_channel_idx'),
+        ),
+        migrations.RunPython(split_by_channel, migrations.RunPython.noop),
+    ]
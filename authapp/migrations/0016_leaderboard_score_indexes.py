@@ -0,0 +1,21 @@
+# Generated by Django 4.2.18 on 2026-10-19 07:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authapp', '0015_outbox_event_channel'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(condition=models.Q(('total_earned__gt', 0)), fields=['-total_earned', 'id'], name='authapp_cus_earners_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(condition=models.Q(('referral_bonus_earned__gt', 0)), fields=['-referral_bonus_earned', 'id'], name='authapp_cus_referrers_idx'),
+        ),
+    ]
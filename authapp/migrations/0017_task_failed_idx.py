@@ -0,0 +1,17 @@
+# Generated by Django 4.2.18 on 2026-10-19 07:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authapp', '0016_leaderboard_score_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(condition=models.Q(('status', 'failed')), fields=['run_after'], name='authapp_task_failed_idx'),
+        ),
+    ]
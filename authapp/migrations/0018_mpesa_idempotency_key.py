@@ -0,0 +1,32 @@
+# Generated by Django 4.2.18 on 2026-10-19 07:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authapp', '0017_task_failed_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mpesatransaction',
+            name='idempotency_key',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AlterField(
+            model_name='mpesatransaction',
+            name='checkout_request_id',
+            field=models.CharField(blank=True, max_length=100, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='mpesatransaction',
+            name='merchant_request_id',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddConstraint(
+            model_name='mpesatransaction',
+            constraint=models.UniqueConstraint(condition=models.Q(('idempotency_key__isnull', False)), fields=('user', 'idempotency_key'), name='authapp_mpe_idempotency_uniq'),
+        ),
+    ]
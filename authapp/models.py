@@ -1,10 +1,14 @@
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.db import models
 from django.utils import timezone
+from decimal import Decimal
 import re
 import random
 import string
 
+# Fresh referral codes tried before a save gives up
+REFERRAL_CODE_ATTEMPTS = 5
+
 class CustomUserManager(BaseUserManager):
     def create_user(self, phone_number, pin, **extra_fields):
         # Validate phone number format
@@ -89,6 +93,9 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
         related_name='referrals'
     )
     referral_bonus_earned = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
+    # Upline ids as '/<root>/.../<referrer>/', maintained by authapp.referrals
+    referral_path = models.TextField(blank=True, default='')
+    downline_count = models.IntegerField(default=0)
     
     # Track important dates
     last_login = models.DateTimeField(null=True, blank=True)
@@ -109,21 +116,40 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
         verbose_name = 'User'
         verbose_name_plural = 'Users'
         ordering = ['-date_joined']
+        indexes = [
+            models.Index(fields=['-date_joined'], name='authapp_cus_date_jo_idx'),
+            models.Index(fields=['is_premium', '-date_joined'], name='authapp_cus_is_prem_idx'),
+            # Leaderboard rebuilds (authapp.leaderboard)
+            models.Index(fields=['-total_earned', 'id'], condition=models.Q(total_earned__gt=0),
+                         name='authapp_cus_earners_idx'),
+            models.Index(fields=['-referral_bonus_earned', 'id'], condition=models.Q(referral_bonus_earned__gt=0),
+                         name='authapp_cus_referrers_idx'),
+        ]
     
     def __str__(self):
         return self.phone_number
     
     def save(self, *args, **kwargs):
-        if not self.referral_code:
+        if self.referral_code:
+            return super().save(*args, **kwargs)
+        
+        # Insert with a random code and let the unique index catch the rare clash,
+        # instead of probing for a free code first
+        from django.db import IntegrityError, transaction
+        for attempt in range(REFERRAL_CODE_ATTEMPTS):
             self.referral_code = self.generate_referral_code()
-        super().save(*args, **kwargs)
+            try:
+                with transaction.atomic():
+                    return super().save(*args, **kwargs)
+            except IntegrityError:
+                clash = CustomUser.objects.filter(referral_code=self.referral_code).exists()
+                self.referral_code = ''
+                if not clash or attempt == REFERRAL_CODE_ATTEMPTS - 1:
+                    raise
     
     def generate_referral_code(self):
-        """Generate unique referral code"""
-        while True:
-            code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
-            if not CustomUser.objects.filter(referral_code=code).exists():
-                return code
+        """Generate a random referral code; uniqueness is enforced on insert"""
+        return ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
     
     def set_pin(self, raw_pin):
         from django.contrib.auth.hashers import make_password
@@ -147,18 +173,34 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
         # Show last 4 digits of phone number
         return f"User {self.phone_number[-4:]}"
     
+    def get_session_auth_hash(self):
+        # Cached copies (authapp.usercache) carry the hash instead of the password
+        cached = self.__dict__.get('_session_auth_hash')
+        return cached if cached is not None else super().get_session_auth_hash()
+    
+    def lock_for_update(self, *fields):
+        """
+        Lock this user's row for the current transaction and reload
+        ``fields`` from it; this instance may be a stale cached copy, so
+        balances are always computed from the locked row.
+        """
+        row = CustomUser.objects.select_for_update().values(*fields).get(pk=self.pk)
+        for field, value in row.items():
+            setattr(self, field, value)
+    
     def activate_premium(self):
         """Activate premium membership and add Ksh 500 bonus"""
         from django.db import transaction
         
         with transaction.atomic():
+            self.lock_for_update('balance')
             self.is_premium = True
             self.premium_activated_date = timezone.now()
             
             # Add Ksh 500 bonus to balance
-            bonus_amount = 500.00
+            bonus_amount = Decimal('500.00')
             self.balance += bonus_amount
-            self.save()
+            self.save(update_fields=['is_premium', 'premium_activated_date', 'balance'])
             
             # Create transaction record for premium activation bonus
             Transaction.objects.create(
@@ -175,15 +217,41 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
                 transaction_type='premium',
                 description='Premium Membership Activation'
             )
-    
-    def add_earning(self, amount, description="Survey completion"):
-        """Add earnings to user balance"""
+            
+            from .notifications import emit
+            emit(self.pk, 'premium_activated')
+            
+            # Reward the upline of a referred user (queued; see authapp.tasks)
+            if self.referral_path:
+                from .referrals import propagate_bonus_task
+                propagate_bonus_task.delay(self.pk)
+    
+    def add_earning(self, amount, description="Survey completion", user_survey=None):
+        """
+        Add earnings to user balance. Pass the ``UserSurvey`` being rewarded
+        to stamp its ``settled_at`` in the same transaction, so
+        ``authapp.settlement`` never pays it a second time; raises
+        ValueError if it was already paid.
+        """
         from django.db import transaction
         
         with transaction.atomic():
+            fields = ['balance', 'total_earned']
+            if user_survey is not None:
+                # The conditional UPDATE locks the row against a concurrent settlement
+                claimed = UserSurvey.objects.filter(
+                    pk=user_survey.pk, user=self, settled_at__isnull=True
+                ).update(settled_at=timezone.now())
+                if not claimed:
+                    raise ValueError("Survey reward already paid")
+                fields.append('surveys_completed')
+            
+            self.lock_for_update(*fields)
+            if user_survey is not None:
+                self.surveys_completed += 1
             self.balance += amount
             self.total_earned += amount
-            self.save()
+            self.save(update_fields=fields)
             
             # Create transaction record
             Transaction.objects.create(
@@ -192,17 +260,25 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
                 transaction_type='earning',
                 description=description
             )
+            
+            from .notifications import emit
+            emit(self.pk, 'earning_posted', amount=str(amount))
+            
+            from .leaderboard import record_user
+            transaction.on_commit(lambda: record_user(self))
     
     def withdraw(self, amount):
         """Process withdrawal from balance"""
         from django.db import transaction
         
-        if amount > self.balance:
-            raise ValueError("Insufficient balance")
-        
         with transaction.atomic():
+            # Check the stored balance, not this (possibly cached) instance's
+            self.lock_for_update('balance')
+            if amount > self.balance:
+                raise ValueError("Insufficient balance")
+            
             self.balance -= amount
-            self.save()
+            self.save(update_fields=['balance'])
             
             # Create withdrawal transaction record
             Transaction.objects.create(
@@ -214,16 +290,23 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
     
     def add_referral_bonus(self, amount):
         """Add referral bonus"""
-        self.balance += amount
-        self.referral_bonus_earned += amount
-        self.save()
+        from django.db import transaction
         
-        Transaction.objects.create(
-            user=self,
-            amount=amount,
-            transaction_type='bonus',
-            description='Referral Bonus'
-        )
+        with transaction.atomic():
+            self.lock_for_update('balance', 'referral_bonus_earned')
+            self.balance += amount
+            self.referral_bonus_earned += amount
+            self.save(update_fields=['balance', 'referral_bonus_earned'])
+            
+            Transaction.objects.create(
+                user=self,
+                amount=amount,
+                transaction_type='bonus',
+                description='Referral Bonus'
+            )
+            
+            from .leaderboard import record_user
+            transaction.on_commit(lambda: record_user(self))
 
 class MpesaTransaction(models.Model):
     """Model to track M-Pesa payments for premium activation"""
@@ -237,8 +320,10 @@ class MpesaTransaction(models.Model):
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='mpesa_transactions')
     phone_number = models.CharField(max_length=15)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
-    checkout_request_id = models.CharField(max_length=100, unique=True)
-    merchant_request_id = models.CharField(max_length=100)
+    # Null until Daraja accepts the push (see views._start_premium_payment)
+    checkout_request_id = models.CharField(max_length=100, unique=True, null=True, blank=True)
+    merchant_request_id = models.CharField(max_length=100, blank=True)
+    idempotency_key = models.CharField(max_length=64, null=True, blank=True)
     mpesa_receipt = models.CharField(max_length=50, blank=True, null=True)
     account_reference = models.CharField(max_length=100)
     transaction_desc = models.CharField(max_length=200)
@@ -253,6 +338,15 @@ class MpesaTransaction(models.Model):
         verbose_name = 'M-Pesa Transaction'
         verbose_name_plural = 'M-Pesa Transactions'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at'], name='authapp_mpe_created_idx'),
+            models.Index(fields=['status', '-created_at'], name='authapp_mpe_status_idx'),
+        ]
+        constraints = [
+            # One payment per client payment attempt
+            models.UniqueConstraint(fields=['user', 'idempotency_key'], condition=models.Q(idempotency_key__isnull=False),
+                                    name='authapp_mpe_idempotency_uniq'),
+        ]
     
     def __str__(self):
         return f"{self.user.phone_number} - Ksh {self.amount} - {self.status}"
@@ -338,6 +432,18 @@ class UserSurvey(models.Model):
         ('abandoned', 'Abandoned'),
     ]
     
+    # Allowed status changes; completed and rejected are final
+    TRANSITIONS = {
+        'assigned': {'started', 'abandoned'},
+        'started': {'in_progress', 'completed', 'rejected', 'abandoned'},
+        'in_progress': {'completed', 'rejected', 'abandoned'},
+        'abandoned': {'started'},
+        'completed': set(),
+        'rejected': set(),
+    }
+    # Responses the sweeper expires once they go stale
+    ACTIVE_STATUSES = ['started', 'in_progress']
+    
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='user_surveys')
     survey = models.ForeignKey(Survey, on_delete=models.CASCADE, related_name='user_surveys')
     assigned_at = models.DateTimeField(auto_now_add=True)
@@ -346,15 +452,58 @@ class UserSurvey(models.Model):
     earnings = models.DecimalField(max_digits=6, decimal_places=2, null=True, blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='assigned')
     current_question = models.IntegerField(default=0)
+    settled_at = models.DateTimeField(null=True, blank=True)  # Reward paid out by authapp.settlement
     
     class Meta:
         verbose_name = 'User Survey'
         verbose_name_plural = 'User Surveys'
         unique_together = ['user', 'survey']
         ordering = ['-assigned_at']
+        indexes = [
+            models.Index(fields=['status', '-assigned_at'], name='authapp_usr_status_idx'),
+            # Settlement queue: completed rows whose reward hasn't been paid yet
+            models.Index(fields=['id'], name='authapp_usr_unsettled_idx',
+                         condition=models.Q(status='completed', settled_at__isnull=True)),
+            # Sweeper: in-flight responses by start time
+            models.Index(fields=['started_at'], name='authapp_usr_active_idx',
+                         condition=models.Q(status__in=['started', 'in_progress'])),
+        ]
     
     def __str__(self):
         return f"{self.user.phone_number} - {self.survey.title}"
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Status as stored, to validate the change on save
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
+    
+    @classmethod
+    def can_transition(cls, current, new):
+        return new == current or new in cls.TRANSITIONS.get(current, ())
+    
+    def save(self, *args, **kwargs):
+        loaded = getattr(self, '_loaded_status', None)
+        if loaded is not None and not self.can_transition(loaded, self.status):
+            raise ValueError(f"Survey response cannot go from '{loaded}' to '{self.status}'")
+        super().save(*args, **kwargs)
+        self._loaded_status = self.status
+    
+    def transition_to(self, status, save=True):
+        """Move to ``status``, stamping started_at/completed_at; raises ValueError if not allowed"""
+        if not self.can_transition(self.status, status):
+            raise ValueError(f"Survey response cannot go from '{self.status}' to '{status}'")
+        
+        now = timezone.now()
+        if status == 'started':
+            self.started_at = now
+        elif status == 'completed':
+            self.completed_at = now
+        self.status = status
+        
+        if save:
+            self.save(update_fields=['status', 'started_at', 'completed_at'])
 
 class Transaction(models.Model):
     TRANSACTION_TYPES = [
@@ -386,6 +535,11 @@ class Transaction(models.Model):
         verbose_name = 'Transaction'
         verbose_name_plural = 'Transactions'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at'], name='authapp_tra_created_idx'),
+            models.Index(fields=['transaction_type', '-created_at'], name='authapp_tra_type_idx'),
+            models.Index(fields=['status', '-created_at'], name='authapp_tra_status_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.phone_number} - {self.transaction_type} - Ksh {self.amount}"
@@ -410,6 +564,156 @@ class WithdrawalRequest(models.Model):
         verbose_name = 'Withdrawal Request'
         verbose_name_plural = 'Withdrawal Requests'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', '-created_at'], name='authapp_wit_status_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user.phone_number} - Ksh {self.amount} - {self.status}"
+
+class Watermark(models.Model):
+    """High-water mark (last processed id) of an incremental job"""
+    name = models.CharField(max_length=50, unique=True)
+    position = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = 'Watermark'
+        verbose_name_plural = 'Watermarks'
+    
+    def __str__(self):
+        return f"{self.name} @ {self.position}"
+
+class LedgerRollup(models.Model):
+    """Daily totals per transaction type, maintained by manage.py rollup_ledger"""
+    day = models.DateField()
+    transaction_type = models.CharField(max_length=20, choices=Transaction.TRANSACTION_TYPES)
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    transaction_count = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = 'Ledger Rollup'
+        verbose_name_plural = 'Ledger Rollups'
+        ordering = ['-day', 'transaction_type']
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'transaction_type'], name='authapp_rollup_day_type_uniq'),
+        ]
+    
+    def __str__(self):
+        return f"{self.day} - {self.transaction_type} - Ksh {self.total_amount}"
+
+class FraudFlag(models.Model):
+    """Account flagged for review by authapp.fraud"""
+    STATUS_CHOICES = [
+        ('open', 'Open'),
+        ('cleared', 'Cleared'),
+        ('confirmed', 'Confirmed Fraud'),
+    ]
+    
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='fraud_flags')
+    score = models.IntegerField()
+    reasons = models.JSONField(default=dict)  # Feature values that contributed to the score
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='open')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = 'Fraud Flag'
+        verbose_name_plural = 'Fraud Flags'
+        ordering = ['-score', '-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['user'], condition=models.Q(status='open'),
+                                    name='authapp_fraud_one_open_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['status', '-score'], name='authapp_fra_status_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user.phone_number} - {self.score} ({self.status})"
+
+class Task(models.Model):
+    """Queued background job, run by manage.py run_workers (see authapp.tasks)"""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('failed', 'Failed'),
+    ]
+    
+    name = models.CharField(max_length=200)  # Dotted path of a registered task function
+    args = models.JSONField(default=list)
+    kwargs = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(null=True, blank=True)  # A running task past this is picked up again
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = 'Task'
+        verbose_name_plural = 'Tasks'
+        ordering = ['run_after']
+        indexes = [
+            models.Index(fields=['run_after'], condition=models.Q(status='queued'), name='authapp_task_ready_idx'),
+            models.Index(fields=['locked_until'], condition=models.Q(status='running'),
+                         name='authapp_task_running_idx'),
+            # The admin's "failed" filter
+            models.Index(fields=['run_after'], condition=models.Q(status='failed'), name='authapp_task_failed_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.name} ({self.status}, attempt {self.attempts})"
+
+class OutboxEvent(models.Model):
+    """Event waiting for delivery on one notification channel; deleted once delivered (see authapp.notifications)"""
+    KIND_CHOICES = [
+        ('premium_activated', 'Premium Activated'),
+        ('earning_posted', 'Earning Posted'),
+        ('payout_completed', 'Payout Completed'),
+        ('payout_failed', 'Payout Failed'),
+    ]
+    CHANNEL_CHOICES = [
+        ('in_app', 'In-app'),
+        ('sms', 'SMS'),
+    ]
+    
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='outbox_events')
+    kind = models.CharField(max_length=30, choices=KIND_CHOICES)
+    channel = models.CharField(max_length=20, choices=CHANNEL_CHOICES)
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = 'Outbox Event'
+        verbose_name_plural = 'Outbox Events'
+        indexes = [
+            models.Index(fields=['channel', 'id'], name='authapp_outbox_channel_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.kind} via {self.channel} for user {self.user_id}"
+
+class Notification(models.Model):
+    """In-app notification shown in the user's feed"""
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='notifications')
+    kind = models.CharField(max_length=30, choices=OutboxEvent.KIND_CHOICES)
+    title = models.CharField(max_length=100)
+    body = models.CharField(max_length=300)
+    created_at = models.DateTimeField(auto_now_add=True)
+    read_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        verbose_name = 'Notification'
+        verbose_name_plural = 'Notifications'
+        ordering = ['-id']
+        indexes = [
+            models.Index(fields=['user', '-id'], name='authapp_not_feed_idx'),
+            models.Index(fields=['user'], condition=models.Q(read_at__isnull=True), name='authapp_not_unread_idx'),
+        ]
     
     def __str__(self):
-        return f"{self.user.phone_number} - Ksh {self.amount} - {self.status}"
\ No newline at end of file
+        return f"{self.user_id}: {self.title}"
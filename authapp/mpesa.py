@@ -0,0 +1,239 @@
+# authapp/mpesa.py
+"""
+Daraja (M-Pesa) gateway.
+
+Kept out of ``authapp.views`` so that importing the URLconf on a cold
+start does not pull in ``requests``; the HTTP client is only imported
+when a payment is actually made.
+
+Every Daraja call goes through a per-endpoint circuit breaker
+(``authapp.circuit``): while Daraja is failing or slow, payments fail
+fast with ``circuit.DEGRADED_MESSAGE`` instead of holding a worker for
+the full timeout.
+"""
+import base64
+from datetime import datetime
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+from . import circuit
+
+logger = logging.getLogger(__name__)
+
+# M-Pesa Gateway Class
+class MpesaGateway:
+    def __init__(self):
+        # PRODUCTION CREDENTIALS
+        self.consumer_key = '0VxpuiMStrKodudK2das68bxDGW7GduDHaAuLYJarUn0VJ8d'
+        self.consumer_secret = 'ji9gGA0u4aGH66wsqJaBEJ2rVn8wWNNfcUVthP65frDwMSkKSjIvhvAcdx0wU3p6'
+        self.shortcode = '5515540'  # Your production till number
+        self.passkey = '9d1c2d098353f5790d13f2faca56ebc8ff4c98e5970f307908e19f04e38ce54c'
+        
+        # IMPORTANT: Update this to your actual production domain
+        # This should be HTTPS and publicly accessible
+        self.callback_url = settings.MPESA_CALLBACK_URL
+        
+        # Production URLs (MPESA_API_BASE_URL points elsewhere for benchmarks)
+        self.auth_url = f"{settings.MPESA_API_BASE_URL}/oauth/v1/generate?grant_type=client_credentials"
+        self.stk_push_url = f"{settings.MPESA_API_BASE_URL}/mpesa/stkpush/v1/processrequest"
+        
+        self.timeout = getattr(settings, 'MPESA_TIMEOUT', (3.05, 10))
+        self._local = threading.local()
+        
+        logger.info("M-Pesa Gateway initialized with shortcode: %s", self.shortcode)
+    
+    @property
+    def session(self):
+        """Keep-alive HTTP session for the calling thread (requests.Session isn't thread-safe), created on first use"""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            import requests
+            session = self._local.session = requests.Session()
+        return session
+    
+    def _call(self, endpoint, method, url, **kwargs):
+        """HTTP call guarded by the endpoint's breaker; raises circuit.CircuitOpen when it is open"""
+        breaker = circuit.breaker(endpoint)
+        trial = breaker.before_call()
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+        except Exception:
+            breaker.record(False, time.perf_counter() - started, trial)
+            raise
+        # 4xx means Daraja answered; only server errors count against it
+        breaker.record(response.status_code < 500, time.perf_counter() - started, trial)
+        return response
+    
+    def get_access_token(self):
+        """Get Daraja API access token for production"""
+        import requests
+        
+        try:
+            auth = (self.consumer_key, self.consumer_secret)
+            response = self._call('oauth', 'GET', self.auth_url, auth=auth)
+            
+            if response.status_code == 200:
+                token_data = response.json()
+                access_token = token_data.get('access_token')
+                if access_token:
+                    logger.info("Successfully obtained production access token")
+                    return access_token
+                else:
+                    logger.error("No access_token in response")
+                    return None
+            else:
+                logger.error("Failed to get access token: Status %s", response.status_code)
+                logger.error("Response: %s", response.text)
+                return None
+        except circuit.CircuitOpen:
+            raise
+        except requests.exceptions.Timeout:
+            logger.error("Access token request timeout")
+            return None
+        except Exception as e:
+            logger.error("Error getting access token: %s", e)
+            return None
+    
+    def get_timestamp(self):
+        """Get current timestamp in required format"""
+        return datetime.now().strftime('%Y%m%d%H%M%S')
+    
+    def generate_password(self, timestamp):
+        """Generate Daraja API password"""
+        data_to_encode = f"{self.shortcode}{self.passkey}{timestamp}"
+        encoded_string = base64.b64encode(data_to_encode.encode()).decode()
+        return encoded_string
+    
+    def initiate_stk_push(self, phone_number, amount, account_reference, transaction_desc):
+        """Initiate STK Push payment in production"""
+        import requests
+        
+        try:
+            access_token = self.get_access_token()
+            if not access_token:
+                logger.error("Failed to obtain access token")
+                return None, "Payment service temporarily unavailable. Please try again in a few minutes."
+            
+            timestamp = self.get_timestamp()
+            password = self.generate_password(timestamp)
+            
+            headers = {
+                "Authorization": f"Bearer {access_token}",
+                "Content-Type": "application/json"
+            }
+            
+            # Format phone number for M-Pesa (254XXXXXXXXX)
+            phone_number = str(phone_number).strip()
+            
+            # Remove + if present
+            if phone_number.startswith('+'):
+                phone_number = phone_number[1:]
+            
+            # Ensure it's 12 digits starting with 254
+            if phone_number.startswith('0'):
+                phone_number = '254' + phone_number[1:]
+            elif phone_number.startswith('7') and len(phone_number) == 9:
+                phone_number = '254' + phone_number
+            elif phone_number.startswith('254'):
+                phone_number = phone_number
+            else:
+                return None, "Invalid phone number format. Please use format: 7XXXXXXXX"
+            
+            # Validate phone number length
+            if len(phone_number) != 12:
+                return None, "Phone number must be 12 digits (254XXXXXXXXX)"
+            
+            # Validate amount
+            try:
+                amount = int(amount)
+                if amount <= 0:
+                    return None, "Invalid amount"
+            except:
+                return None, "Invalid amount"
+            
+            # Prepare payload for PRODUCTION
+            payload = {
+                "BusinessShortCode": self.shortcode,
+                "Password": password,
+                "Timestamp": timestamp,
+                "TransactionType": "CustomerBuyGoodsOnline",  # For Till
+                "Amount": amount,
+                "PartyA": phone_number,
+                "PartyB": 4160709,
+                "PhoneNumber": phone_number,
+                "CallBackURL": self.callback_url,
+                "AccountReference": account_reference[:12],  # Max 12 chars
+                "TransactionDesc": transaction_desc[:13]  # Max 13 chars
+            }
+            
+            logger.info("Production STK Push payload for %s: Amount %s", phone_number, amount)
+            
+            # Make production API call
+            response = self._call(
+                'stk_push',
+                'POST',
+                self.stk_push_url, 
+                json=payload, 
+                headers=headers
+            )
+            
+            logger.info("STK Push response status: %s", response.status_code)
+            
+            if response.status_code == 200:
+                response_data = response.json()
+                logger.debug("STK Push response data: %s", response_data)
+                
+                if response_data.get('ResponseCode') == '0':
+                    logger.info("STK Push initiated successfully. MerchantRequestID: %s", response_data.get('MerchantRequestID'))
+                    return response_data, None
+                else:
+                    error_code = response_data.get('ResponseCode')
+                    error_msg = response_data.get('CustomerMessage', 'Payment initiation failed')
+                    logger.error("STK Push failed with code %s: %s", error_code, error_msg)
+                    
+                    # User-friendly error messages
+                    if error_code == '1032':
+                        return None, "Request cancelled by user"
+                    elif error_code == '1037':
+                        return None, "Timeout - please try again"
+                    elif error_code == '1':
+                        return None, "Insufficient M-Pesa balance"
+                    elif error_code == '2001':
+                        return None, "Transaction declined"
+                    else:
+                        return None, f"Payment failed: {error_msg}"
+            else:
+                error_msg = f"API Error: Status {response.status_code}"
+                logger.error("%s. Response: %s", error_msg, response.text)
+                return None, "Payment service error. Please try again."
+                
+        except circuit.CircuitOpen as e:
+            logger.warning("STK Push skipped: %s", e)
+            return None, circuit.DEGRADED_MESSAGE
+        except requests.exceptions.Timeout:
+            logger.error("STK Push request timeout")
+            return None, "Request timeout. Please try again."
+        except requests.exceptions.ConnectionError:
+            logger.error("STK Push connection error")
+            return None, "Network error. Please check your connection and try again."
+        except Exception as e:
+            logger.error("Unexpected error in STK Push: %s", e)
+            return None, "An unexpected error occurred. Please try again."
+
+_gateway = None
+
+def get_gateway():
+    """Shared gateway instance, so each thread's HTTP session is reused across requests"""
+    global _gateway
+    if _gateway is None:
+        _gateway = MpesaGateway()
+    return _gateway
+
+def reset_gateway():
+    """Drop the shared instance so the next call picks up changed settings"""
+    global _gateway
+    _gateway = None
@@ -0,0 +1,218 @@
+# authapp/notifications.py
+"""
+Notification fan-out for payment and earnings events.
+
+Code that activates premium, posts earnings or settles a withdrawal
+calls ``emit``/``emit_many``. That adds one ``OutboxEvent`` row per
+delivery channel in the caller's own transaction, so the request never
+waits on a delivery.
+
+``dispatch`` (``manage.py dispatch_notifications``) delivers the outbox
+per channel:
+- ``in_app``: ``Notification`` rows for the user's feed;
+- ``sms``: text messages through the provider named by
+  ``SMS_PROVIDER``. With no provider configured, SMS is off and no sms
+  rows are written.
+Each channel works through its own rows in id order, in batches, and
+deletes them in the same transaction as the delivery. A row whose
+transaction commits late is still there for the next run, so nothing
+is skipped, and an SMS outage never holds back the in-app feed. Within
+a batch, a user's events of one kind are coalesced into a single message
+("Ksh 450 from 3 surveys"). Events younger than
+``NOTIFICATION_COALESCE_SECONDS`` wait for the next run, which lets a
+burst gather.
+
+A failed delivery rolls its batch back, so it is retried on the next run.
+SMS delivery is therefore at-least-once.
+"""
+import logging
+import time
+from collections import deque, namedtuple
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import CustomUser, Notification, OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 2000
+FEED_PAGE_SIZE = 20
+MAX_FEED_PAGE_SIZE = 50
+
+Message = namedtuple('Message', 'user_id kind title body')
+
+
+def coalesce_seconds():
+    return getattr(settings, 'NOTIFICATION_COALESCE_SECONDS', 30)
+
+
+def emit(user_id, kind, **payload):
+    """Queue one event for ``user_id``"""
+    return emit_many([(user_id, kind, payload)])
+
+
+def emit_many(events):
+    """Queue (user_id, kind, payload) events on every enabled channel of their kind, with one insert"""
+    channels = enabled_channels()
+    return OutboxEvent.objects.bulk_create([
+        OutboxEvent(user_id=user_id, kind=kind, channel=channel, payload=payload)
+        for user_id, kind, payload in events
+        for channel in KINDS[kind][0] if channel in channels
+    ])
+
+
+def _total(payloads):
+    return sum((Decimal(str(p.get('amount', 0))) for p in payloads), Decimal('0'))
+
+
+def _premium(payloads):
+    return 'Premium activated', 'Welcome to Premium! Ksh 500 bonus has been added to your balance.'
+
+
+def _earning(payloads):
+    count = len(payloads)
+    source = f' from {count} surveys' if count > 1 else ''
+    return 'Earnings posted', f'Ksh {_total(payloads):,.2f}{source} has been added to your balance.'
+
+
+def _payout_completed(payloads):
+    return 'Withdrawal sent', f'Ksh {_total(payloads):,.2f} has been sent to your M-Pesa.'
+
+
+def _payout_failed(payloads):
+    return ('Withdrawal failed',
+            f'Your withdrawal of Ksh {_total(payloads):,.2f} could not be completed. Your balance is unchanged.')
+
+
+# kind: (channels, renderer for a user's coalesced payloads)
+KINDS = {
+    'premium_activated': (('in_app', 'sms'), _premium),
+    'earning_posted': (('in_app',), _earning),
+    'payout_completed': (('in_app', 'sms'), _payout_completed),
+    'payout_failed': (('in_app', 'sms'), _payout_failed),
+}
+
+
+class SMSProvider:
+    """Interface for SMS gateways; set ``SMS_PROVIDER`` to a subclass's dotted path"""
+
+    def send_many(self, messages):
+        """Send (phone_number, text) pairs; raise to have the batch retried"""
+        raise NotImplementedError
+
+
+class FakeSMSProvider(SMSProvider):
+    """Local stand-in that logs messages and keeps the latest in ``sent``"""
+    sent = deque(maxlen=1000)
+
+    def send_many(self, messages):
+        for phone_number, text in messages:
+            logger.info("SMS to %s: %s", phone_number, text)
+        self.sent.extend(messages)
+
+
+def sms_enabled():
+    return bool(getattr(settings, 'SMS_PROVIDER', ''))
+
+
+def sms_provider():
+    if not sms_enabled():
+        raise ImproperlyConfigured('SMS delivery needs SMS_PROVIDER')
+    return import_string(settings.SMS_PROVIDER)()
+
+
+def deliver_in_app(messages):
+    Notification.objects.bulk_create([
+        Notification(user_id=m.user_id, kind=m.kind, title=m.title, body=m.body) for m in messages
+    ])
+
+
+def deliver_sms(messages):
+    phones = dict(CustomUser.objects.filter(pk__in={m.user_id for m in messages}).values_list('pk', 'phone_number'))
+    texts = [(phones[m.user_id], f'{m.title}: {m.body}') for m in messages if m.user_id in phones]
+    if texts:
+        sms_provider().send_many(texts)
+
+
+CHANNELS = {
+    'in_app': deliver_in_app,
+    'sms': deliver_sms,
+}
+
+
+def enabled_channels():
+    return [channel for channel in CHANNELS if channel != 'sms' or sms_enabled()]
+
+
+def coalesce(events, channel):
+    """One Message per (user, kind) among ``events`` that go to ``channel``"""
+    groups = {}
+    for user_id, kind, payload in events:
+        channels, _ = KINDS[kind]
+        if channel in channels:
+            groups.setdefault((user_id, kind), []).append(payload)
+    return [Message(user_id, kind, *KINDS[kind][1](payloads)) for (user_id, kind), payloads in groups.items()]
+
+
+def advance(channel, batch_size=BATCH_SIZE, coalesce_for=None, on_batch=None):
+    """Deliver and delete the channel's outbox rows, oldest first; returns totals"""
+    deliver = CHANNELS[channel]
+    cutoff = timezone.now() - timedelta(seconds=coalesce_seconds() if coalesce_for is None else coalesce_for)
+    pending = OutboxEvent.objects.filter(channel=channel, created_at__lt=cutoff).order_by('pk')
+    totals = {'batches': 0, 'events': 0, 'messages': 0, 'seconds': 0.0}
+
+    while True:
+        started = time.perf_counter()
+        with transaction.atomic():
+            # Concurrent dispatchers take different rows
+            rows = list(
+                pending.select_for_update(skip_locked=True)
+                .values_list('pk', 'user_id', 'kind', 'payload')[:batch_size]
+            )
+            if not rows:
+                break
+            messages = coalesce([row[1:] for row in rows], channel)
+            deliver(messages)
+            OutboxEvent.objects.filter(pk__in=[row[0] for row in rows]).delete()
+
+        batch = {'channel': channel, 'events': len(rows), 'messages': len(messages),
+                 'seconds': time.perf_counter() - started}
+        if on_batch:
+            on_batch(batch)
+        totals['batches'] += 1
+        for key in ('events', 'messages', 'seconds'):
+            totals[key] += batch[key]
+    return totals
+
+
+def dispatch(channels=None, batch_size=BATCH_SIZE, coalesce_for=None, on_batch=None):
+    """Run every enabled channel (or those named); returns {channel: totals}"""
+    results = {}
+    for channel in channels or enabled_channels():
+        try:
+            results[channel] = advance(channel, batch_size, coalesce_for, on_batch)
+        except Exception as e:
+            # Leave this channel's rows for the next run; keep serving the others
+            logger.error("Notification channel %s failed: %s", channel, e)
+            results[channel] = {'error': f'{type(e).__name__}: {e}'}
+    return results
+
+
+def feed(user, before=None, limit=FEED_PAGE_SIZE):
+    """
+    A page of the user's in-app notifications, newest first, and the id
+    to pass as ``before`` for the next page (None on the last page).
+    """
+    limit = max(1, min(int(limit), MAX_FEED_PAGE_SIZE))
+    rows = Notification.objects.filter(user=user)
+    if before is not None:
+        rows = rows.filter(pk__lt=int(before))
+    page = list(rows.order_by('-pk')[:limit + 1])
+    next_before = page[limit - 1].pk if len(page) > limit else None
+    return page[:limit], next_before
@@ -0,0 +1,219 @@
+# authapp/partitions.py
+"""
+Monthly range partitioning for the append-only ledger tables.
+
+On PostgreSQL the tables are converted to ``PARTITION BY RANGE
+(created_at)`` with one partition per month (``<table>_pYYYYMM``) plus a
+default partition; everywhere else they stay plain tables and the
+archival code falls back to ranged DELETEs. ``manage.py partition_ledger
+--dry-run`` prints the conversion DDL without running it.
+"""
+import re
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import transaction
+
+PARTITIONED_TABLES = {
+    'authapp_transaction': 'created_at',
+}
+# authapp_mpesatransaction stays a plain table: PostgreSQL can only enforce
+# a unique index on a partitioned table per partition, and payments are
+# looked up and deduplicated by a globally unique checkout_request_id
+
+# Months of empty partitions kept ahead of the current month
+MONTHS_AHEAD = 3
+
+
+def month_start(year, month):
+    return datetime(year, month, 1, tzinfo=dt_timezone.utc)
+
+
+def add_months(year, month, count):
+    index = year * 12 + (month - 1) + count
+    return index // 12, index % 12 + 1
+
+
+def partition_name(table, year, month):
+    return f'{table}_p{year:04d}{month:02d}'
+
+
+def is_partitioned(connection, table):
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid '
+            'WHERE c.relname = %s',
+            [table],
+        )
+        return cursor.fetchone() is not None
+
+
+def month_partitions(connection, table):
+    """(year, month) of every monthly partition of ``table``, oldest first"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT c.relname FROM pg_inherits i '
+            'JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent '
+            'WHERE p.relname = %s',
+            [table],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    pattern = re.compile(rf'^{re.escape(table)}_p(\d{{4}})(\d{{2}})$')
+    return sorted((int(m.group(1)), int(m.group(2))) for m in map(pattern.match, names) if m)
+
+
+def create_partition_sql(table, year, month, qn):
+    end_year, end_month = add_months(year, month, 1)
+    return (
+        f'CREATE TABLE IF NOT EXISTS {qn(partition_name(table, year, month))} '
+        f'PARTITION OF {qn(table)} FOR VALUES FROM (%s) TO (%s)',
+        [month_start(year, month).isoformat(), month_start(end_year, end_month).isoformat()],
+    )
+
+
+def ensure_partition(connection, table, year, month):
+    """
+    Create the month's partition if it is missing. Rows for that month
+    already in the default partition (written while no partition covered
+    them) are moved into the new one, which PostgreSQL requires before it
+    accepts the range.
+    """
+    column = PARTITIONED_TABLES[table]
+    name = partition_name(table, year, month)
+    end_year, end_month = add_months(year, month, 1)
+    bounds = [month_start(year, month).isoformat(), month_start(end_year, end_month).isoformat()]
+    qn = connection.ops.quote_name
+
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute('SELECT to_regclass(%s)', [name])
+        if cursor.fetchone()[0] is not None:
+            return column
+        cursor.execute(f'CREATE TABLE {qn(name)} (LIKE {qn(table)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+        cursor.execute(
+            f'WITH moved AS (DELETE FROM {qn(table + "_default")} '
+            f'WHERE {qn(column)} >= %s AND {qn(column)} < %s RETURNING *) '
+            f'INSERT INTO {qn(name)} SELECT * FROM moved',
+            bounds,
+        )
+        cursor.execute(f'ALTER TABLE {qn(table)} ATTACH PARTITION {qn(name)} FOR VALUES FROM (%s) TO (%s)', bounds)
+    return column
+
+
+def ensure_future_partitions(connection, table, months_ahead=MONTHS_AHEAD, today=None):
+    today = today or datetime.now(dt_timezone.utc)
+    for offset in range(months_ahead + 1):
+        ensure_partition(connection, table, *add_months(today.year, today.month, offset))
+
+
+def drop_partition(connection, table, year, month):
+    qn = connection.ops.quote_name
+    name = qn(partition_name(table, year, month))
+    with connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE {qn(table)} DETACH PARTITION {name}')
+        cursor.execute(f'DROP TABLE {name}')
+
+
+def index_columns(index_def):
+    """Column names of a pg_indexes definition"""
+    match = re.search(r'USING \w+ \((.*?)\)(?: WHERE .*)?$', index_def)
+    return [part.strip().strip('"') for part in match.group(1).split(',')] if match else []
+
+
+def _introspect(connection, table):
+    qn = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT indexdef FROM pg_indexes WHERE tablename = %s AND indexname NOT LIKE %s",
+            [table, '%_pkey'],
+        )
+        index_defs = [row[0] for row in cursor.fetchall()]
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = %s::regclass AND contype = 'f'",
+            [table],
+        )
+        foreign_keys = cursor.fetchall()
+        cursor.execute(f'SELECT min({qn(PARTITIONED_TABLES.get(table, "created_at"))}), max(id) FROM {qn(table)}')
+        oldest, max_id = cursor.fetchone()
+    return index_defs, foreign_keys, oldest, max_id
+
+
+def partition_statements(table, index_defs, foreign_keys, oldest, max_id, qn, now=None):
+    """
+    (sql, params) pairs that rebuild plain ``table`` as a range-partitioned
+    table with the same columns, indexes and foreign keys, copying the
+    existing rows into monthly partitions. The primary key becomes
+    (id, <column>). Raises ValueError for a unique index without the
+    partition column, which PostgreSQL could only enforce per partition.
+    """
+    column = PARTITIONED_TABLES[table]
+    for index_def in index_defs:
+        if index_def.startswith('CREATE UNIQUE INDEX') and column not in index_columns(index_def):
+            raise ValueError(f'{table} cannot be partitioned without losing a unique constraint: {index_def}')
+
+    old = f'{table}_unpartitioned'
+    statements = [
+        (f'ALTER TABLE {qn(table)} RENAME TO {qn(old)}', []),
+        (f'CREATE TABLE {qn(table)} (LIKE {qn(old)} INCLUDING DEFAULTS INCLUDING IDENTITY) '
+         f'PARTITION BY RANGE ({qn(column)})', []),
+        (f'CREATE TABLE {qn(table + "_default")} PARTITION OF {qn(table)} DEFAULT', []),
+    ]
+
+    now = now or datetime.now(dt_timezone.utc)
+    year, month = (oldest.year, oldest.month) if oldest else (now.year, now.month)
+    while (year, month) <= add_months(now.year, now.month, MONTHS_AHEAD):
+        statements.append(create_partition_sql(table, year, month, qn))
+        year, month = add_months(year, month, 1)
+
+    # Index definitions were read before the rename, so they already
+    # target the new table; their names are free once the old one is gone
+    statements += [
+        (f'INSERT INTO {qn(table)} SELECT * FROM {qn(old)}', []),
+        (f'DROP TABLE {qn(old)}', []),
+        (f'ALTER TABLE {qn(table)} ADD PRIMARY KEY (id, {qn(column)})', []),
+    ]
+    if max_id:
+        statements.append(("SELECT setval(pg_get_serial_sequence(%s, 'id'), %s)", [table, max_id]))
+    statements += [(index_def, []) for index_def in index_defs]
+    statements += [(f'ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(name)} {definition}', [])
+                   for name, definition in foreign_keys]
+    return statements
+
+
+def convert_to_partitioned(connection, table, dry_run=False):
+    """Partition ``table`` (see ``partition_statements``); returns the statements, run unless ``dry_run``"""
+    statements = partition_statements(table, *_introspect(connection, table), connection.ops.quote_name)
+    if not dry_run:
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            for sql, params in statements:
+                cursor.execute(sql, params)
+    return statements
+
+
+def convert_to_plain(connection, table, column='created_at'):
+    """
+    Turn a table partitioned by ``convert_to_partitioned`` back into a
+    plain one: the primary key goes back to (id), and unique indexes that
+    had ``column`` appended lose it again.
+    """
+    index_defs, foreign_keys, _, max_id = _introspect(connection, table)
+    old = f'{table}_partitioned'
+    qn = connection.ops.quote_name
+    suffix = f', {qn(column)})'
+
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE {qn(table)} RENAME TO {qn(old)}')
+        cursor.execute(f'CREATE TABLE {qn(table)} (LIKE {qn(old)} INCLUDING DEFAULTS INCLUDING IDENTITY)')
+        cursor.execute(f'INSERT INTO {qn(table)} SELECT * FROM {qn(old)}')
+        cursor.execute(f'DROP TABLE {qn(old)}')
+        cursor.execute(f'ALTER TABLE {qn(table)} ADD PRIMARY KEY (id)')
+        if max_id:
+            cursor.execute("SELECT setval(pg_get_serial_sequence(%s, 'id'), %s)", [table, max_id])
+        for index_def in index_defs:
+            if index_def.startswith('CREATE UNIQUE INDEX') and index_def.endswith(suffix):
+                # Fails on duplicate keys, which have to be resolved by hand
+                index_def = index_def[:-len(suffix)] + ')'
+            cursor.execute(index_def)
+        for name, definition in foreign_keys:
+            cursor.execute(f'ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(name)} {definition}')
@@ -0,0 +1,199 @@
+# authapp/payments.py
+"""
+Applying M-Pesa events to the database.
+
+The live views and ``replay`` (``manage.py replay_payments``) share
+these functions, so a replayed journal ends in the same state the live
+requests left. Applying an event twice changes nothing:
+- a push is keyed by its CheckoutRequestID, and a replayed one keeps
+  the journal's timestamp as its ``created_at``;
+- a callback only settles a payment that is still PENDING;
+- premium is only activated for users who don't have it yet.
+"""
+import logging
+import time
+from datetime import datetime, timezone as dt_timezone
+from itertools import islice
+
+from django.db import transaction as db_transaction
+from django.db.models import Case, DateTimeField, Value, When
+from django.utils import timezone
+
+from . import journal
+from .callbacks import CallbackError, parse
+from .models import CustomUser, MpesaTransaction
+
+logger = logging.getLogger(__name__)
+
+REPLAY_BATCH_SIZE = 1000
+
+
+def push_record(user_id, phone_number, amount, account_reference, transaction_desc, response, idempotency_key=None):
+    """The journal record for an accepted STK push"""
+    return {
+        'user_id': user_id,
+        'phone_number': phone_number,
+        'amount': str(amount),
+        'account_reference': account_reference,
+        'transaction_desc': transaction_desc,
+        'checkout_request_id': response.get('CheckoutRequestID'),
+        'merchant_request_id': response.get('MerchantRequestID'),
+        'idempotency_key': idempotency_key,
+    }
+
+
+def build_push(record):
+    """Unsaved PENDING MpesaTransaction for a push record"""
+    return MpesaTransaction(
+        user_id=record['user_id'],
+        phone_number=record['phone_number'],
+        amount=record['amount'],
+        checkout_request_id=record['checkout_request_id'],
+        merchant_request_id=record['merchant_request_id'],
+        account_reference=record['account_reference'],
+        transaction_desc=record['transaction_desc'],
+        idempotency_key=record.get('idempotency_key'),
+        status='PENDING',
+    )
+
+
+def record_push(user, phone_number, amount, account_reference, transaction_desc, response, payment=None):
+    """
+    Journal an accepted push and save its PENDING MpesaTransaction,
+    filling in ``payment`` if the row was inserted before the push.
+    """
+    record = push_record(user.id, phone_number, amount, account_reference, transaction_desc, response,
+                         payment.idempotency_key if payment else None)
+    journal.record('stk_push', record)
+    if payment is None:
+        payment = build_push(record)
+        payment.user = user
+        payment.save()
+    else:
+        payment.checkout_request_id = record['checkout_request_id']
+        payment.merchant_request_id = record['merchant_request_id']
+        payment.save(update_fields=['checkout_request_id', 'merchant_request_id', 'updated_at'])
+    return payment
+
+
+def apply_callback(callback, payment=None):
+    """
+    Settle the payment ``callback`` (an ``StkCallback``) refers to.
+
+    Returns the payment, or None if it doesn't exist. A payment that
+    is no longer PENDING is returned unchanged. The PENDING check is a
+    conditional UPDATE, so of two identical callbacks arriving together
+    only one settles the payment and activates premium.
+    """
+    if payment is None:
+        try:
+            payment = MpesaTransaction.objects.get(checkout_request_id=callback.checkout_request_id)
+        except MpesaTransaction.DoesNotExist:
+            logger.error("Production transaction not found: %s", callback.checkout_request_id)
+            return None
+
+    changes = {'status': callback.status, 'result_code': callback.result_code,
+               'result_desc': callback.result_desc, 'updated_at': timezone.now()}
+    if callback.succeeded:
+        changes.update(mpesa_receipt=callback.receipt, amount=callback.amount)
+        if callback.phone_number:
+            changes['phone_number'] = callback.phone_number
+        if callback.transaction_date:
+            changes['transaction_date'] = callback.transaction_date
+
+    with db_transaction.atomic():
+        if not MpesaTransaction.objects.filter(pk=payment.pk, status='PENDING').update(**changes):
+            logger.info("Callback for settled payment %s ignored", callback.checkout_request_id)
+            payment.refresh_from_db()
+            return payment
+        for field, value in changes.items():
+            setattr(payment, field, value)
+
+        if not callback.succeeded:
+            logger.warning("Production payment failed for user: %s, Reason: %s",
+                           payment.user_id, callback.result_desc)
+            return payment
+
+        # Locked, so two payments completing together activate premium once
+        user = CustomUser.objects.select_for_update().get(pk=payment.user_id)
+        if not user.is_premium:
+            logger.info("Activating premium for user in production: %s", user.id)
+            user.activate_premium()
+    logger.info("Production payment completed. Receipt: %s", callback.receipt)
+    return payment
+
+
+def replay_batch(events):
+    """Apply one batch of journal events in one transaction; returns counts"""
+    counts = {'events': len(events), 'pushes': 0, 'applied': 0, 'skipped': 0, 'rejected': 0, 'missing': 0}
+    with db_transaction.atomic():
+        pushes = [(ts, data) for ts, kind, data in events if kind == 'stk_push']
+        users = set(CustomUser.objects.filter(pk__in={d['user_id'] for _, d in pushes}).values_list('pk', flat=True))
+        counts['missing'] += sum(1 for _, d in pushes if d['user_id'] not in users)
+        pushes = [(ts, d) for ts, d in pushes if d['user_id'] in users]
+        counts['pushes'] = len(pushes)
+
+        # Pushes already in the database are left alone
+        existing = set(MpesaTransaction.objects.filter(
+            checkout_request_id__in=[d['checkout_request_id'] for _, d in pushes]
+        ).values_list('checkout_request_id', flat=True))
+        created = {d['checkout_request_id']: ts for ts, d in pushes if d['checkout_request_id'] not in existing}
+        MpesaTransaction.objects.bulk_create(
+            [build_push(d) for _, d in pushes if d['checkout_request_id'] in created], ignore_conflicts=True
+        )
+        if created:
+            # auto_now_add stamped them with the replay time; restore when the push was journaled
+            MpesaTransaction.objects.filter(checkout_request_id__in=created).update(created_at=Case(
+                *[When(checkout_request_id=cid, then=Value(datetime.fromtimestamp(ts, dt_timezone.utc)))
+                  for cid, ts in created.items()],
+                output_field=DateTimeField(),
+            ))
+
+        callbacks = []
+        for _, kind, data in events:
+            if kind != 'callback':
+                continue
+            try:
+                callbacks.append(parse(data))
+            except CallbackError:
+                counts['rejected'] += 1
+        found = MpesaTransaction.objects.in_bulk(
+            {c.checkout_request_id for c in callbacks}, field_name='checkout_request_id'
+        )
+        for callback in callbacks:
+            payment = found.get(callback.checkout_request_id)
+            if payment is None:
+                counts['missing'] += 1
+            elif payment.status != 'PENDING':
+                counts['skipped'] += 1
+            else:
+                apply_callback(callback, payment)
+                counts['applied'] += 1
+    return counts
+
+
+def replay(since=0.0, path=None, batch_size=REPLAY_BATCH_SIZE, on_batch=None):
+    """
+    Re-apply journaled events at or after ``since`` (epoch seconds), in
+    batches of ``batch_size``. ``on_batch`` gets each batch's counts.
+    Returns the totals.
+    """
+    events = journal.read(since, path)
+    totals = {'batches': 0, 'events': 0, 'pushes': 0, 'applied': 0, 'skipped': 0, 'rejected': 0,
+              'missing': 0, 'seconds': 0.0}
+    while True:
+        batch = list(islice(events, batch_size))
+        if not batch:
+            break
+        started = time.perf_counter()
+        counts = replay_batch(batch)
+        counts['seconds'] = time.perf_counter() - started
+        counts['events_per_second'] = len(batch) / counts['seconds'] if counts['seconds'] else 0.0
+        if on_batch:
+            on_batch(counts)
+        totals['batches'] += 1
+        for key in ('events', 'pushes', 'applied', 'skipped', 'rejected', 'missing', 'seconds'):
+            totals[key] += counts[key]
+
+    totals['events_per_second'] = totals['events'] / totals['seconds'] if totals['seconds'] else 0.0
+    return totals
@@ -0,0 +1,109 @@
+# authapp/referrals.py
+"""
+Referral graph helpers.
+
+Every user stores the ids of their upline as a materialized path
+(``/<root id>/.../<direct referrer id>/``) so walking the chain never
+needs a query, and every ancestor keeps a ``downline_count`` aggregate
+that is bumped once at signup instead of being counted per request.
+"""
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from . import leaderboard, usercache
+from .bulk import adjust_balances
+from .models import CustomUser, Transaction
+from .tasks import task
+
+# Ksh paid to the direct referrer, their referrer, and so on
+DEFAULT_BONUS_LEVELS = ('50.00', '20.00', '10.00')
+
+
+def bonus_levels():
+    """Return the configured per-level bonus amounts as Decimals"""
+    levels = getattr(settings, 'REFERRAL_BONUS_LEVELS', DEFAULT_BONUS_LEVELS)
+    return [Decimal(str(amount)) for amount in levels]
+
+
+def path_for(referrer):
+    """Materialized path a user referred by ``referrer`` should carry"""
+    return f"{referrer.referral_path or '/'}{referrer.pk}/"
+
+
+def upline_ids(user, depth=None):
+    """Ids of the user's upline, nearest referrer first"""
+    ids = [int(pk) for pk in reversed(user.referral_path.strip('/').split('/')) if pk]
+    return ids if depth is None else ids[:depth]
+
+
+def record_signup(user):
+    """Add a freshly registered user to the downline count of their whole upline"""
+    ancestors = upline_ids(user)
+    if ancestors:
+        CustomUser.objects.filter(pk__in=ancestors).update(downline_count=F('downline_count') + 1)
+        usercache.invalidate(ancestors)
+
+
+@task
+def record_signup_task(user_id):
+    """``record_signup`` run by a worker after registration"""
+    user = CustomUser.objects.filter(pk=user_id).only('id', 'referral_path').first()
+    if user is not None:
+        record_signup(user)
+
+
+def propagate_bonus(user, levels=None, description='Referral Bonus'):
+    """
+    Pay multi-level referral bonuses for ``user`` to their upline.
+
+    Applies every level with a single UPDATE and writes the ledger rows
+    with one bulk insert. Returns the list of created transactions.
+    """
+    levels = bonus_levels() if levels is None else [Decimal(str(a)) for a in levels]
+    amounts = dict(zip(upline_ids(user, len(levels)), levels))
+    if not amounts:
+        return []
+    level_of = {pk: level for level, pk in enumerate(amounts, start=1)}
+
+    with transaction.atomic():
+        updated = adjust_balances(amounts, referral_bonus_earned=True)
+
+        # Fresh scores for the leaderboard; ancestors deleted since the
+        # path was written are skipped
+        rows = list(CustomUser.objects.filter(pk__in=amounts).values(*leaderboard.ENTRY_FIELDS))
+        if updated != len(amounts):
+            existing = {row['id'] for row in rows}
+            amounts = {pk: amount for pk, amount in amounts.items() if pk in existing}
+
+        transaction.on_commit(lambda: leaderboard.record(rows))
+
+        return Transaction.objects.bulk_create([
+            Transaction(
+                user_id=pk,
+                amount=amount,
+                transaction_type='referral',
+                description=f'{description} (level {level_of[pk]})',
+            )
+            for pk, amount in amounts.items()
+        ])
+
+
+@task
+def propagate_bonus_task(user_id):
+    """``propagate_bonus`` run by a worker after a premium activation"""
+    user = CustomUser.objects.filter(pk=user_id).only('id', 'referral_path').first()
+    if user is not None:
+        propagate_bonus(user)
+
+
+def downline_stats(user):
+    """Downline size and referral earnings, read from the maintained aggregates"""
+    return {
+        'referral_code': user.referral_code,
+        'downline_count': user.downline_count,
+        'referral_bonus_earned': float(user.referral_bonus_earned),
+        'upline_depth': len(upline_ids(user)),
+    }
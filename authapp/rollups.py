@@ -0,0 +1,136 @@
+# authapp/rollups.py
+"""
+Daily ledger totals per transaction type.
+
+``LedgerRollup`` holds one row per (day, transaction_type). ``advance``
+folds ``Transaction`` rows past the ``ledger_rollup`` watermark into it in
+id-ordered chunks, so every ledger row is counted exactly once and each
+run only reads what was written since the last one
+(``manage.py rollup_ledger``). Reports then aggregate O(days) rollup rows
+instead of scanning the ledger.
+
+Ledger ids are handed out before commit, so a slow transaction can commit
+a lower id after a higher one is already visible. Rows younger than
+``lag`` seconds are left for the next run to give such writers time to
+land before the watermark moves past them.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .models import LedgerRollup, Transaction, Watermark
+
+WATERMARK = 'ledger_rollup'
+DEFAULT_CHUNK = 50000
+DEFAULT_LAG = 60
+
+PERIODS = {
+    'day': None,
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+
+
+def _chunk_end(after, cutoff, size):
+    """Highest ledger id of the next chunk, or None when there is nothing to fold"""
+    ids = (Transaction.objects
+           .filter(pk__gt=after, created_at__lt=cutoff)
+           .order_by('pk')
+           .values_list('pk', flat=True))
+    last = ids[size - 1:size]
+    if last:
+        return last[0]
+    return ids.order_by('-pk').first()
+
+
+def _fold(after, until):
+    """Add ledger rows in (after, until] to the rollup table; returns rows folded"""
+    totals = (Transaction.objects
+              .filter(pk__gt=after, pk__lte=until)
+              .annotate(day=TruncDate('created_at'))
+              .values('day', 'transaction_type')
+              .annotate(total=Sum('amount'), count=Count('id'))
+              .order_by())
+    totals = {(row['day'], row['transaction_type']): row for row in totals}
+    if not totals:
+        return 0
+
+    existing = LedgerRollup.objects.filter(day__in={day for day, _ in totals})
+    existing = {(r.day, r.transaction_type): r for r in existing if (r.day, r.transaction_type) in totals}
+
+    updated, created = [], []
+    for key, row in totals.items():
+        rollup = existing.get(key)
+        if rollup is None:
+            created.append(LedgerRollup(day=key[0], transaction_type=key[1],
+                                        total_amount=row['total'], transaction_count=row['count']))
+        else:
+            rollup.total_amount = F('total_amount') + row['total']
+            rollup.transaction_count = F('transaction_count') + row['count']
+            updated.append(rollup)
+
+    LedgerRollup.objects.bulk_create(created)
+    LedgerRollup.objects.bulk_update(updated, ['total_amount', 'transaction_count'])
+    return sum(row['count'] for row in totals.values())
+
+
+def advance(chunk_size=DEFAULT_CHUNK, lag=DEFAULT_LAG):
+    """Fold every ledger row older than ``lag`` seconds past the watermark; returns rows folded"""
+    Watermark.objects.get_or_create(name=WATERMARK)
+    cutoff = timezone.now() - timedelta(seconds=lag)
+    folded = 0
+
+    while True:
+        with transaction.atomic():
+            # Row lock serialises concurrent runs; each chunk commits with its watermark
+            mark = Watermark.objects.select_for_update().get(name=WATERMARK)
+            until = _chunk_end(mark.position, cutoff, chunk_size)
+            if until is None:
+                return folded
+            folded += _fold(mark.position, until)
+            mark.position = until
+            mark.save(update_fields=['position', 'updated_at'])
+
+
+def rebuild():
+    """Drop the rollups and fold the whole ledger again"""
+    with transaction.atomic():
+        LedgerRollup.objects.all().delete()
+        Watermark.objects.update_or_create(name=WATERMARK, defaults={'position': 0})
+    return advance()
+
+
+def totals(period='day', start=None, end=None, transaction_type=None):
+    """Totals per period and transaction type from the rollup table, oldest first"""
+    if period not in PERIODS:
+        raise ValueError(f"Unknown period {period!r}. Choose one of: {', '.join(PERIODS)}")
+
+    rows = LedgerRollup.objects.all()
+    if start:
+        rows = rows.filter(day__gte=start)
+    if end:
+        rows = rows.filter(day__lte=end)
+    if transaction_type:
+        rows = rows.filter(transaction_type=transaction_type)
+
+    trunc = PERIODS[period]
+    bucket = trunc('day') if trunc else F('day')
+    rows = (rows.annotate(period=bucket)
+            .values('period', 'transaction_type')
+            .annotate(total=Sum('total_amount'), count=Sum('transaction_count'))
+            .order_by('period', 'transaction_type'))
+
+    return [{
+        'period': row['period'].isoformat(),
+        'transaction_type': row['transaction_type'],
+        'total_amount': str(row['total']),
+        'transaction_count': row['count'],
+    } for row in rows]
+
+
+def watermark():
+    """Last ledger id folded into the rollups"""
+    return Watermark.objects.filter(name=WATERMARK).values_list('position', flat=True).first() or 0
@@ -0,0 +1,110 @@
+# authapp/settlement.py
+"""
+Batched payout of survey rewards.
+
+``CustomUser.add_earning`` saves the whole user row and inserts one
+ledger row per call. Settlement pays completed, unsettled ``UserSurvey``
+rows in batches instead. Each batch is one transaction with five
+statements:
+- lock the batch's rows;
+- credit every user with one grouped UPDATE ... FROM (VALUES ...) via
+  ``bulk.increment_users``;
+- ``bulk_create`` the 'earning' ledger rows;
+- stamp ``settled_at`` on the batch;
+- queue the 'earning_posted' notifications.
+
+A row is paid its ``earnings``, or the survey's ``reward_amount`` when
+no earnings were recorded. ``settled_at`` makes a rerun skip rows that
+were already paid (``manage.py settle_surveys``), including rows paid one
+at a time through ``add_earning(user_survey=...)``, which stamps it too.
+"""
+import time
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import leaderboard, notifications
+from .bulk import increment_users
+from .models import Transaction, UserSurvey
+
+BATCH_SIZE = 2000
+DESCRIPTION = 'Survey completion'
+
+
+def unsettled(queryset=None):
+    """Completed rows whose reward hasn't been paid, oldest first"""
+    queryset = UserSurvey.objects.all() if queryset is None else queryset
+    return queryset.filter(status='completed', settled_at__isnull=True).order_by('pk')
+
+
+def settle_batch(ids):
+    """Pay out the unsettled rows among ``ids`` in one transaction; returns batch metrics"""
+    started = time.perf_counter()
+    with transaction.atomic():
+        rows = list(
+            unsettled(UserSurvey.objects.filter(pk__in=ids))
+            .select_for_update(of=('self',))
+            .annotate(amount=Coalesce('earnings', F('survey__reward_amount')))
+            .values_list('pk', 'user_id', 'amount')
+        )
+
+        payouts = defaultdict(lambda: [Decimal('0'), 0])
+        for _, user_id, amount in rows:
+            payouts[user_id][0] += amount
+            payouts[user_id][1] += 1
+
+        increment_users(
+            {user_id: (amount, amount, count) for user_id, (amount, count) in payouts.items()},
+            ['balance', 'total_earned', 'surveys_completed'],
+        )
+        Transaction.objects.bulk_create([
+            Transaction(user_id=user_id, amount=amount, transaction_type='earning', description=DESCRIPTION)
+            for _, user_id, amount in rows
+        ])
+        UserSurvey.objects.filter(pk__in=[pk for pk, _, _ in rows]).update(settled_at=timezone.now())
+        notifications.emit_many([(user_id, 'earning_posted', {'amount': str(amount)}) for _, user_id, amount in rows])
+
+        users = list(payouts)
+        transaction.on_commit(lambda: leaderboard.record_users(users))
+
+    elapsed = time.perf_counter() - started
+    total = sum(amount for amount, _ in payouts.values())
+    return {
+        'rows': len(rows),
+        'users': len(payouts),
+        'amount': total,
+        'seconds': elapsed,
+        'rows_per_second': len(rows) / elapsed if elapsed else 0.0,
+    }
+
+
+def settle(queryset=None, batch_size=BATCH_SIZE, on_batch=None):
+    """
+    Settle every unsettled completed row in ``queryset`` (all by default).
+
+    ``on_batch`` is called with each batch's metrics. Returns the totals.
+    """
+    totals = {'batches': 0, 'rows': 0, 'users': 0, 'amount': Decimal('0'), 'seconds': 0.0}
+    pending = unsettled(queryset)
+    last = 0
+
+    while True:
+        # Keyset pagination over the partial index on unsettled rows
+        ids = list(pending.filter(pk__gt=last).values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            break
+        last = ids[-1]
+
+        metrics = settle_batch(ids)
+        if on_batch:
+            on_batch(metrics)
+        totals['batches'] += 1
+        for key in ('rows', 'users', 'amount', 'seconds'):
+            totals[key] += metrics[key]
+
+    totals['rows_per_second'] = totals['rows'] / totals['seconds'] if totals['seconds'] else 0.0
+    return totals
@@ -0,0 +1,24 @@
+# authapp/signals.py
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import fragments, usercache
+from .models import CustomUser, Survey, UserSurvey
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def invalidate_cached_user(sender, instance, **kwargs):
+    usercache.invalidate([instance.pk])
+
+
+@receiver(post_save, sender=Survey)
+@receiver(post_delete, sender=Survey)
+def invalidate_survey_fragments(sender, instance, **kwargs):
+    fragments.bump_surveys()
+
+
+@receiver(post_save, sender=UserSurvey)
+@receiver(post_delete, sender=UserSurvey)
+def invalidate_user_fragments(sender, instance, **kwargs):
+    fragments.bump_user(instance.user_id)
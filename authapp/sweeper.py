@@ -0,0 +1,59 @@
+# authapp/sweeper.py
+"""
+Expire survey responses that were started and never finished.
+
+Stale ``started``/``in_progress`` rows move to ``abandoned`` (an allowed
+transition, see ``UserSurvey.TRANSITIONS``) in batches. Each batch is a
+single ``UPDATE ... WHERE id IN (SELECT ... LIMIT n)`` that walks the
+partial index on in-flight rows, so the sweep never scans finished
+responses and the index stays the size of the live working set.
+Rows started before ``started_at`` was recorded are aged by
+``assigned_at`` instead (``manage.py sweep_surveys``).
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Subquery
+from django.utils import timezone
+
+from . import fragments
+from .models import UserSurvey
+
+BATCH_SIZE = 5000
+
+
+def abandon_after():
+    """How long a response may stay in flight"""
+    return timedelta(hours=getattr(settings, 'SURVEY_ABANDON_AFTER_HOURS', 24))
+
+
+def stale(older_than=None):
+    """(indexed, legacy) querysets of in-flight rows started before the cutoff"""
+    cutoff = timezone.now() - (older_than or abandon_after())
+    active = UserSurvey.objects.filter(status__in=UserSurvey.ACTIVE_STATUSES)
+    return (
+        active.filter(started_at__lt=cutoff).order_by('started_at'),
+        active.filter(started_at__isnull=True, assigned_at__lt=cutoff).order_by('-assigned_at'),
+    )
+
+
+def sweep(older_than=None, batch_size=BATCH_SIZE, dry_run=False):
+    """Mark stale in-flight responses abandoned; returns how many were (or would be) expired"""
+    swept = 0
+    for queryset in stale(older_than):
+        if dry_run:
+            swept += queryset.count()
+            continue
+        while True:
+            batch = Subquery(queryset.values('pk')[:batch_size])
+            updated = UserSurvey.objects.filter(
+                pk__in=batch, status__in=UserSurvey.ACTIVE_STATUSES
+            ).update(status='abandoned')
+            swept += updated
+            if updated < batch_size:
+                break
+
+    if swept and not dry_run:
+        # Abandoned surveys show up as available again on dashboards
+        fragments.bump_surveys()
+    return swept
@@ -0,0 +1,328 @@
+# authapp/synthetic.py
+"""
+Synthetic data at production scale for development and performance work
+(``manage.py populate_data``).
+
+Users, surveys and ledger rows are written with ``bulk_create`` in large
+batches; on PostgreSQL the ledger can be streamed with COPY instead.
+Distributions roughly follow production: sign-ups skew recent, about a
+third of users are premium, half arrive through a referral, and ledger
+activity is concentrated on a minority of heavy users. The same seed
+always produces the same data.
+
+Every generated value drawn from a model field with ``choices`` is
+checked against those choices before anything is written.
+"""
+import csv
+import io
+import random
+from collections import Counter
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import CustomUser, Survey, Transaction
+
+BATCH_SIZE = 5000
+PIN = '1234'
+PHONE_PREFIX = '+2541'  # 01xx numbers, clear of the 07xx range real users mostly have
+
+SAMPLE_SURVEYS = [
+    {
+        'title': 'Mobile Banking App Experience',
+        'description': 'Share your experience with mobile banking apps in Kenya',
+        'reward_amount': Decimal('200.00'),
+        'estimated_time': 8,
+        'category': 'finance',
+        'difficulty': 'medium',
+        'questions_count': 12,
+        'is_premium_only': False,
+    },
+    {
+        'title': 'Consumer Preferences - Soft Drinks',
+        'description': 'Tell us about your soft drink preferences and buying habits',
+        'reward_amount': Decimal('150.00'),
+        'estimated_time': 5,
+        'category': 'consumer',
+        'difficulty': 'easy',
+        'questions_count': 8,
+        'is_premium_only': False,
+    },
+    {
+        'title': 'Premium: Luxury Car Brands Survey',
+        'description': 'Exclusive survey about luxury car brand preferences',
+        'reward_amount': Decimal('500.00'),
+        'estimated_time': 12,
+        'category': 'shopping',
+        'difficulty': 'premium',
+        'questions_count': 15,
+        'is_premium_only': True,
+    },
+]
+
+# difficulty: (minutes, reward range in Ksh, share of surveys)
+DIFFICULTIES = {
+    'easy': ((2, 5), (50, 150), 0.5),
+    'medium': ((5, 10), (100, 300), 0.35),
+    'premium': ((10, 15), (300, 800), 0.15),
+}
+
+TRANSACTION_MIX = {
+    'earning': 0.6,
+    'referral': 0.15,
+    'withdrawal': 0.1,
+    'bonus': 0.1,
+    'premium': 0.05,
+}
+
+TRANSACTION_STATUSES = {
+    'completed': 0.95,
+    'pending': 0.03,
+    'failed': 0.015,
+    'cancelled': 0.005,
+}
+
+PREMIUM_SHARE = 0.35
+REFERRED_SHARE = 0.5
+MAX_REFERRAL_DEPTH = 12
+
+
+def check_choices(model, field_name, values):
+    """Raise ValueError unless every value is one of the field's choices"""
+    allowed = {value for value, _ in model._meta.get_field(field_name).choices}
+    invalid = sorted(set(values) - allowed)
+    if invalid:
+        raise ValueError(
+            f"Invalid {model.__name__}.{field_name} value(s) {', '.join(invalid)}; "
+            f"choose from {', '.join(sorted(allowed))}"
+        )
+
+
+def check_all():
+    check_choices(Survey, 'category', [s['category'] for s in SAMPLE_SURVEYS])
+    check_choices(Survey, 'difficulty', [s['difficulty'] for s in SAMPLE_SURVEYS])
+    check_choices(Survey, 'difficulty', DIFFICULTIES)
+    check_choices(Transaction, 'transaction_type', TRANSACTION_MIX)
+    check_choices(Transaction, 'status', TRANSACTION_STATUSES)
+
+
+@contextmanager
+def explicit_timestamps(model, *field_names):
+    """Let bulk inserts keep the timestamps we generate instead of auto_now_add"""
+    fields = [model._meta.get_field(name) for name in field_names]
+    saved = [field.auto_now_add for field in fields]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, value in zip(fields, saved):
+            field.auto_now_add = value
+
+
+def batched_range(total, size=BATCH_SIZE):
+    for start in range(0, total, size):
+        yield start, min(size, total - start)
+
+
+def make_surveys(count, rng):
+    """Sample surveys first, then synthetic ones spread over every category"""
+    categories = [value for value, _ in Survey.SURVEY_CATEGORIES]
+    difficulties = list(DIFFICULTIES)
+    weights = [share for _, _, share in DIFFICULTIES.values()]
+
+    surveys = [Survey(**data) for data in SAMPLE_SURVEYS[:count]]
+    for n in range(len(surveys), count):
+        category = rng.choice(categories)
+        difficulty = rng.choices(difficulties, weights)[0]
+        (min_time, max_time), (low, high), _ = DIFFICULTIES[difficulty]
+        surveys.append(Survey(
+            title=f'{Survey.SURVEY_CATEGORIES[categories.index(category)][1]} Survey #{n}',
+            description=f'Synthetic {difficulty} survey about {category}',
+            reward_amount=Decimal(rng.randrange(low, high + 1, 10)),
+            estimated_time=rng.randint(min_time, max_time),
+            category=category,
+            difficulty=difficulty,
+            is_premium_only=difficulty == 'premium' and rng.random() < 0.8,
+            is_active=rng.random() < 0.9,
+            questions_count=rng.randint(5, 25),
+        ))
+    Survey.objects.bulk_create(surveys, batch_size=BATCH_SIZE)
+    return len(surveys)
+
+
+def make_users(count, rng, now, first=0):
+    """
+    Users with a realistic referral tree. Returns (ids, join dates).
+
+    Referred users pick an already inserted user as referrer, so
+    ``referral_path`` and ``downline_count`` match what sign-up would have
+    written. Batches start small and double, so even the first few
+    thousand users form a tree.
+    """
+    pin_hash = make_password(PIN)
+    # Sign-up age in days: most users joined recently, a tail goes back two years
+    ages = sorted((min(int(rng.expovariate(1 / 120)), 730) for _ in range(count)), reverse=True)
+
+    ids, joined, paths = [], [], []
+    downlines = Counter()
+    while len(ids) < count:
+        start = len(ids)
+        batch = []
+        for n in range(start, min(count, start + max(1, min(start, BATCH_SIZE)))):
+            path = ''
+            if ids and rng.random() < REFERRED_SHARE:
+                referrer = rng.randrange(len(ids))
+                if paths[referrer].count('/') <= MAX_REFERRAL_DEPTH:
+                    path = f"{paths[referrer] or '/'}{ids[referrer]}/"
+
+            premium = rng.random() < PREMIUM_SHARE
+            earned = Decimal(int(rng.lognormvariate(6, 1.2))) if premium else Decimal('0')
+            batch.append(CustomUser(
+                phone_number=f'{PHONE_PREFIX}{first + n:08d}',
+                pin=pin_hash,
+                referral_code=f'SYN{first + n:07d}',
+                referred_by_id=int(path.rsplit('/', 2)[1]) if path else None,
+                referral_path=path,
+                is_premium=premium,
+                premium_activated_date=now - timezone.timedelta(days=ages[n] // 2) if premium else None,
+                total_earned=earned,
+                balance=(earned * Decimal(rng.random())).quantize(Decimal('1')) + (500 if premium else 0),
+                date_joined=now - timezone.timedelta(days=ages[n], seconds=rng.randrange(86400)),
+            ))
+
+        created = CustomUser.objects.bulk_create(batch)
+        if created[0].pk is None:
+            found = dict(CustomUser.objects.filter(
+                referral_code__in=[u.referral_code for u in created]).values_list('referral_code', 'pk'))
+            for user in created:
+                user.pk = found[user.referral_code]
+        for user in created:
+            ids.append(user.pk)
+            joined.append(user.date_joined)
+            paths.append(user.referral_path)
+            downlines.update(int(pk) for pk in user.referral_path.split('/') if pk)
+
+    counts = sorted(downlines.items())
+    for start, size in batched_range(len(counts)):
+        CustomUser.objects.bulk_update(
+            [CustomUser(pk=pk, downline_count=n) for pk, n in counts[start:start + size]],
+            ['downline_count'],
+        )
+    return ids, joined
+
+
+def _transaction_amount(kind, rng):
+    if kind == 'earning':
+        return Decimal(rng.choice([50, 50, 100, 100, 150, 200, 300, 500]))
+    if kind == 'referral':
+        return Decimal(rng.choice(['50.00', '50.00', '20.00', '10.00']))
+    if kind == 'withdrawal':
+        return Decimal(rng.randrange(50, 5000, 10))
+    if kind == 'bonus':
+        return Decimal('500.00')
+    return Decimal('0.00')
+
+
+def generate_transactions(count, rng, now, users, joined):
+    """Yield ledger rows as tuples; a few heavy users get most of the activity"""
+    types, type_weights = list(TRANSACTION_MIX), list(TRANSACTION_MIX.values())
+    statuses, status_weights = list(TRANSACTION_STATUSES), list(TRANSACTION_STATUSES.values())
+    activity = [1 / (rank + 1) ** 0.8 for rank in range(len(users))]
+    rng.shuffle(activity)
+    cumulative, total = [], 0
+    for weight in activity:
+        total += weight
+        cumulative.append(total)
+
+    for _, size in batched_range(count):
+        picks = rng.choices(range(len(users)), cum_weights=cumulative, k=size)
+        kinds = rng.choices(types, type_weights, k=size)
+        states = rng.choices(statuses, status_weights, k=size)
+        for index, kind, state in zip(picks, kinds, states):
+            since = joined[index]
+            created = since + (now - since) * rng.random()
+            yield (users[index], _transaction_amount(kind, rng), kind,
+                   f'Synthetic {kind}', state, created)
+
+
+def insert_transactions(rows, copy=False):
+    """Write rows from ``generate_transactions``; returns how many were written"""
+    if copy:
+        return _copy_transactions(rows)
+
+    written = 0
+    batch = []
+    with explicit_timestamps(Transaction, 'created_at'):
+        for user_id, amount, kind, description, state, created in rows:
+            batch.append(Transaction(user_id=user_id, amount=amount, transaction_type=kind,
+                                     description=description, status=state, created_at=created))
+            if len(batch) == BATCH_SIZE:
+                Transaction.objects.bulk_create(batch)
+                written += len(batch)
+                batch = []
+        Transaction.objects.bulk_create(batch)
+    return written + len(batch)
+
+
+def _copy_transactions(rows):
+    """Stream rows into the ledger with PostgreSQL COPY, one batch at a time"""
+    if connection.vendor != 'postgresql':
+        raise ValueError('COPY loading needs PostgreSQL')
+
+    table = connection.ops.quote_name(Transaction._meta.db_table)
+    sql = (f'COPY {table} (user_id, amount, transaction_type, description, status, created_at, updated_at) '
+           f"FROM STDIN WITH (FORMAT csv)")
+    now = timezone.now().isoformat()
+    written = 0
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        buffer.seek(0)
+        with connection.cursor() as cursor:
+            cursor.cursor.copy_expert(sql, buffer)
+        buffer.seek(0)
+        buffer.truncate()
+
+    for n, (user_id, amount, kind, description, state, created) in enumerate(rows, start=1):
+        writer.writerow((user_id, amount, kind, description, state, created.isoformat(), now))
+        if n % BATCH_SIZE == 0:
+            flush()
+        written = n
+    flush()
+    return written
+
+
+def populate(users=0, surveys=3, transactions=0, seed=0, copy=False, log=None):
+    """Generate the requested rows; returns a dict of counts per table"""
+    check_all()
+    rng = random.Random(seed)
+    now = timezone.now()
+    log = log or (lambda message: None)
+    counts = {}
+
+    with transaction.atomic():
+        counts['surveys'] = make_surveys(surveys, rng)
+        log(f'{counts["surveys"]} surveys')
+
+        first = CustomUser.objects.filter(phone_number__startswith=PHONE_PREFIX).count()
+        ids, joined = make_users(users, rng, now, first=first)
+        counts['users'] = len(ids)
+        log(f'{counts["users"]} users')
+
+        if transactions:
+            if not ids:
+                # Spread the ledger over the users already in the database
+                existing = list(CustomUser.objects.values_list('pk', 'date_joined'))
+                ids, joined = [pk for pk, _ in existing], [date for _, date in existing]
+            if not ids:
+                raise ValueError('Ledger rows need users; pass --users as well')
+            rows = generate_transactions(transactions, rng, now, ids, joined)
+            counts['transactions'] = insert_transactions(rows, copy=copy)
+            log(f'{counts["transactions"]} transactions')
+
+    return counts
@@ -0,0 +1,218 @@
+# authapp/tasks.py
+"""
+Database-backed background tasks.
+
+Decorate a function with ``@task`` and call ``func.delay(*args)`` from a
+request to queue it as a ``Task`` row. The row is written in the
+caller's transaction, so a task is only ever seen if the work that
+queued it committed. ``manage.py run_workers`` runs queued tasks on a
+thread pool; no broker is needed. On Vercel, where nothing runs between
+requests, the cron in vercel.json calls ``/auth/cron/tasks/`` every
+minute to ``drain`` the queue.
+
+Delivery:
+- a worker claims a task with a conditional UPDATE and holds it for
+  ``TASK_VISIBILITY_TIMEOUT`` seconds. If the worker dies, the task is
+  picked up again once that lapses.
+- the task function runs in one transaction with the deletion of its
+  row. A worker whose claim was taken over rolls back instead of
+  committing, so database changes from a task are applied once.
+- a failing task is retried with exponential backoff
+  (``TASK_RETRY_BACKOFF`` doubled per attempt, capped at
+  ``TASK_RETRY_BACKOFF_MAX``). After ``max_attempts`` it is kept as
+  failed for inspection in the admin.
+
+With ``TASK_QUEUE_EAGER`` (the local profile's default) ``delay`` runs
+the function immediately instead, inside the caller's request.
+"""
+import logging
+import random
+import threading
+import time
+import traceback
+from datetime import timedelta
+from importlib import import_module
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ATTEMPTS = 5
+
+_registry = {}
+
+
+class LostClaim(Exception):
+    """Another worker took the task over after its visibility timeout"""
+
+
+def eager():
+    return getattr(settings, 'TASK_QUEUE_EAGER', False)
+
+
+def visibility_timeout():
+    return getattr(settings, 'TASK_VISIBILITY_TIMEOUT', 300)
+
+
+def task(func=None, *, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """Register ``func`` as a task and give it a ``delay`` method"""
+    def register(func):
+        name = f'{func.__module__}.{func.__qualname__}'
+        _registry[name] = func
+        func.task_name = name
+        func.delay = lambda *args, **kwargs: enqueue(name, args, kwargs, max_attempts=max_attempts)
+        return func
+    return register(func) if func is not None else register
+
+
+def lookup(name):
+    """The registered function for ``name``, importing its module if needed"""
+    if name not in _registry:
+        import_module(name.rsplit('.', 1)[0])
+    try:
+        return _registry[name]
+    except KeyError:
+        raise ValueError(f'Unknown task: {name}') from None
+
+
+def enqueue(name, args=(), kwargs=None, max_attempts=DEFAULT_MAX_ATTEMPTS, delay=0):
+    """Queue a task (args must be JSON-serializable); runs it right away in eager mode"""
+    kwargs = kwargs or {}
+    if eager():
+        return lookup(name)(*args, **kwargs)
+    return Task.objects.create(
+        name=name, args=list(args), kwargs=kwargs, max_attempts=max_attempts,
+        run_after=timezone.now() + timedelta(seconds=delay),
+    )
+
+
+def backoff(attempts):
+    """Seconds before retry number ``attempts``, with jitter"""
+    base = getattr(settings, 'TASK_RETRY_BACKOFF', 10)
+    ceiling = getattr(settings, 'TASK_RETRY_BACKOFF_MAX', 3600)
+    return min(ceiling, base * 2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+
+
+def ready(now=None):
+    """Tasks a worker may claim: queued and due, or running past their visibility timeout"""
+    now = now or timezone.now()
+    return Task.objects.filter(
+        Q(status='queued', run_after__lte=now) | Q(status='running', locked_until__lte=now)
+    )
+
+
+def claim(limit=10):
+    """Claim one ready task for this worker; returns it or None"""
+    now = timezone.now()
+    for pk in ready(now).order_by('run_after').values_list('pk', flat=True)[:limit]:
+        # The same conditions again, so exactly one worker wins each row
+        claimed = ready(now).filter(pk=pk).update(
+            status='running', attempts=F('attempts') + 1,
+            locked_until=now + timedelta(seconds=visibility_timeout()), updated_at=now,
+        )
+        if claimed:
+            return Task.objects.get(pk=pk)
+    return None
+
+
+def execute(task_row):
+    """Run a claimed task; returns True if it finished"""
+    try:
+        func = lookup(task_row.name)
+        with transaction.atomic():
+            func(*task_row.args, **task_row.kwargs)
+            # Commit only while the claim is still ours
+            if not Task.objects.filter(pk=task_row.pk, attempts=task_row.attempts).delete()[0]:
+                raise LostClaim(task_row.name)
+        return True
+    except LostClaim:
+        logger.warning("Task %s (%s) was taken over by another worker", task_row.pk, task_row.name)
+        return False
+    except Exception as e:
+        logger.error("Task %s (%s) failed on attempt %s: %s", task_row.pk, task_row.name, task_row.attempts, e)
+        error = traceback.format_exc()[-4000:]
+        if task_row.attempts >= task_row.max_attempts:
+            update = {'status': 'failed', 'locked_until': None}
+        else:
+            update = {'status': 'queued', 'locked_until': None,
+                      'run_after': timezone.now() + timedelta(seconds=backoff(task_row.attempts))}
+        Task.objects.filter(pk=task_row.pk, attempts=task_row.attempts).update(
+            last_error=error, updated_at=timezone.now(), **update)
+        return False
+
+
+def run_next(on_task=None):
+    """Claim and run one ready task; returns False if none was ready"""
+    task_row = claim()
+    if task_row is None:
+        return False
+    if task_row.attempts > task_row.max_attempts:
+        # Its workers kept dying before the visibility timeout
+        Task.objects.filter(pk=task_row.pk).update(
+            status='failed', last_error='Visibility timeout exceeded on every attempt')
+        return True
+    started = time.perf_counter()
+    ok = execute(task_row)
+    if on_task:
+        on_task(task_row, ok, time.perf_counter() - started)
+    return True
+
+
+def work(stop, poll=1.0, burst=False, on_task=None):
+    """
+    Worker loop: claim and run tasks until ``stop`` (a threading.Event)
+    is set, or with ``burst`` until nothing is ready.
+    """
+    try:
+        while not stop.is_set():
+            close_old_connections()
+            try:
+                if not run_next(on_task):
+                    if burst:
+                        break
+                    stop.wait(poll)
+            except Exception as e:
+                # Database trouble; the claim lapses after the visibility timeout
+                logger.error("Task worker error: %s", e)
+                stop.wait(poll)
+    finally:
+        from django.db import connection
+        connection.close()
+
+
+def drain(seconds, on_task=None):
+    """
+    Run ready tasks in the calling thread until none is ready or
+    ``seconds`` have passed; returns how many were run. A task already
+    running when time is up is finished first.
+    """
+    deadline = time.monotonic() + seconds
+    count = 0
+    while time.monotonic() < deadline and run_next(on_task):
+        count += 1
+    return count
+
+
+def run_workers(concurrency=4, poll=1.0, burst=False, on_task=None, stop=None):
+    """Run ``concurrency`` worker threads until ``stop`` is set (or the queue drains with ``burst``)"""
+    stop = stop or threading.Event()
+    threads = [
+        threading.Thread(target=work, args=(stop, poll, burst, on_task), name=f'task-worker-{n}', daemon=True)
+        for n in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(0.5)
+    except KeyboardInterrupt:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    return stop
@@ -1,3 +1,1416 @@
-from django.test import TestCase
+import io
+import json
+import logging
+import os
+import pickle
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, connection, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from myproject import log, metrics
+from myproject.middleware import LandingPageCacheMiddleware
+
+from . import (
+    admin, bulk, circuit, fraud, leaderboard, notifications, partitions, payments, referrals, rollups, settlement,
+    sweeper, tasks, usercache, views,
+)
+from .callbacks import RESULT_CODES, CallbackError, StkCallback, parse
+from .management.commands import startup_profile
+from .models import (
+    CustomUser, FraudFlag, LedgerRollup, MpesaTransaction, Notification, OutboxEvent, Survey, Task, Transaction,
+    UserSurvey, Watermark,
+)
+
+
+def callback_body(result_code=0, checkout_request_id='ws_CO_0000000001', amount=79):
+    """An stkCallback body shaped like the ones Daraja sends"""
+    callback = {
+        'MerchantRequestID': 'MR-0000-1',
+        'CheckoutRequestID': checkout_request_id,
+        'ResultCode': result_code,
+        'ResultDesc': RESULT_CODES.get(result_code, 'Unknown result'),
+    }
+    if result_code == 0:
+        callback['CallbackMetadata'] = {'Item': [
+            {'Name': 'Amount', 'Value': amount},
+            {'Name': 'MpesaReceiptNumber', 'Value': 'NLJ7RT61SV'},
+            {'Name': 'Balance'},
+            {'Name': 'TransactionDate', 'Value': 20260101120000},
+            {'Name': 'PhoneNumber', 'Value': 254712345678},
+        ]}
+    return json.dumps({'Body': {'stkCallback': callback}}).encode()
+
+
+class CallbackParserTests(SimpleTestCase):
+    def test_successful_callback(self):
+        callback = parse(callback_body())
+        self.assertTrue(callback.succeeded)
+        self.assertEqual(callback.status, 'COMPLETED')
+        self.assertEqual(callback.amount, Decimal('79'))
+        self.assertEqual(callback.receipt, 'NLJ7RT61SV')
+        self.assertEqual(callback.transaction_date, '20260101120000')
+        self.assertEqual(callback.phone_number, '254712345678')
+
+    def test_known_result_codes(self):
+        for code, description in RESULT_CODES.items():
+            with self.subTest(code=code):
+                callback = parse(callback_body(code))
+                self.assertEqual(callback.result_code, code)
+                self.assertEqual(callback.result_desc, description)
+                self.assertEqual(callback.status, 'COMPLETED' if code == 0 else 'FAILED')
+
+    def test_rejects_malformed_bodies(self):
+        valid = json.loads(callback_body())
+        stk = valid['Body']['stkCallback']
+        bodies = [
+            b'', b'not json', b'[]', b'{"Body": []}', b'{"Body": {"stkCallback": "x"}}',
+            json.dumps({'Body': {'stkCallback': {**stk, 'ResultCode': 'zero'}}}),
+            json.dumps({'Body': {'stkCallback': {**stk, 'ResultCode': True}}}),
+            json.dumps({'Body': {'stkCallback': {**stk, 'CheckoutRequestID': None}}}),
+            json.dumps({'Body': {'stkCallback': {**stk, 'CheckoutRequestID': 'x' * 101}}}),
+            json.dumps({'Body': {'stkCallback': {**stk, 'CallbackMetadata': {}}}}),
+            json.dumps({'Body': {'stkCallback': {**stk, 'CallbackMetadata': {'Item': [
+                {'Name': 'Amount', 'Value': -5}, {'Name': 'MpesaReceiptNumber', 'Value': 'NLJ7RT61SV'}]}}}}),
+            json.dumps({'Body': {'stkCallback': {**stk, 'CallbackMetadata': {'Item': [
+                {'Name': 'Amount', 'Value': 79}, {'Name': 'MpesaReceiptNumber', 'Value': '<script>'}]}}}}),
+            json.dumps({'Body': {'stkCallback': {**stk, 'CallbackMetadata': {'Item': [
+                {'Name': 'Amount', 'Value': 79}]}}}}),
+            b'[' * 5000,
+        ]
+        for body in bodies:
+            with self.subTest(body=body[:60]):
+                with self.assertRaises(CallbackError):
+                    parse(body)
+
+    def test_fuzz(self):
+        """Mutated bodies either parse or raise CallbackError, nothing else"""
+        rng = random.Random(47)
+        seeds = [callback_body(code) for code in RESULT_CODES]
+        junk = [None, True, -1, 0, 1.5, '', 'x' * 200, [], {}, '254712345678', '1e999', 'NaN']
+        for _ in range(3000):
+            data = json.loads(rng.choice(seeds))
+            node = data
+            # Walk a random path into the body and replace one value
+            while isinstance(node, (dict, list)) and node and rng.random() < 0.8:
+                key = rng.choice(list(node) if isinstance(node, dict) else range(len(node)))
+                if not isinstance(node[key], (dict, list)) or rng.random() < 0.3:
+                    node[key] = rng.choice(junk)
+                    break
+                node = node[key]
+            body = json.dumps(data).encode()
+            if rng.random() < 0.2:
+                cut = rng.randrange(len(body))
+                body = body[:cut] + bytes([rng.randrange(256)]) + body[cut + 1:]
+            try:
+                self.assertIsInstance(parse(body), StkCallback)
+            except CallbackError:
+                pass
+
+    def test_parse_cost(self):
+        bodies = [callback_body(code, f'ws_CO_{n:010d}') for n, code in
+                  enumerate(list(RESULT_CODES) * 500)]
+        started = time.perf_counter()
+        for body in bodies:
+            parse(body)
+        per_callback = (time.perf_counter() - started) / len(bodies)
+        self.assertLess(per_callback, 0.0005, f'{per_callback * 1e6:.1f} us per callback')
+
+
+class MpesaCallbackViewTests(TestCase):
+    def setUp(self):
+        self.journal_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.journal_dir)
+        journal_settings = self.settings(PAYMENT_JOURNAL_DIR=self.journal_dir)
+        journal_settings.enable()
+        self.addCleanup(journal_settings.disable)
+
+        self.user = CustomUser.objects.create_user(phone_number='712345678', pin='1234')
+        self.payment = payments.record_push(
+            self.user, '254712345678', 79, 'PREMIUM1', 'Premium Activation',
+            {'CheckoutRequestID': 'ws_CO_0000000001', 'MerchantRequestID': 'MR-0000-1'},
+        )
+
+    def post(self, body):
+        return self.client.post('/auth/mpesa-callback/', body, content_type='application/json')
+
+    def test_success_activates_premium(self):
+        self.assertEqual(self.post(callback_body()).status_code, 200)
+        self.payment.refresh_from_db()
+        self.user.refresh_from_db()
+        self.assertEqual(self.payment.status, 'COMPLETED')
+        self.assertEqual(self.payment.mpesa_receipt, 'NLJ7RT61SV')
+        self.assertTrue(self.user.is_premium)
+
+    def test_failure_code_marks_failed(self):
+        self.assertEqual(self.post(callback_body(1032)).status_code, 200)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'FAILED')
+        self.assertEqual(self.payment.result_code, 1032)
+
+    def test_malformed_callback_rejected(self):
+        self.assertEqual(self.post(b'{"Body": {}}').status_code, 400)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'PENDING')
+
+    def test_replay_rebuilds_lost_payments(self):
+        before = self.user.balance
+        self.post(b'not json')
+        self.post(callback_body())
+        self.user.refresh_from_db()
+        balance = self.user.balance
+
+        # Lose the payment and the activation
+        MpesaTransaction.objects.all().delete()
+        CustomUser.objects.filter(pk=self.user.pk).update(is_premium=False, balance=before)
+
+        # A day later
+        later = timezone.now() + timedelta(days=1)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            totals = payments.replay(path=self.journal_dir)
+        self.assertEqual((totals['events'], totals['pushes'], totals['applied'], totals['rejected']), (3, 1, 1, 1))
+        payment = MpesaTransaction.objects.get(checkout_request_id='ws_CO_0000000001')
+        self.assertEqual(payment.status, 'COMPLETED')
+        self.assertAlmostEqual(payment.created_at.timestamp(), self.payment.created_at.timestamp(), delta=1)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.is_premium)
+        self.assertEqual(self.user.balance, balance)
+
+        # Replaying again changes nothing
+        totals = payments.replay(path=self.journal_dir)
+        self.assertEqual((totals['applied'], totals['skipped']), (0, 1))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, balance)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ReferralTests(TestCase):
+    def register(self, n, referrer=None):
+        body = {'phoneNumber': f'7100000{n:02d}', 'pin': '1234', 'confirmPin': '1234',
+                'referralCode': referrer.referral_code if referrer else ''}
+        response = self.client.post('/auth/register/', json.dumps(body), content_type='application/json')
+        self.assertTrue(response.json()['success'], response.json())
+        self.client.logout()
+        return CustomUser.objects.get(phone_number=f'+2547100000{n:02d}')
+
+    def chain(self, length):
+        users = [self.register(0)]
+        for n in range(1, length):
+            users.append(self.register(n, users[-1]))
+        return users
+
+    def test_signup_paths_and_downline_counts(self):
+        users = self.chain(4)
+        self.assertEqual([u.referral_path for u in users],
+                         ['', f'/{users[0].pk}/', f'/{users[0].pk}/{users[1].pk}/',
+                          f'/{users[0].pk}/{users[1].pk}/{users[2].pk}/'])
+        self.assertEqual(referrals.upline_ids(users[3]), [users[2].pk, users[1].pk, users[0].pk])
+        counts = dict(CustomUser.objects.values_list('pk', 'downline_count'))
+        self.assertEqual([counts[u.pk] for u in users], [3, 2, 1, 0])
+
+    def test_deep_chain_path_is_not_truncated(self):
+        root = self.register(0)
+        ancestors = list(range(1000000, 1000060))
+        CustomUser.objects.filter(pk=root.pk).update(
+            referral_path='/' + ''.join(f'{pk}/' for pk in ancestors))
+        root.refresh_from_db()
+
+        user = self.register(1, root)
+        self.assertGreater(len(user.referral_path), 255)
+        self.assertEqual(referrals.upline_ids(user), [root.pk] + ancestors[::-1])
+
+    def test_premium_pays_each_upline_level(self):
+        users = self.chain(5)
+        before = dict(CustomUser.objects.values_list('pk', 'balance'))
+        with self.captureOnCommitCallbacks(execute=True):
+            users[4].activate_premium()
+
+        paid = {users[3].pk: Decimal('50.00'), users[2].pk: Decimal('20.00'), users[1].pk: Decimal('10.00')}
+        for user in CustomUser.objects.filter(pk__in=[u.pk for u in users[:4]]):
+            with self.subTest(user=user.pk):
+                amount = paid.get(user.pk, Decimal('0'))
+                self.assertEqual(user.balance, before[user.pk] + amount)
+                self.assertEqual(user.referral_bonus_earned, amount)
+                rows = list(Transaction.objects.filter(user=user, transaction_type='referral')
+                            .values_list('amount', flat=True))
+                self.assertEqual(rows, [amount] if amount else [])
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class LeaderboardTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(phone_number='712300001', pin='1234')
+        self.user.refresh_from_db()
+
+    def test_reads_never_query_the_database(self):
+        CustomUser.objects.filter(pk=self.user.pk).update(total_earned=Decimal('120.00'))
+        with self.assertNumQueries(0):
+            self.assertEqual(leaderboard.top('earners'), [])
+            response = self.client.get('/auth/leaderboard/', {'board': 'earners'})
+        self.assertEqual(response.json()['entries'], [])
+        self.assertIsNone(leaderboard.rebuilt_at())
+
+    def test_missing_board_is_built_on_write(self):
+        CustomUser.objects.filter(pk=self.user.pk).update(total_earned=Decimal('120.00'))
+        leaderboard.record_users([self.user.pk])
+        self.assertEqual(leaderboard.top('earners'), [{'rank': 1, 'name': 'User 0001', 'score': 120.0}])
+        self.assertIsNotNone(leaderboard.rebuilt_at())
+
+    def test_stale_board_is_rebuilt_on_write(self):
+        leaderboard.rebuild()
+        other = CustomUser.objects.create_user(phone_number='712300002', pin='1234')
+        CustomUser.objects.filter(pk=other.pk).update(total_earned=Decimal('80.00'))
+        CustomUser.objects.filter(pk=self.user.pk).update(total_earned=Decimal('10.00'))
+        leaderboard.record_users([self.user.pk])
+        self.assertEqual([e['score'] for e in leaderboard.top('earners')], [10.0])
+
+        cache.set(leaderboard.REBUILT_AT_KEY, time.time() - leaderboard.max_age() - 1, timeout=None)
+        leaderboard.record_users([self.user.pk])
+        self.assertEqual([e['score'] for e in leaderboard.top('earners')], [80.0, 10.0])
+
+    def test_rolled_back_bonus_leaves_board_alone(self):
+        leaderboard.rebuild()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                self.user.add_referral_bonus(Decimal('50.00'))
+                raise RuntimeError
+        self.assertEqual(callbacks, [])
+        self.assertEqual(leaderboard.top('referrers'), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.refresh_from_db()
+            self.user.add_referral_bonus(Decimal('50.00'))
+        self.assertEqual([e['score'] for e in leaderboard.top('referrers')], [50.0])
+
+
+class ColdStartTests(SimpleTestCase):
+    def test_entry_point_skips_the_payment_stack(self):
+        code = ("import sys, myproject.asgi; "
+                "print(sorted(m for m in ('requests', 'authapp.mpesa') if m in sys.modules))")
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                                cwd=settings.BASE_DIR, env={**os.environ, 'STARTUP_WARMUP': '1'})
+        self.assertEqual(result.returncode, 0, result.stderr[-2000:])
+        self.assertEqual(result.stdout.strip(), '[]')
+
+    def test_gateway_is_shared_until_reset(self):
+        from .mpesa import get_gateway, reset_gateway
+        self.addCleanup(reset_gateway)
+        gateway = get_gateway()
+        self.assertIs(get_gateway(), gateway)
+        reset_gateway()
+        self.assertIsNot(get_gateway(), gateway)
+
+    def test_profile_parses_importtime(self):
+        stderr = ('import time: self [us] | cumulative | imported package\n'
+                  'import time:       120 |        120 |     json.decoder\n'
+                  'import time:       300 |        420 | json\n')
+        self.assertEqual(startup_profile.Command()._parse(stderr),
+                         {'json.decoder': (120, 120), 'json': (300, 420)})
+
+
+class FakePgConnection:
+    """Just enough of a psycopg2 connection for the pool"""
+
+    def __init__(self, healthy=True):
+        self.closed = 0
+        self.healthy = healthy
+
+    def cursor(self):
+        from django.db.backends.postgresql.base import Database
+        if not self.healthy:
+            raise Database.OperationalError('server closed the connection')
+        return mock.MagicMock()
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def setUp(self):
+        from myproject.db.postgresql_pool import base
+        self.base = base
+        self.addCleanup(base._pools.pop, 'pool-test', None)
+
+    def wrapper(self, **options):
+        settings_dict = {
+            'ENGINE': 'myproject.db.postgresql_pool', 'NAME': 'railway', 'USER': 'postgres', 'PASSWORD': '',
+            'HOST': 'localhost', 'PORT': '', 'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': True,
+            'AUTOCOMMIT': True, 'ATOMIC_REQUESTS': False, 'TIME_ZONE': None, 'TEST': {},
+            'OPTIONS': {'connect_timeout': 5, 'pool_size': 2, 'pool_check_after': 30, **options},
+        }
+        return self.base.DatabaseWrapper(settings_dict, 'pool-test')
+
+    def release(self, db, raw):
+        db.connection = raw
+        db._close()
+        db.connection = None
+
+    def test_pool_options_stay_out_of_connect(self):
+        params = self.wrapper().get_connection_params()
+        self.assertEqual(params['connect_timeout'], 5)
+        self.assertNotIn('pool_size', params)
+        self.assertNotIn('pool_check_after', params)
+
+    def test_released_connection_is_reused(self):
+        db, raw = self.wrapper(), FakePgConnection()
+        self.release(db, raw)
+        self.assertFalse(raw.closed)
+        with mock.patch.object(self.base.base.DatabaseWrapper, 'get_new_connection') as connect:
+            self.assertIs(self.wrapper().get_new_connection({}), raw)
+            connect.assert_not_called()
+
+    def test_pool_is_bounded(self):
+        db = self.wrapper()
+        raws = [FakePgConnection() for _ in range(3)]
+        for raw in raws:
+            self.release(db, raw)
+        self.assertEqual([raw.closed for raw in raws], [0, 0, 1])
+
+    def test_idle_connection_is_pinged_and_dropped_when_dead(self):
+        db = self.wrapper(pool_check_after=0)
+        dead = FakePgConnection(healthy=False)
+        self.release(db, dead)
+        fresh = FakePgConnection()
+        with mock.patch.object(self.base.base.DatabaseWrapper, 'get_new_connection', return_value=fresh):
+            self.assertIs(db.get_new_connection({}), fresh)
+        self.assertTrue(dead.closed)
+
+
+class SettingsProfileTests(SimpleTestCase):
+    def settings_for(self, profile, expression='settings.DATABASES["default"]["ENGINE"]'):
+        code = f'from django.conf import settings; print({expression})'
+        env = {name: value for name, value in os.environ.items() if name != 'TASK_QUEUE_EAGER'}
+        return subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, cwd=settings.BASE_DIR,
+                              env={**env, 'DJANGO_SETTINGS_MODULE': 'myproject.settings', 'DJANGO_PROFILE': profile})
+
+    def test_profile_selects_the_database(self):
+        self.assertEqual(self.settings_for('local').stdout.strip(), 'myproject.db.sqlite_wal')
+        self.assertEqual(self.settings_for('production').stdout.strip(), 'django.db.backends.postgresql')
+        unknown = self.settings_for('staging')
+        self.assertNotEqual(unknown.returncode, 0)
+        self.assertIn("Unknown DJANGO_PROFILE 'staging'", unknown.stderr)
+
+    def test_production_queue_has_a_consumer(self):
+        from django.urls import resolve
+        if self.settings_for('production', 'settings.TASK_QUEUE_EAGER').stdout.strip() == 'True':
+            return
+        # Nothing runs between requests on Vercel: a cron must drain the queue
+        with open(os.path.join(settings.BASE_DIR, 'vercel.json')) as handle:
+            crons = json.load(handle).get('crons', [])
+        runners = [cron for cron in crons if resolve(cron['path']).func is views.run_tasks_view]
+        self.assertTrue(runners, 'TASK_QUEUE_EAGER is off in production but no cron runs queued tasks')
+        self.assertEqual(runners[0]['schedule'], '* * * * *')
+
+    def test_local_backend_applies_pragmas(self):
+        from myproject.db.sqlite_wal.base import DatabaseWrapper
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        db = DatabaseWrapper({
+            **settings.DATABASES['default'], 'NAME': os.path.join(directory, 'wal.sqlite3'),
+            'OPTIONS': {'pragmas': {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'busy_timeout': 4321}},
+        }, 'wal-test')
+        self.addCleanup(db.close)
+        with db.cursor() as cursor:
+            pragmas = {}
+            for name in ('journal_mode', 'synchronous', 'busy_timeout'):
+                cursor.execute(f'PRAGMA {name}')
+                pragmas[name] = cursor.fetchone()[0]
+        # synchronous=NORMAL reads back as 1
+        self.assertEqual(pragmas, {'journal_mode': 'wal', 'synchronous': 1, 'busy_timeout': 4321})
+
+
+def start_fake_daraja(test):
+    """Point the gateway at a FakeDaraja for the rest of ``test``"""
+    from benchmarks.fake_daraja import FakeDaraja
+    from .mpesa import reset_gateway
+    cache.clear()
+    daraja = FakeDaraja().start()
+    test.addCleanup(daraja.stop)
+    daraja_settings = test.settings(MPESA_API_BASE_URL=daraja.base_url)
+    daraja_settings.enable()
+    test.addCleanup(daraja_settings.disable)
+    reset_gateway()
+    test.addCleanup(reset_gateway)
+    return daraja
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'], PAYMENT_JOURNAL_DIR='')
+class BenchmarkSuiteTests(TestCase):
+    def setUp(self):
+        self.daraja = start_fake_daraja(self)
+
+    def test_payment_flow_runs_against_fake_daraja(self):
+        from benchmarks import fixtures, runner
+        fixtures.seed(users=30, surveys=3, transactions=20)
+        CustomUser.objects.filter(is_premium=True).update(is_premium=False)
+        suite = runner.Suite(self.daraja, seeded_users=30)
+        results = suite.run(['initiate_payment', 'mpesa_callback', 'check_payment_status'], iterations=4, warmup=0)
+
+        self.assertEqual({view: r['errors'] for view, r in results.items()},
+                         {'initiate_payment': 0, 'mpesa_callback': 0, 'check_payment_status': 0})
+        self.assertEqual(len(self.daraja.pushes), MpesaTransaction.objects.count())
+        completed = MpesaTransaction.objects.filter(status='COMPLETED').values_list('checkout_request_id', flat=True)
+        self.assertTrue(set(completed) <= {push['CheckoutRequestID'] for push in self.daraja.pushes})
+        self.assertTrue(completed)
+
+    def test_percentile_and_compare(self):
+        from benchmarks import runner
+        self.assertEqual([runner.percentile([1, 2, 3, 4], pct) for pct in (50, 95, 100)], [2, 4, 4])
+        baseline = {'views': {'login': {'rps': 100.0, 'p50_ms': 10.0, 'p95_ms': 20.0, 'queries_per_request': 4}}}
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as handle:
+            json.dump(baseline, handle)
+        self.addCleanup(os.remove, handle.name)
+        rows = runner.compare({'login': {'rps': 150.0, 'p50_ms': 5.0, 'p95_ms': 20.0, 'queries_per_request': 4}},
+                              handle.name)
+        self.assertEqual([(metric, change) for view, metric, before, after, change in rows],
+                         [('rps', 50.0), ('p50_ms', -50.0), ('p95_ms', 0.0), ('queries_per_request', 0.0)])
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+                   REQUEST_METRICS_SAMPLE_RATE=1.0, REQUEST_METRICS_SERVER_TIMING=False)
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.registry.reset()
+        self.addCleanup(metrics.registry.reset)
+
+    def get(self):
+        return self.client.get('/auth/leaderboard/')
+
+    def test_sampled_requests_are_recorded(self):
+        with self.settings(REQUEST_METRICS_SAMPLE_RATE=0.25), \
+                mock.patch('myproject.middleware.random.random', side_effect=[0.1, 0.3, 0.2, 0.9]):
+            self.client = self.client_class()
+            for _ in range(4):
+                self.get()
+        self.assertEqual(metrics.registry.snapshot()['leaderboard']['requests'], 2)
+
+        with self.settings(REQUEST_METRICS_SAMPLE_RATE=0):
+            self.client = self.client_class()
+            self.get()
+        self.assertEqual(metrics.registry.snapshot()['leaderboard']['requests'], 2)
+
+    def test_server_timing_only_for_staff(self):
+        response = self.get()
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(metrics.registry.snapshot()['leaderboard']['requests'], 1)
+
+        member = CustomUser.objects.create_user(phone_number='712800001', pin='1234')
+        self.client.force_login(member, backend='authapp.backends.PhoneAuthBackend')
+        self.assertNotIn('Server-Timing', self.get())
+
+        staff = CustomUser.objects.create_user(phone_number='712800002', pin='1234', is_staff=True)
+        self.client.force_login(staff, backend='authapp.backends.PhoneAuthBackend')
+        self.assertRegex(self.get()['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries')
+
+    def test_server_timing_setting_opens_it_to_everyone(self):
+        with self.settings(REQUEST_METRICS_SERVER_TIMING=True):
+            self.client = self.client_class()
+            self.assertIn('total;dur=', self.get()['Server-Timing'])
+
+
+class LoggingPipelineTests(SimpleTestCase):
+    def setUp(self):
+        self.stream = io.StringIO()
+        self.handler = log.BackgroundQueueHandler(stream=self.stream)
+        self.handler.addFilter(log.RequestIdFilter())
+        self.logger = logging.getLogger('authapp.tests.pipeline')
+        self.logger.addHandler(self.handler)
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.addCleanup(self.logger.removeHandler, self.handler)
+
+    def emitted(self):
+        self.handler.close()
+        return [json.loads(line) for line in self.stream.getvalue().splitlines()]
+
+    def test_pins_and_phone_numbers_are_masked(self):
+        self.logger.info('Login pin=4821 from 0712345678')
+        self.logger.info('Payload %s for %s', {'phone_number': '254712345678', 'pin': '4821'}, '+254798765432')
+        self.logger.info('Push', extra={'PartyA': '254712345678', 'note': 'retry for 0798765432',
+                                        'body': {'confirmPin': '4821', 'amount': 79}})
+        entries = self.emitted()
+        output = self.stream.getvalue()
+        for secret in ('4821', '712345678', '798765432'):
+            self.assertNotIn(secret, output)
+        self.assertEqual(entries[0]['message'], 'Login pin=**** from 0712***678')
+        self.assertIn("'phone_number': '254712***678'", entries[1]['message'])
+        self.assertIn("'pin': '****'", entries[1]['message'])
+        self.assertEqual((entries[2]['PartyA'], entries[2]['note']), ('254712***678', 'retry for 0798***432'))
+        self.assertEqual(entries[2]['body'], {'confirmPin': '****', 'amount': 79})
+
+    def test_request_id_and_level(self):
+        token = log.request_id_var.set('req-1234abcd')
+        self.addCleanup(log.request_id_var.reset, token)
+        self.logger.warning('Slow callback')
+        [entry] = self.emitted()
+        self.assertEqual((entry['level'], entry['logger'], entry['request_id']),
+                         ('WARNING', 'authapp.tests.pipeline', 'req-1234abcd'))
+
+    def test_listener_starts_and_stops_cleanly(self):
+        thread = self.handler.listener._thread
+        self.assertTrue(thread.is_alive())
+        for n in range(200):
+            self.logger.info('Record %s', n)
+        self.assertEqual(len(self.emitted()), 200)
+        self.assertFalse(thread.is_alive())
+        self.assertIsNone(self.handler.listener._thread)
+        # logging.shutdown() closes handlers again at exit
+        self.handler.close()
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class AdminChangeListTests(TestCase):
+    def setUp(self):
+        for n in range(3):
+            CustomUser.objects.create_user(phone_number=f'71290000{n}', pin='1234')
+
+    def paginator(self, queryset):
+        return admin.EstimatedCountPaginator(queryset.order_by('pk'), 50)
+
+    def test_estimate_above_the_cap(self):
+        paginator = self.paginator(CustomUser.objects.all())
+        with mock.patch.object(admin.EstimatedCountPaginator, 'estimate', return_value=2500000), \
+                self.assertNumQueries(0):
+            self.assertEqual(paginator.count, 2500000)
+
+    def test_exact_count_below_the_cap(self):
+        with mock.patch.object(admin.EstimatedCountPaginator, 'estimate', return_value=1):
+            self.assertEqual(self.paginator(CustomUser.objects.all()).count, 3)
+        # No planner estimate off PostgreSQL
+        self.assertIsNone(self.paginator(CustomUser.objects.all()).estimate())
+
+    def test_filtered_count_is_capped(self):
+        filtered = CustomUser.objects.filter(is_premium=False)
+        with mock.patch.object(admin.EstimatedCountPaginator, 'count_cap', 2):
+            self.assertEqual(self.paginator(filtered).count, 2)
+        self.assertEqual(self.paginator(filtered).count, 3)
+
+    def test_changelists_only_filter_indexed_columns(self):
+        from django.contrib.admin import site
+        for model, model_admin in site._registry.items():
+            if not isinstance(model_admin, admin.FastChangeListAdmin):
+                continue
+            indexed = {index.fields[0].lstrip('-') for index in model._meta.indexes if not index.condition}
+            # Partial indexes serve filters on their condition's columns
+            indexed |= {lookup.split('__')[0] for index in model._meta.indexes if index.condition
+                        for lookup, value in index.condition.children}
+            indexed |= {f.name for f in model._meta.fields if f.db_index or f.unique or f.is_relation}
+            for name in model_admin.list_filter:
+                with self.subTest(model=model.__name__, filter=name):
+                    self.assertIn(name, indexed)
+
+    def test_user_changelist_renders(self):
+        staff = CustomUser.objects.create_user(phone_number='712900009', pin='1234', is_staff=True,
+                                               is_superuser=True)
+        self.client.force_login(staff, backend='authapp.backends.PhoneAuthBackend')
+        response = self.client.get('/admin/authapp/customuser/', {'is_premium__exact': '0'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cl'].result_count, 4)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class GrantPremiumTests(TestCase):
+    def test_grant_pays_upline_bonuses(self):
+        root = CustomUser.objects.create_user(phone_number='712400001', pin='1234')
+        parent = CustomUser.objects.create_user(phone_number='712400002', pin='1234', referred_by=root,
+                                                referral_path=referrals.path_for(root))
+        child = CustomUser.objects.create_user(phone_number='712400003', pin='1234', referred_by=parent,
+                                               referral_path=referrals.path_for(parent))
+        before = dict(CustomUser.objects.values_list('pk', 'balance'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(bulk.grant_premium([root.pk, child.pk]), 2)
+
+        balances = dict(CustomUser.objects.values_list('pk', 'balance'))
+        self.assertEqual(balances[root.pk], before[root.pk] + Decimal('500.00') + Decimal('20.00'))
+        self.assertEqual(balances[parent.pk], before[parent.pk] + Decimal('50.00'))
+        self.assertEqual(balances[child.pk], before[child.pk] + Decimal('500.00'))
+        referral_rows = Transaction.objects.filter(transaction_type='referral')
+        self.assertEqual(sorted(referral_rows.values_list('user_id', 'amount')),
+                         sorted([(root.pk, Decimal('20.00')), (parent.pk, Decimal('50.00'))]))
+
+        # Already premium: no second grant, no second bonus
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(bulk.grant_premium([child.pk]), 0)
+        self.assertEqual(referral_rows.count(), 2)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'], PAYMENT_JOURNAL_DIR='')
+class RetryFailedPaymentsTests(TestCase):
+    def setUp(self):
+        self.daraja = start_fake_daraja(self)
+
+    def test_each_worker_thread_pushes_on_its_own_session(self):
+        import requests
+        for n in range(6):
+            user = CustomUser.objects.create_user(phone_number=f'71240010{n}', pin='1234')
+            MpesaTransaction.objects.create(
+                user=user, phone_number=f'25471240010{n}', amount=79, status='FAILED',
+                checkout_request_id=f'ws_CO_OLD_{n}', merchant_request_id=f'MR-OLD-{n}',
+                account_reference='PREMIUM', transaction_desc='Premium',
+            )
+
+        used, request = {}, requests.Session.request
+
+        def tracking(session, *args, **kwargs):
+            used.setdefault(id(session), set()).add(threading.get_ident())
+            return request(session, *args, **kwargs)
+
+        with mock.patch.object(requests.Session, 'request', tracking):
+            sent, errors = bulk.retry_failed_payments(MpesaTransaction.objects.all(), concurrency=3)
+        self.assertEqual((sent, errors), (6, 0))
+        self.assertEqual(MpesaTransaction.objects.filter(status='PENDING').count(), 6)
+        self.assertEqual(len(self.daraja.pushes), 6)
+        self.assertTrue(all(len(threads) == 1 for threads in used.values()), used)
+
+
+class PartitionStatementTests(SimpleTestCase):
+    def quote(self, name):
+        return f'"{name}"'
+
+    def test_conversion_ddl(self):
+        index_defs = ['CREATE INDEX authapp_tra_created_idx ON public.authapp_transaction '
+                      'USING btree (created_at DESC)']
+        foreign_keys = [('authapp_tra_user_fk', 'FOREIGN KEY (user_id) REFERENCES authapp_customuser(id)')]
+        statements = partitions.partition_statements(
+            'authapp_transaction', index_defs, foreign_keys, datetime(2026, 8, 14, tzinfo=dt_timezone.utc),
+            41, self.quote, now=datetime(2026, 10, 19, tzinfo=dt_timezone.utc),
+        )
+        sql = [statement for statement, params in statements]
+        self.assertEqual(sql[:3], [
+            'ALTER TABLE "authapp_transaction" RENAME TO "authapp_transaction_unpartitioned"',
+            'CREATE TABLE "authapp_transaction" (LIKE "authapp_transaction_unpartitioned" '
+            'INCLUDING DEFAULTS INCLUDING IDENTITY) PARTITION BY RANGE ("created_at")',
+            'CREATE TABLE "authapp_transaction_default" PARTITION OF "authapp_transaction" DEFAULT',
+        ])
+        months = [params[0][:7] for statement, params in statements if 'FOR VALUES FROM' in statement]
+        self.assertEqual(months, ['2026-08', '2026-09', '2026-10', '2026-11', '2026-12', '2027-01'])
+        self.assertIn('ALTER TABLE "authapp_transaction" ADD PRIMARY KEY (id, "created_at")', sql)
+        self.assertEqual(statements[-3][1], ['authapp_transaction', 41])
+        self.assertEqual(sql[-2:], [
+            index_defs[0], 'ALTER TABLE "authapp_transaction" ADD CONSTRAINT "authapp_tra_user_fk" '
+            'FOREIGN KEY (user_id) REFERENCES authapp_customuser(id)',
+        ])
+
+    def test_refuses_unique_index_without_partition_column(self):
+        unique = ('CREATE UNIQUE INDEX authapp_tra_receipt_key ON public.authapp_transaction '
+                  'USING btree (mpesa_receipt)')
+        with self.assertRaises(ValueError):
+            partitions.partition_statements('authapp_transaction', [unique], [], None, None, self.quote)
+
+    def test_payments_stay_unpartitioned(self):
+        self.assertNotIn(MpesaTransaction._meta.db_table, partitions.PARTITIONED_TABLES)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'partitions need PostgreSQL')
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class PostgresPartitionTests(TestCase):
+    def test_tables(self):
+        self.assertTrue(partitions.is_partitioned(connection, 'authapp_transaction'))
+        self.assertFalse(partitions.is_partitioned(connection, 'authapp_mpesatransaction'))
+
+    def test_checkout_ids_stay_unique(self):
+        user = CustomUser.objects.create_user(phone_number='712500001', pin='1234')
+        fields = {'user': user, 'phone_number': '254712500001', 'amount': 1, 'checkout_request_id': 'ws_CO_1',
+                  'merchant_request_id': 'MR-1', 'account_reference': 'P', 'transaction_desc': 'P'}
+        MpesaTransaction.objects.create(**fields)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            MpesaTransaction.objects.create(**fields)
+
+    def test_new_partition_takes_rows_from_default(self):
+        user = CustomUser.objects.create_user(phone_number='712500002', pin='1234')
+        row = Transaction.objects.create(user=user, amount=5, transaction_type='earning', description='x')
+        Transaction.objects.filter(pk=row.pk).update(created_at=datetime(2001, 1, 15, tzinfo=dt_timezone.utc))
+
+        partitions.ensure_partition(connection, 'authapp_transaction', 2001, 1)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT id FROM authapp_transaction_p200101')
+            self.assertEqual(cursor.fetchall(), [(row.pk,)])
+            cursor.execute('SELECT count(*) FROM authapp_transaction_default WHERE id = %s', [row.pk])
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class LedgerRollupTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(phone_number='712550001', pin='1234')
+        Transaction.objects.all().delete()
+
+    def post(self, days_ago, amount, transaction_type='earning'):
+        row = Transaction.objects.create(user=self.user, amount=Decimal(amount), transaction_type=transaction_type,
+                                         description='x')
+        Transaction.objects.filter(pk=row.pk).update(created_at=timezone.now() - timedelta(days=days_ago))
+        return row
+
+    def test_chunked_advance_matches_rebuild(self):
+        for days_ago, amount, kind in [(3, '10.00', 'earning'), (3, '5.50', 'earning'), (3, '100.00', 'withdrawal'),
+                                       (2, '7.25', 'earning'), (1, '50.00', 'referral')]:
+            self.post(days_ago, amount, kind)
+        self.assertEqual(rollups.advance(chunk_size=2, lag=0), 5)
+        first = rollups.totals()
+
+        self.post(3, '4.50')
+        self.post(1, '1.00')
+        self.assertEqual(rollups.advance(chunk_size=2, lag=0), 2)
+        self.assertEqual(rollups.advance(chunk_size=2, lag=0), 0)
+        incremental = rollups.totals()
+        self.assertEqual(rollups.watermark(), Transaction.objects.order_by('-pk').first().pk)
+
+        self.assertEqual(rollups.rebuild(), 7)
+        self.assertEqual(rollups.totals(), incremental)
+        earnings = [r for r in incremental if r['transaction_type'] == 'earning']
+        self.assertEqual([(Decimal(r['total_amount']), r['transaction_count']) for r in earnings],
+                         [(Decimal('20.00'), 3), (Decimal('7.25'), 1), (Decimal('1.00'), 1)])
+        self.assertNotEqual(first, incremental)
+        self.assertEqual(LedgerRollup.objects.count(), 5)
+
+    def test_young_rows_wait_for_the_next_run(self):
+        self.post(1, '10.00')
+        young = Transaction.objects.create(user=self.user, amount=Decimal('3.00'), transaction_type='earning',
+                                           description='x')
+        self.assertEqual(rollups.advance(lag=60), 1)
+        self.assertLess(rollups.watermark(), young.pk)
+        self.assertEqual([r['transaction_count'] for r in rollups.totals()], [1])
+
+        Transaction.objects.filter(pk=young.pk).update(created_at=timezone.now() - timedelta(minutes=2))
+        self.assertEqual(rollups.advance(lag=60), 1)
+        self.assertEqual(sum(r['transaction_count'] for r in rollups.totals()), 2)
+
+    def test_weekly_totals_and_unknown_period(self):
+        self.post(1, '10.00')
+        self.post(1, '2.00')
+        rollups.advance(lag=0)
+        [week] = rollups.totals('week', transaction_type='earning')
+        self.assertEqual((Decimal(week['total_amount']), week['transaction_count']), (Decimal('12.00'), 2))
+        with self.assertRaises(ValueError):
+            rollups.totals('year')
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'], USER_CACHE_TTL=300)
+class StaleUserCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(phone_number='712600001', pin='1234')
+        self.client.force_login(self.user, backend='authapp.backends.PhoneAuthBackend')
+        usercache.get(self.user.pk)
+        # Changed behind the cache's back, as another worker's write would be
+        CustomUser.objects.filter(pk=self.user.pk).update(is_premium=True, balance=Decimal('100.00'))
+
+    def test_payment_reads_premium_status_from_database(self):
+        self.assertFalse(usercache.get(self.user.pk).is_premium)
+        response = self.client.post('/auth/initiate-premium-payment/', json.dumps({'phone_number': '712600001'}),
+                                    content_type='application/json')
+        self.assertEqual(response.json()['message'], 'You are already a premium member!')
+
+    def test_withdrawal_checks_stored_balance(self):
+        stale = usercache.get(self.user.pk)
+        self.assertEqual(stale.balance, Decimal('500.00'))
+        with self.assertRaises(ValueError):
+            stale.withdraw(Decimal('200.00'))
+        stale.withdraw(Decimal('60.00'))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, Decimal('40.00'))
+        self.assertTrue(self.user.is_premium)
+
+    def test_credits_do_not_overwrite_a_concurrent_withdrawal(self):
+        stale = usercache.get(self.user.pk)
+        CustomUser.objects.get(pk=self.user.pk).withdraw(Decimal('30.00'))
+        stale.add_earning(Decimal('5.00'))
+        stale.add_referral_bonus(Decimal('20.00'))
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.balance, self.user.total_earned, self.user.referral_bonus_earned),
+                         (Decimal('95.00'), Decimal('5.00'), Decimal('20.00')))
+        # Columns the credits don't own are left alone
+        self.assertTrue(self.user.is_premium)
+
+    def test_cached_copy_has_no_pin_hash(self):
+        user = CustomUser.objects.get(pk=self.user.pk)
+        cached = cache.get(usercache.CACHE_KEY.format(pk=self.user.pk))
+        self.assertNotIn('pin', cached.__dict__)
+        self.assertNotIn('password', cached.__dict__)
+        self.assertNotIn(user.pin.encode(), pickle.dumps(cached))
+        self.assertEqual(cached.get_session_auth_hash(), user.get_session_auth_hash())
+
+        # The session still verifies against the cached copy, without loading the user
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/auth/notifications/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([q['sql'] for q in queries if 'authapp_customuser' in q['sql']])
+        self.assertTrue(cached.check_pin('1234'))
+
+
+class StaticManifestTests(SimpleTestCase):
+    def test_committed_manifest_covers_templates(self):
+        """Production serves the committed collectstatic output; every {% static %} needs an entry"""
+        root = os.path.join(settings.BASE_DIR, 'staticfiles_build', 'static')
+        with open(os.path.join(root, 'staticfiles.json')) as handle:
+            paths = json.load(handle)['paths']
+        templates = os.path.join(settings.BASE_DIR, 'templates')
+        for name in os.listdir(templates):
+            with open(os.path.join(templates, name), encoding='utf-8') as handle:
+                for asset in re.findall(r"{%\s*static\s+'([^']+)'\s*%}", handle.read()):
+                    with self.subTest(template=name, asset=asset):
+                        self.assertIn(asset, paths, 'run DJANGO_PROFILE=production manage.py collectstatic')
+                        self.assertTrue(os.path.exists(os.path.join(root, paths[asset])))
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'], LANDING_PAGE_CACHE=True,
+                   LANDING_PAGE_MAX_AGE=300, BUILD_ID='test-build')
+class LandingPageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.key = LandingPageCacheMiddleware.CACHE_KEY.format(build='test-build')
+
+    def test_etag_round_trip(self):
+        first = self.client.get('/')
+        self.assertEqual(first.status_code, 200)
+        self.assertIsNotNone(cache.get(self.key))
+        with self.assertNumQueries(0):
+            second = self.client.get('/')
+            not_modified = self.client.get('/', HTTP_IF_NONE_MATCH=second['ETag'])
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['Cache-Control'], 'public, max-age=300')
+        self.assertIn('Cookie', second['Vary'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b'')
+        self.assertEqual(not_modified['ETag'], second['ETag'])
+
+        head = self.client.head('/')
+        self.assertEqual((head.content, int(head['Content-Length'])), (b'', len(first.content)))
+
+    def test_session_cookie_bypasses_the_copy(self):
+        user = CustomUser.objects.create_user(phone_number='712950001', pin='1234')
+        self.client.force_login(user, backend='authapp.backends.PhoneAuthBackend')
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIsNone(cache.get(self.key))
+
+    def test_logged_in_page_is_never_served_to_anonymous_visitors(self):
+        user = CustomUser.objects.create_user(phone_number='712950002', pin='1234')
+
+        def render(request):
+            name = request.user.phone_number if request.user.is_authenticated else 'guest'
+            return HttpResponse(f'Welcome, {name}')
+
+        middleware = LandingPageCacheMiddleware(render)
+        signed_in = RequestFactory().get('/')
+        signed_in.user = user
+        self.assertEqual(middleware(signed_in).content, b'Welcome, +254712950002')
+        self.assertIsNone(cache.get(self.key))
+
+        private = LandingPageCacheMiddleware(lambda request: HttpResponse('Yours', headers={'Cache-Control': 'private'}))
+        anonymous = RequestFactory().get('/')
+        anonymous.user = AnonymousUser()
+        private(anonymous)
+        self.assertIsNone(cache.get(self.key))
+
+        self.assertEqual(middleware(anonymous).content, b'Welcome, guest')
+        self.assertEqual(middleware(anonymous).content, b'Welcome, guest')
+        self.assertIsNotNone(cache.get(self.key))
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class DashboardFragmentTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(phone_number='712960001', pin='1234')
+        CustomUser.objects.filter(pk=self.user.pk).update(is_premium=True)
+        self.survey = Survey.objects.create(title='Mobile money habits', description='x',
+                                            reward_amount=Decimal('80.00'), estimated_time=5)
+        self.client.force_login(self.user, backend='authapp.backends.PhoneAuthBackend')
+
+    def dashboard(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/auth/dashboard/')
+        self.assertEqual(response.status_code, 200)
+        survey_queries = [q['sql'] for q in queries if 'FROM "authapp_survey"' in q['sql']]
+        return response.content.decode(), survey_queries
+
+    def test_fragment_is_cached_until_its_data_changes(self):
+        html, queried = self.dashboard()
+        self.assertIn('Mobile money habits', html)
+        self.assertTrue(queried)
+
+        html, queried = self.dashboard()
+        self.assertIn('Mobile money habits', html)
+        self.assertEqual(queried, [])
+
+        # A new survey bumps the catalogue version
+        Survey.objects.create(title='Matatu commute', description='x', reward_amount=Decimal('60.00'),
+                              estimated_time=4)
+        html, queried = self.dashboard()
+        self.assertIn('Matatu commute', html)
+        self.assertTrue(queried)
+
+        # Starting a survey bumps only this user's version
+        UserSurvey.objects.create(user=self.user, survey=self.survey, status='started')
+        html, queried = self.dashboard()
+        self.assertNotIn('Mobile money habits', html)
+        self.assertIn('Matatu commute', html)
+
+
+class SyntheticDataTests(TestCase):
+    def test_generated_tree_and_ledger_are_consistent(self):
+        from . import synthetic
+        counts = synthetic.populate(users=60, surveys=5, transactions=300, seed=7)
+        self.assertEqual(counts, {'surveys': 5, 'users': 60, 'transactions': 300})
+
+        users = {u.pk: u for u in CustomUser.objects.filter(phone_number__startswith=synthetic.PHONE_PREFIX)}
+        downlines = {pk: 0 for pk in users}
+        for user in users.values():
+            upline = referrals.upline_ids(user)
+            self.assertEqual(user.referred_by_id, upline[0] if upline else None)
+            for pk in upline:
+                downlines[pk] += 1
+        self.assertEqual({pk: u.downline_count for pk, u in users.items()}, downlines)
+        self.assertTrue(any(downlines.values()))
+
+        for row in Transaction.objects.filter(description__startswith='Synthetic').select_related('user'):
+            self.assertGreaterEqual(row.created_at, row.user.date_joined)
+
+        # Numbering continues after the existing synthetic users
+        self.assertEqual(synthetic.populate(users=2, surveys=0, seed=7)['users'], 2)
+        self.assertTrue(CustomUser.objects.filter(phone_number=f'{synthetic.PHONE_PREFIX}{61:08d}').exists())
+
+    def test_same_seed_same_ledger(self):
+        from . import synthetic
+        now = timezone.now()
+        joined = [now - timedelta(days=30)] * 3
+
+        def ledger(seed):
+            return list(synthetic.generate_transactions(50, random.Random(seed), now, [1, 2, 3], joined))
+
+        self.assertEqual(ledger(3), ledger(3))
+        self.assertNotEqual(ledger(3), ledger(4))
+
+    def test_rejects_values_outside_field_choices(self):
+        from . import synthetic
+        with self.assertRaises(ValueError):
+            synthetic.check_choices(Transaction, 'transaction_type', ['earning', 'lottery'])
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class SettlementTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(phone_number='712700001', pin='1234')
+        self.user.refresh_from_db()
+        survey = Survey.objects.create(title='Habits', description='x', reward_amount=Decimal('45.00'),
+                                       estimated_time=5)
+        self.response = UserSurvey.objects.create(user=self.user, survey=survey, status='completed')
+
+    def assertPaidOnce(self):
+        self.assertEqual(Transaction.objects.filter(user=self.user, transaction_type='earning').count(), 1)
+        user = CustomUser.objects.get(pk=self.user.pk)
+        self.assertEqual(user.balance, Decimal('545.00'))
+        self.assertEqual(user.total_earned, Decimal('45.00'))
+        self.assertEqual(user.surveys_completed, 1)
+
+    def test_settling_twice_pays_once(self):
+        self.assertEqual(settlement.settle()['rows'], 1)
+        self.assertEqual(settlement.settle()['rows'], 0)
+        self.assertPaidOnce()
+
+    def test_settle_skips_rows_paid_by_add_earning(self):
+        self.user.add_earning(Decimal('45.00'), user_survey=self.response)
+        self.assertEqual(settlement.settle()['rows'], 0)
+        self.assertPaidOnce()
+
+    def test_add_earning_refuses_settled_rows(self):
+        settlement.settle()
+        user = CustomUser.objects.get(pk=self.user.pk)
+        with self.assertRaises(ValueError):
+            user.add_earning(Decimal('45.00'), user_survey=self.response)
+        self.assertPaidOnce()
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class SurveyStateTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(phone_number='712710001', pin='1234')
+        self.surveys = [Survey.objects.create(title=f'Survey {n}', description='x', reward_amount=Decimal('30.00'),
+                                              estimated_time=5) for n in range(5)]
+
+    def response(self, n=0, **fields):
+        return UserSurvey.objects.create(user=self.user, survey=self.surveys[n], **fields)
+
+    def test_legal_transitions_persist(self):
+        response = self.response()
+        response.transition_to('started')
+        response.transition_to('in_progress')
+        response.transition_to('completed')
+        stored = UserSurvey.objects.get(pk=response.pk)
+        self.assertEqual(stored.status, 'completed')
+        self.assertIsNotNone(stored.started_at)
+        self.assertIsNotNone(stored.completed_at)
+
+        abandoned = self.response(1, status='abandoned')
+        abandoned.transition_to('started')
+        self.assertEqual(UserSurvey.objects.get(pk=abandoned.pk).status, 'started')
+
+    def test_illegal_transitions_raise(self):
+        for status, target in [('assigned', 'completed'), ('completed', 'started'), ('rejected', 'abandoned'),
+                               ('abandoned', 'completed')]:
+            with self.subTest(status=status, target=target):
+                UserSurvey.objects.filter(survey=self.surveys[0]).delete()
+                response = self.response(status=status)
+                with self.assertRaises(ValueError):
+                    response.transition_to(target)
+                self.assertEqual(response.status, status)
+
+    def test_save_refuses_a_status_set_by_hand(self):
+        self.response(status='completed')
+        stored = UserSurvey.objects.get(user=self.user)
+        stored.status = 'started'
+        with self.assertRaises(ValueError):
+            stored.save()
+        self.assertEqual(UserSurvey.objects.get(pk=stored.pk).status, 'completed')
+
+    def test_sweeper_expires_stale_rows_once(self):
+        old = timezone.now() - timedelta(days=2)
+        stale = self.response(0, status='started')
+        UserSurvey.objects.filter(pk=stale.pk).update(started_at=old)
+        legacy = self.response(1, status='in_progress')
+        UserSurvey.objects.filter(pk=legacy.pk).update(assigned_at=old)
+        fresh = self.response(2, status='started', started_at=timezone.now())
+        finished = self.response(3, status='completed')
+        UserSurvey.objects.filter(pk=finished.pk).update(started_at=old)
+        also_stale = self.response(4, status='started')
+        UserSurvey.objects.filter(pk=also_stale.pk).update(started_at=old)
+
+        self.assertEqual(sweeper.sweep(dry_run=True), 3)
+        self.assertEqual(sweeper.sweep(batch_size=1), 3)
+        statuses = dict(UserSurvey.objects.values_list('pk', 'status'))
+        self.assertEqual([statuses[r.pk] for r in (stale, legacy, fresh, finished, also_stale)],
+                         ['abandoned', 'abandoned', 'started', 'completed', 'abandoned'])
+        self.assertEqual(sweeper.sweep(), 0)
+
+        # Abandoned responses can be picked up again
+        revived = UserSurvey.objects.get(pk=stale.pk)
+        revived.transition_to('started')
+        self.assertEqual(sweeper.sweep(), 0)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'], FRAUD_FLAG_SCORE=50)
+class FraudScoringTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(phone_number='712720001', pin='1234')
+        self.honest = CustomUser.objects.create_user(phone_number='712720002', pin='1234')
+        now = timezone.now()
+        for n in range(4):
+            survey = Survey.objects.create(title=f'Survey {n}', description='x', reward_amount=Decimal('30.00'),
+                                           estimated_time=10)
+            # 20 seconds for a ten minute survey, every time
+            UserSurvey.objects.create(user=self.user, survey=survey, status='completed',
+                                      started_at=now - timedelta(seconds=20), completed_at=now)
+            UserSurvey.objects.create(user=self.honest, survey=survey, status='completed',
+                                      started_at=now - timedelta(minutes=9), completed_at=now)
+        for user in (self.user, self.honest):
+            Transaction.objects.create(user=user, amount=Decimal('120.00'), transaction_type='earning',
+                                       description='Surveys')
+
+    def test_fast_completions_are_flagged(self):
+        totals = fraud.advance(lag=0)
+        self.assertEqual(totals['flagged'], 1)
+        flag = FraudFlag.objects.get()
+        self.assertEqual(flag.user, self.user)
+        self.assertEqual(flag.status, 'open')
+        self.assertGreaterEqual(flag.score, 50)
+        self.assertEqual(flag.reasons, {'fast_ratio': 1.0})
+
+    def test_rerun_does_not_reflag_rows_past_the_watermark(self):
+        fraud.advance(lag=0)
+        FraudFlag.objects.update(status='cleared')
+
+        totals = fraud.advance(lag=0)
+        self.assertEqual((totals['rows'], totals['flagged']), (0, 0))
+        self.assertEqual(FraudFlag.objects.filter(status='open').count(), 0)
+
+        # New activity rescoring the user opens a fresh flag
+        Transaction.objects.create(user=self.user, amount=Decimal('30.00'), transaction_type='earning',
+                                   description='Survey')
+        totals = fraud.advance(lag=0)
+        self.assertEqual((totals['rows'], totals['flagged']), (1, 1))
+        self.assertEqual(FraudFlag.objects.filter(user=self.user, status='open').count(), 1)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'], PAYMENT_JOURNAL_DIR='',
+                   MPESA_MAX_PENDING_PUSHES=2, MPESA_PENDING_WINDOW=120)
+class PaymentIdempotencyTests(TestCase):
+    def setUp(self):
+        self.daraja = start_fake_daraja(self)
+        self.user = CustomUser.objects.create_user(phone_number='712730001', pin='1234')
+        self.client.force_login(self.user, backend='authapp.backends.PhoneAuthBackend')
+
+    def pay(self, key):
+        return self.client.post('/auth/initiate-premium-payment/', json.dumps({'phone_number': '254712730001'}),
+                                content_type='application/json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_repeated_key_sends_one_push(self):
+        first, repeat = self.pay('attempt-0001'), self.pay('attempt-0001')
+        self.assertEqual((first.status_code, repeat.status_code), (200, 200))
+        self.assertEqual(repeat.json(), first.json())
+        self.assertEqual(len(self.daraja.pushes), 1)
+        payment = MpesaTransaction.objects.get()
+        self.assertEqual((payment.idempotency_key, payment.checkout_request_id),
+                         ('attempt-0001', self.daraja.pushes[0]['CheckoutRequestID']))
+
+    def test_repeat_while_the_push_is_in_flight(self):
+        MpesaTransaction.objects.create(user=self.user, phone_number='254712730001', amount=79,
+                                        account_reference='PREMIUM', transaction_desc='Premium Activation',
+                                        idempotency_key='attempt-0001')
+        self.assertEqual(self.pay('attempt-0001').status_code, 409)
+        self.assertEqual(self.daraja.pushes, [])
+
+        # One left behind by a request that died mid-push stops blocking the key
+        MpesaTransaction.objects.update(created_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(self.pay('attempt-0001').status_code, 200)
+        self.assertEqual(len(self.daraja.pushes), 1)
+        self.assertEqual(MpesaTransaction.objects.count(), 1)
+
+    def test_pending_cap(self):
+        self.assertEqual([self.pay(f'attempt-000{n}').status_code for n in range(2)], [200, 200])
+        capped = self.pay('attempt-0002')
+        self.assertEqual(capped.status_code, 429)
+        self.assertEqual(capped['Retry-After'], '120')
+        self.assertEqual(len(self.daraja.pushes), 2)
+        self.assertEqual(MpesaTransaction.objects.count(), 2)
+        # A repeat of an accepted attempt is still answered
+        self.assertEqual(self.pay('attempt-0000').status_code, 200)
+
+    def test_failed_push_releases_the_key(self):
+        from .mpesa import MpesaGateway
+        with mock.patch.object(MpesaGateway, 'initiate_stk_push', return_value=(None, 'Request rejected')):
+            self.assertEqual(self.pay('attempt-0001').status_code, 400)
+        with mock.patch.object(MpesaGateway, 'initiate_stk_push', side_effect=ConnectionError):
+            self.assertEqual(self.pay('attempt-0001').status_code, 500)
+        self.assertFalse(MpesaTransaction.objects.exists())
+
+        self.assertEqual(self.pay('attempt-0001').status_code, 200)
+        self.assertEqual(len(self.daraja.pushes), 1)
+        self.assertEqual(MpesaTransaction.objects.get().status, 'PENDING')
+
+
+class CircuitTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_connection_check_fails_fast_while_open(self):
+        circuit.breaker('oauth').trip()
+        response = views.test_mpesa_connection(RequestFactory().get('/'))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(json.loads(response.content)['message'], circuit.DEGRADED_MESSAGE)
+        self.assertTrue(int(response['Retry-After']) > 0)
+
+    @override_settings(MPESA_TIMEOUT=(3.05, 10), CIRCUIT_OPEN_SECONDS=0)
+    def test_one_trial_while_a_request_can_still_be_in_flight(self):
+        breaker = circuit.breaker('stk_push')
+        self.assertGreater(breaker.probe_seconds, 3.05 + 10)
+        breaker.trip()
+        self.assertTrue(breaker.before_call())
+        with self.assertRaises(circuit.CircuitOpen):
+            breaker.before_call()
+        breaker.record(True, 0.2, trial=True)
+        self.assertEqual(breaker.state(), 'closed')
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'], PAYMENT_JOURNAL_DIR='')
+class ApplyCallbackTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(phone_number='712800001', pin='1234')
+        self.payment = payments.record_push(
+            self.user, '254712800001', 79, 'PREMIUM1', 'Premium Activation',
+            {'CheckoutRequestID': 'ws_CO_0000000002', 'MerchantRequestID': 'MR-0000-2'},
+        )
+
+    def test_duplicate_callbacks_activate_once(self):
+        # Both copies were loaded while the payment was still PENDING
+        first, second = (MpesaTransaction.objects.get(pk=self.payment.pk) for _ in range(2))
+        callback = parse(callback_body(checkout_request_id='ws_CO_0000000002'))
+        with self.captureOnCommitCallbacks(execute=True):
+            payments.apply_callback(callback, first)
+            settled = payments.apply_callback(callback, second)
+
+        self.assertEqual(settled.status, 'COMPLETED')
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.is_premium)
+        self.assertEqual(self.user.balance, Decimal('1000.00'))
+        self.assertEqual(Transaction.objects.filter(user=self.user, transaction_type='bonus').count(), 1)
+
+    def test_journal_check(self):
+        from .checks import check_payment_journal
+        with self.settings(PROFILE='production'):
+            self.assertEqual([w.id for w in check_payment_journal(None)], ['authapp.W001'])
+        with tempfile.NamedTemporaryFile() as blocker, self.settings(PAYMENT_JOURNAL_DIR=f'{blocker.name}/journal'):
+            self.assertEqual([w.id for w in check_payment_journal(None)], ['authapp.W002'])
+        with self.settings(PAYMENT_JOURNAL_DIR=tempfile.gettempdir()):
+            self.assertEqual(check_payment_journal(None), [])
+
+
+@tasks.task(max_attempts=2)
+def mark_task(name, fail=False):
+    """Test task: leaves a Watermark row behind, or fails"""
+    Watermark.objects.create(name=name)
+    if fail:
+        raise RuntimeError(f'{name} failed')
+
+
+@override_settings(TASK_QUEUE_EAGER=False, TASK_VISIBILITY_TIMEOUT=60)
+class TaskQueueTests(TestCase):
+    def expire(self, **changes):
+        """Move every task's deadlines into the past"""
+        past = timezone.now() - timedelta(seconds=1)
+        Task.objects.update(run_after=past, **changes)
+
+    def test_claim_reserves_the_task(self):
+        mark_task.delay('claimed')
+        row = tasks.claim()
+        self.assertEqual((row.status, row.attempts), ('running', 1))
+        self.assertGreater(row.locked_until, timezone.now())
+        self.assertIsNone(tasks.claim())
+
+        self.assertTrue(tasks.execute(row))
+        self.assertFalse(Task.objects.exists())
+        self.assertTrue(Watermark.objects.filter(name='claimed').exists())
+
+    def test_expired_claim_is_taken_over(self):
+        mark_task.delay('taken-over')
+        stale = tasks.claim()
+        self.expire(locked_until=timezone.now() - timedelta(seconds=1))
+        current = tasks.claim()
+        self.assertEqual((current.pk, current.attempts), (stale.pk, 2))
+
+        # The first worker finishing late rolls back instead of committing
+        self.assertFalse(tasks.execute(stale))
+        self.assertFalse(Watermark.objects.filter(name='taken-over').exists())
+        self.assertTrue(tasks.execute(current))
+        self.assertEqual(Watermark.objects.filter(name='taken-over').count(), 1)
+
+    def test_failing_task_retries_then_fails(self):
+        mark_task.delay('broken', fail=True)
+        self.assertFalse(tasks.execute(tasks.claim()))
+        row = Task.objects.get()
+        self.assertEqual((row.status, row.attempts), ('queued', 1))
+        self.assertGreater(row.run_after, timezone.now())
+        self.assertIsNone(tasks.claim())
+
+        self.expire()
+        self.assertFalse(tasks.execute(tasks.claim()))
+        row = Task.objects.get()
+        self.assertEqual((row.status, row.attempts), ('failed', 2))
+        self.assertIn('broken failed', row.last_error)
+        self.assertFalse(Watermark.objects.exists())
+        self.expire()
+        self.assertIsNone(tasks.claim())
+
+    def test_drain_stops_when_nothing_is_ready(self):
+        for name in ('first', 'second'):
+            mark_task.delay(name)
+        mark_task.delay('broken', fail=True)
+        self.assertEqual(tasks.drain(0), 0)
+        self.assertEqual(tasks.drain(30), 3)
+        self.assertEqual(set(Watermark.objects.values_list('name', flat=True)), {'first', 'second'})
+        # The failure waits out its backoff
+        self.assertEqual(Task.objects.get().status, 'queued')
+
+    @override_settings(CRON_SECRET='cron-secret', TASK_CRON_SECONDS=30)
+    def test_cron_endpoint(self):
+        mark_task.delay('from-cron')
+        self.assertEqual(self.client.get('/auth/cron/tasks/').status_code, 401)
+        self.assertEqual(self.client.get('/auth/cron/tasks/', HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+        with self.settings(CRON_SECRET=''):
+            self.assertEqual(self.client.get('/auth/cron/tasks/', HTTP_AUTHORIZATION='Bearer ').status_code, 401)
+        self.assertTrue(Task.objects.exists())
+
+        response = self.client.get('/auth/cron/tasks/', HTTP_AUTHORIZATION='Bearer cron-secret')
+        self.assertEqual(response.json(), {'success': True, 'tasks': 1, 'failed': 0, 'ready': 0})
+        self.assertFalse(Task.objects.exists())
+        self.assertTrue(Watermark.objects.filter(name='from-cron').exists())
+
+    def test_consumer_check(self):
+        from .checks import check_task_consumer
+        with self.settings(PROFILE='production', CRON_SECRET=''):
+            self.assertEqual([w.id for w in check_task_consumer(None)], ['authapp.W003'])
+        with self.settings(PROFILE='production', CRON_SECRET='cron-secret'):
+            self.assertEqual(check_task_consumer(None), [])
+        with self.settings(PROFILE='production', CRON_SECRET='', TASK_QUEUE_EAGER=True):
+            self.assertEqual(check_task_consumer(None), [])
+
+
+class BrokenSMSProvider(notifications.SMSProvider):
+    def send_many(self, messages):
+        raise ConnectionError('gateway down')
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+                   SMS_PROVIDER='authapp.notifications.FakeSMSProvider')
+class NotificationTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(phone_number='712600001', pin='1234')
+        notifications.FakeSMSProvider.sent.clear()
+
+    def test_earnings_coalesce_into_one_message(self):
+        notifications.emit_many([(self.user.pk, 'earning_posted', {'amount': 150})] * 3)
+        results = notifications.dispatch(coalesce_for=0)
+        self.assertEqual(results['in_app'], {'batches': 1, 'events': 3, 'messages': 1,
+                                             'seconds': results['in_app']['seconds']})
+        self.assertIn('Ksh 450.00 from 3 surveys', Notification.objects.get(user=self.user).body)
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_sms_outage_does_not_hold_back_in_app(self):
+        notifications.emit(self.user.pk, 'payout_completed', amount=200)
+        with self.settings(SMS_PROVIDER='authapp.tests.BrokenSMSProvider'):
+            results = notifications.dispatch(coalesce_for=0)
+        self.assertIn('gateway down', results['sms']['error'])
+        self.assertEqual(Notification.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(list(OutboxEvent.objects.values_list('channel', flat=True)), ['sms'])
+
+        notifications.dispatch(coalesce_for=0)
+        self.assertEqual(list(notifications.FakeSMSProvider.sent),
+                         [('+254712600001', 'Withdrawal sent: Ksh 200.00 has been sent to your M-Pesa.')])
+        self.assertEqual(Notification.objects.filter(user=self.user).count(), 1)
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_late_commit_is_still_delivered(self):
+        # The lower id commits after the higher one has been dispatched
+        late, early = notifications.emit_many([(self.user.pk, 'earning_posted', {'amount': 10}),
+                                               (self.user.pk, 'earning_posted', {'amount': 20})])
+        OutboxEvent.objects.filter(pk=late.pk).update(created_at=timezone.now() + timedelta(minutes=1))
+        self.assertEqual(notifications.dispatch(coalesce_for=0)['in_app']['events'], 1)
+
+        OutboxEvent.objects.filter(pk=late.pk).update(created_at=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(notifications.dispatch(coalesce_for=0)['in_app']['events'], 1)
+        self.assertEqual(sorted(Notification.objects.values_list('body', flat=True)),
+                         ['Ksh 10.00 has been added to your balance.', 'Ksh 20.00 has been added to your balance.'])
+
+    def test_sms_off_without_provider(self):
+        with self.settings(SMS_PROVIDER=''):
+            notifications.emit(self.user.pk, 'premium_activated')
+            self.assertEqual(list(OutboxEvent.objects.values_list('channel', flat=True)), ['in_app'])
+            self.assertEqual(list(notifications.dispatch(coalesce_for=0)), ['in_app'])
+            with self.assertRaises(ImproperlyConfigured):
+                notifications.sms_provider()
@@ -7,6 +7,13 @@ urlpatterns = [
     path('login/', views.login_view, name='login'),
     path('logout/', views.logout_view, name='logout'),
     path('dashboard/', views.dashboard_view, name='dashboard'),
+    path('referrals/', views.referral_stats_view, name='referral_stats'),
+    path('leaderboard/', views.leaderboard_view, name='leaderboard'),
+    path('notifications/', views.notifications_view, name='notifications'),
+    path('notifications/read/', views.mark_notifications_read, name='mark_notifications_read'),
+    path('metrics/', views.request_metrics_view, name='request_metrics'),
+    path('reports/ledger/', views.ledger_report_view, name='ledger_report'),
+    path('cron/tasks/', views.run_tasks_view, name='run_tasks'),
     path('activate-premium/', views.activate_premium_view, name='activate_premium'),
     path('debug-users/', views.debug_users, name='debug_users'),
     path('test-pin/', views.test_pin_verification, name='test_pin'),  # Add this
@@ -0,0 +1,76 @@
+# authapp/usercache.py
+"""
+Short-lived cache of ``CustomUser`` rows for ``PhoneAuthBackend.get_user``.
+
+Every authenticated request resolves ``request.user``; polling endpoints
+and the dashboard would otherwise load the full user row each time. Entries
+live for ``USER_CACHE_TTL`` seconds and are dropped after commit whenever
+the row changes: ``save``/``delete`` through the signals in
+``authapp.signals``, and queryset ``update()`` paths (bulk balance changes,
+referral counters) by calling ``invalidate`` themselves. The TTL bounds
+staleness for anything that slips past both.
+
+Invalidation only reaches the configured cache. With the default
+per-process LocMemCache, other workers keep their copy until the TTL
+expires, so several workers need a shared CACHE_BACKEND for the cache
+to stay current. Code that moves money or decides on premium status does
+not trust the cached row either way: it reloads those columns with
+``fresh``, and the balance methods on ``CustomUser`` lock and reload the
+row before writing.
+
+Cached copies leave out the PIN and password hashes. They keep the
+session auth hash so that session verification needs neither, and
+reading either field on a cached user loads it from the database.
+"""
+import copy
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from myproject import metrics
+from .models import CustomUser
+
+CACHE_KEY = 'user:{pk}'
+
+
+def ttl():
+    return getattr(settings, 'USER_CACHE_TTL', 30)
+
+
+def get(user_id):
+    """The user with ``user_id`` from the cache, loading it on a miss; None if it doesn't exist"""
+    if not ttl():
+        return CustomUser.objects.filter(pk=user_id).first()
+
+    key = CACHE_KEY.format(pk=user_id)
+    user = cache.get(key)
+    metrics.record_cache(user is not None)
+    if user is None:
+        user = CustomUser.objects.filter(pk=user_id).first()
+        if user is not None:
+            cache.set(key, cacheable(user), ttl())
+    return user
+
+
+def cacheable(user):
+    """Copy of ``user`` for the cache: the session auth hash instead of the PIN and password hashes"""
+    cached = copy.copy(user)
+    cached._session_auth_hash = user.get_session_auth_hash()
+    for field in ('pin', 'password'):
+        # Now deferred: loaded from the database if anything reads it
+        cached.__dict__.pop(field, None)
+    return cached
+
+
+def fresh(user, *fields):
+    """Reload ``fields`` (default: premium status and balance) of a possibly cached user from the database"""
+    user.refresh_from_db(fields=list(fields or ('is_premium', 'balance')))
+    return user
+
+
+def invalidate(user_ids):
+    """Drop cached users once the current transaction commits"""
+    keys = [CACHE_KEY.format(pk=pk) for pk in user_ids]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
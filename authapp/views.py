@@ -2,14 +2,13 @@
 from django.shortcuts import render, redirect
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.decorators import login_required
+from django.core.exceptions import ValidationError
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 import json
-import requests
-import base64
-from datetime import datetime
 import logging
 from .models import CustomUser, Survey, UserSurvey, Transaction, MpesaTransaction
+from . import fragments, idempotency, leaderboard, referrals, rollups, usercache
 
 logger = logging.getLogger(__name__)
 
@@ -42,171 +41,6 @@ def format_phone_number(phone_number):
         
         return phone_number
 
-# M-Pesa Gateway Class
-class MpesaGateway:
-    def __init__(self):
-        # PRODUCTION CREDENTIALS
-        self.consumer_key = '0VxpuiMStrKodudK2das68bxDGW7GduDHaAuLYJarUn0VJ8d'
-        self.consumer_secret = 'ji9gGA0u4aGH66wsqJaBEJ2rVn8wWNNfcUVthP65frDwMSkKSjIvhvAcdx0wU3p6'
-        self.shortcode = '5515540'  # Your production till number
-        self.passkey = '9d1c2d098353f5790d13f2faca56ebc8ff4c98e5970f307908e19f04e38ce54c'
-        
-        # IMPORTANT: Update this to your actual production domain
-        # This should be HTTPS and publicly accessible
-        self.callback_url = 'https://starrlnk.shop/auth/mpesa-callback/'
-        
-        # Production URLs
-        self.auth_url = "https://api.safaricom.co.ke/oauth/v1/generate?grant_type=client_credentials"
-        self.stk_push_url = "https://api.safaricom.co.ke/mpesa/stkpush/v1/processrequest"
-        
-        logger.info(f"M-Pesa Gateway initialized with shortcode: {self.shortcode}")
-    
-    def get_access_token(self):
-        """Get Daraja API access token for production"""
-        try:
-            auth = (self.consumer_key, self.consumer_secret)
-            response = requests.get(self.auth_url, auth=auth, timeout=30)
-            
-            if response.status_code == 200:
-                token_data = response.json()
-                access_token = token_data.get('access_token')
-                if access_token:
-                    logger.info("Successfully obtained production access token")
-                    return access_token
-                else:
-                    logger.error("No access_token in response")
-                    return None
-            else:
-                logger.error(f"Failed to get access token: Status {response.status_code}")
-                logger.error(f"Response: {response.text}")
-                return None
-        except requests.exceptions.Timeout:
-            logger.error("Access token request timeout")
-            return None
-        except Exception as e:
-            logger.error(f"Error getting access token: {str(e)}")
-            return None
-    
-    def get_timestamp(self):
-        """Get current timestamp in required format"""
-        return datetime.now().strftime('%Y%m%d%H%M%S')
-    
-    def generate_password(self, timestamp):
-        """Generate Daraja API password"""
-        data_to_encode = f"{self.shortcode}{self.passkey}{timestamp}"
-        encoded_string = base64.b64encode(data_to_encode.encode()).decode()
-        return encoded_string
-    
-    def initiate_stk_push(self, phone_number, amount, account_reference, transaction_desc):
-        """Initiate STK Push payment in production"""
-        try:
-            access_token = self.get_access_token()
-            if not access_token:
-                logger.error("Failed to obtain access token")
-                return None, "Payment service temporarily unavailable. Please try again in a few minutes."
-            
-            timestamp = self.get_timestamp()
-            password = self.generate_password(timestamp)
-            
-            headers = {
-                "Authorization": f"Bearer {access_token}",
-                "Content-Type": "application/json"
-            }
-            
-            # Format phone number for M-Pesa (254XXXXXXXXX)
-            phone_number = str(phone_number).strip()
-            
-            # Remove + if present
-            if phone_number.startswith('+'):
-                phone_number = phone_number[1:]
-            
-            # Ensure it's 12 digits starting with 254
-            if phone_number.startswith('0'):
-                phone_number = '254' + phone_number[1:]
-            elif phone_number.startswith('7') and len(phone_number) == 9:
-                phone_number = '254' + phone_number
-            elif phone_number.startswith('254'):
-                phone_number = phone_number
-            else:
-                return None, "Invalid phone number format. Please use format: 7XXXXXXXX"
-            
-            # Validate phone number length
-            if len(phone_number) != 12:
-                return None, "Phone number must be 12 digits (254XXXXXXXXX)"
-            
-            # Validate amount
-            try:
-                amount = int(amount)
-                if amount <= 0:
-                    return None, "Invalid amount"
-            except:
-                return None, "Invalid amount"
-            
-            # Prepare payload for PRODUCTION
-            payload = {
-                "BusinessShortCode": self.shortcode,
-                "Password": password,
-                "Timestamp": timestamp,
-                "TransactionType": "CustomerBuyGoodsOnline",  # For Till
-                "Amount": amount,
-                "PartyA": phone_number,
-                "PartyB": 4160709,
-                "PhoneNumber": phone_number,
-                "CallBackURL": self.callback_url,
-                "AccountReference": account_reference[:12],  # Max 12 chars
-                "TransactionDesc": transaction_desc[:13]  # Max 13 chars
-            }
-            
-            logger.info(f"Production STK Push payload for {phone_number}: Amount {amount}")
-            
-            # Make production API call
-            response = requests.post(
-                self.stk_push_url, 
-                json=payload, 
-                headers=headers, 
-                timeout=30
-            )
-            
-            logger.info(f"STK Push response status: {response.status_code}")
-            
-            if response.status_code == 200:
-                response_data = response.json()
-                logger.info(f"STK Push response data: {response_data}")
-                
-                if response_data.get('ResponseCode') == '0':
-                    logger.info(f"STK Push initiated successfully. MerchantRequestID: {response_data.get('MerchantRequestID')}")
-                    return response_data, None
-                else:
-                    error_code = response_data.get('ResponseCode')
-                    error_msg = response_data.get('CustomerMessage', 'Payment initiation failed')
-                    logger.error(f"STK Push failed with code {error_code}: {error_msg}")
-                    
-                    # User-friendly error messages
-                    if error_code == '1032':
-                        return None, "Request cancelled by user"
-                    elif error_code == '1037':
-                        return None, "Timeout - please try again"
-                    elif error_code == '1':
-                        return None, "Insufficient M-Pesa balance"
-                    elif error_code == '2001':
-                        return None, "Transaction declined"
-                    else:
-                        return None, f"Payment failed: {error_msg}"
-            else:
-                error_msg = f"API Error: Status {response.status_code}"
-                logger.error(f"{error_msg}. Response: {response.text}")
-                return None, "Payment service error. Please try again."
-                
-        except requests.exceptions.Timeout:
-            logger.error("STK Push request timeout")
-            return None, "Request timeout. Please try again."
-        except requests.exceptions.ConnectionError:
-            logger.error("STK Push connection error")
-            return None, "Network error. Please check your connection and try again."
-        except Exception as e:
-            logger.error(f"Unexpected error in STK Push: {str(e)}")
-            return None, "An unexpected error occurred. Please try again."
-
 # Simple Registration
 @csrf_exempt
 def register_view(request):
@@ -216,8 +50,9 @@ def register_view(request):
             phone_number = data.get('phoneNumber')
             pin = data.get('pin')
             confirm_pin = data.get('confirmPin')
+            referral_code = (data.get('referralCode') or '').strip().upper()
             
-            logger.info(f"Registration attempt - Phone: {phone_number}")
+            logger.info("Registration attempt - Phone: %s", phone_number)
             
             # Basic validation
             if pin != confirm_pin:
@@ -226,13 +61,27 @@ def register_view(request):
             if len(pin) != 4 or not pin.isdigit():
                 return JsonResponse({'success': False, 'message': 'PIN must be 4 digits'})
             
+            # Attach the referrer's upline path up front so signup is a single insert
+            extra_fields = {}
+            if referral_code:
+                referrer = CustomUser.objects.filter(
+                    referral_code=referral_code
+                ).only('id', 'referral_path').first()
+                if referrer:
+                    extra_fields = {
+                        'referred_by': referrer,
+                        'referral_path': referrals.path_for(referrer),
+                    }
+            
             # Create user using the manager
             user = CustomUser.objects.create_user(
                 phone_number=phone_number,
-                pin=pin
+                pin=pin,
+                **extra_fields
             )
+            referrals.record_signup_task.delay(user.pk)
             
-            logger.info(f"User created successfully: {user.phone_number}")
+            logger.info("User created successfully: %s", user.phone_number)
             
             # Auto-login after registration
             login(request, user, backend='authapp.backends.PhoneAuthBackend')
@@ -246,7 +95,7 @@ def register_view(request):
         except ValueError as e:
             return JsonResponse({'success': False, 'message': str(e)})
         except Exception as e:
-            logger.error(f"Registration error: {e}")
+            logger.error("Registration error: %s", e)
             return JsonResponse({'success': False, 'message': 'Registration failed. Please try again.'})
     
     return render(request, 'register.html')
@@ -260,7 +109,7 @@ def login_view(request):
             phone_number = data.get('phoneNumber')
             pin = data.get('pin')
             
-            logger.info(f"Login attempt - Phone: {phone_number}")
+            logger.info("Login attempt - Phone: %s", phone_number)
             
             # Format phone number consistently
             formatted_phone = format_phone_number(phone_number)
@@ -270,7 +119,7 @@ def login_view(request):
             
             if user is not None:
                 login(request, user)
-                logger.info(f"Login successful: {user.phone_number}")
+                logger.info("Login successful: %s", user.phone_number)
                 return JsonResponse({
                     'success': True, 
                     'message': 'Login successful!',
@@ -297,7 +146,7 @@ def login_view(request):
                     })
                 
         except Exception as e:
-            logger.error(f"Login error: {e}")
+            logger.error("Login error: %s", e)
             return JsonResponse({
                 'success': False, 
                 'message': 'An error occurred. Please try again.'
@@ -315,13 +164,14 @@ def logout_view(request):
 def dashboard_view(request):
     user = request.user
     
-    # Get available surveys (only show if user is premium)
+    # Get available surveys (only show if user is premium). The queryset is
+    # lazy and only runs when the cached survey fragment is re-rendered.
     if user.is_premium:
         available_surveys = Survey.objects.filter(
             is_active=True
         ).exclude(
-            usersurvey__user=user,
-            usersurvey__status__in=['started', 'completed']
+            user_surveys__user=user,
+            user_surveys__status__in=['started', 'completed']
         )[:5]
     else:
         available_surveys = []
@@ -338,10 +188,154 @@ def dashboard_view(request):
         'total_earnings': total_earnings,
         'current_balance': current_balance,
         'is_premium': user.is_premium,
+        'fragment_version': fragments.version(user),
     }
     
     return render(request, 'dashboard.html', context)
 
+# Referral Stats
+@login_required
+def referral_stats_view(request):
+    """Downline count and referral earnings for the current user"""
+    return JsonResponse({'success': True, **referrals.downline_stats(request.user)})
+
+# Notification Feed
+@login_required
+def notifications_view(request):
+    """The user's in-app notifications, newest first, paged by id (?before=<id>&limit=<n>)"""
+    from .models import Notification
+    from .notifications import FEED_PAGE_SIZE, feed
+    
+    try:
+        page, next_before = feed(request.user, request.GET.get('before') or None,
+                                 request.GET.get('limit') or FEED_PAGE_SIZE)
+    except ValueError:
+        return JsonResponse({'success': False, 'message': 'before and limit must be numbers'}, status=400)
+    
+    return JsonResponse({
+        'success': True,
+        'notifications': [
+            {
+                'id': n.pk,
+                'kind': n.kind,
+                'title': n.title,
+                'body': n.body,
+                'created_at': n.created_at.isoformat(),
+                'read': n.read_at is not None,
+            }
+            for n in page
+        ],
+        'next_before': next_before,
+        'unread': Notification.objects.filter(user=request.user, read_at__isnull=True).count(),
+    })
+
+# Mark Notifications Read
+@login_required
+@csrf_exempt
+def mark_notifications_read(request):
+    """Mark the user's notifications up to ``up_to`` (all if omitted) as read"""
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'message': 'Invalid method'}, status=405)
+    
+    from django.utils import timezone
+    from .models import Notification
+    
+    try:
+        data = json.loads(request.body or b'{}')
+        unread = Notification.objects.filter(user=request.user, read_at__isnull=True)
+        if data.get('up_to') is not None:
+            unread = unread.filter(pk__lte=int(data['up_to']))
+    except (ValueError, TypeError, AttributeError):
+        return JsonResponse({'success': False, 'message': 'up_to must be a notification id'}, status=400)
+    
+    return JsonResponse({'success': True, 'marked': unread.update(read_at=timezone.now())})
+
+# Public Leaderboard
+def leaderboard_view(request):
+    """Top referrers or earners, served from the cache only"""
+    board = request.GET.get('board', 'referrers')
+    if board not in leaderboard.BOARDS:
+        return JsonResponse({
+            'success': False,
+            'message': f"Unknown board. Choose one of: {', '.join(leaderboard.BOARDS)}"
+        }, status=400)
+    
+    return JsonResponse({
+        'success': True,
+        'board': board,
+        'entries': leaderboard.top(board),
+        'updated_at': leaderboard.rebuilt_at(),
+    })
+
+# Request Metrics (staff only)
+@login_required
+def request_metrics_view(request):
+    """Per-view request histograms collected by RequestMetricsMiddleware in this process, plus M-Pesa circuit states"""
+    if not request.user.is_staff:
+        return JsonResponse({'success': False, 'message': 'Staff only'}, status=403)
+    
+    from myproject.metrics import registry
+    from . import circuit
+    if request.method == 'POST' and request.GET.get('reset'):
+        registry.reset()
+    
+    return JsonResponse({
+        'success': True,
+        'since': registry.since,
+        'views': registry.snapshot(),
+        'circuits': circuit.snapshot(),
+    })
+
+# Ledger Report (staff only)
+@login_required
+def ledger_report_view(request):
+    """Ledger totals by transaction type per day, week or month, served from the rollup table"""
+    if not request.user.is_staff:
+        return JsonResponse({'success': False, 'message': 'Staff only'}, status=403)
+    
+    try:
+        rows = rollups.totals(
+            period=request.GET.get('period', 'day'),
+            start=request.GET.get('from') or None,
+            end=request.GET.get('to') or None,
+            transaction_type=request.GET.get('type') or None,
+        )
+    except (ValueError, ValidationError) as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+    
+    return JsonResponse({
+        'success': True,
+        'watermark': rollups.watermark(),
+        'rows': rows,
+    })
+
+# Task queue runner, called by the Vercel cron (see vercel.json)
+def run_tasks_view(request):
+    """Run queued background tasks for up to TASK_CRON_SECONDS; needs the CRON_SECRET bearer token"""
+    import hmac
+    from django.conf import settings
+    from . import tasks
+    
+    secret = settings.CRON_SECRET
+    if not secret or not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {secret}'):
+        return JsonResponse({'success': False, 'message': 'Unauthorized'}, status=401)
+    if request.method != 'GET':
+        return JsonResponse({'success': False, 'message': 'Invalid request method'}, status=405)
+    
+    failed = []
+    
+    def report(task, ok, seconds):
+        if not ok:
+            failed.append(task.pk)
+    
+    done = tasks.drain(settings.TASK_CRON_SECONDS, on_task=report)
+    return JsonResponse({
+        'success': True,
+        'tasks': done,
+        'failed': len(failed),
+        'ready': tasks.ready().count(),
+    })
+
 # Premium Activation Page
 @login_required
 def activate_premium_view(request):
@@ -354,7 +348,7 @@ def initiate_premium_payment(request):
     """Initiate M-Pesa STK Push for premium activation"""
     if request.method == 'POST':
         try:
-            user = request.user
+            user = usercache.fresh(request.user)
             
             if user.is_premium:
                 return JsonResponse({
@@ -371,57 +365,13 @@ def initiate_premium_payment(request):
                     'message': 'Phone number is required'
                 })
             
-            # Amount for premium activation
-            amount = 79
-            
-            # Generate unique reference
-            import time
-            timestamp = int(time.time())
-            account_reference = f"PREMIUM{user.id}"
-            transaction_desc = f"Premium Activation"
-            
-            # Initialize M-Pesa gateway
-            mpesa = MpesaGateway()
-            
-            # Log the attempt
-            logger.info(f"Production payment initiation for user {user.id}, phone: {phone_number}")
-            
-            # Initiate STK Push
-            response, error = mpesa.initiate_stk_push(
-                phone_number=phone_number,
-                amount=amount,
-                account_reference=account_reference,
-                transaction_desc=transaction_desc
-            )
-            
-            if error:
-                logger.error(f"Production STK Push failed: {error}")
-                return JsonResponse({
-                    'success': False,
-                    'message': error
-                }, status=400)
-            
-            # Save transaction to database
-            transaction = MpesaTransaction.objects.create(
-                user=user,
-                phone_number=phone_number,
-                amount=amount,
-                checkout_request_id=response.get('CheckoutRequestID'),
-                merchant_request_id=response.get('MerchantRequestID'),
-                account_reference=account_reference,
-                transaction_desc=transaction_desc,
-                status='PENDING'
-            )
+            # Repeats of one payment attempt (double taps, retries) share a key
+            try:
+                key = idempotency.key_from(request, data)
+            except ValueError as e:
+                return JsonResponse({'success': False, 'message': str(e)}, status=400)
             
-            logger.info(f"Production payment initiated successfully: CheckoutID: {response.get('CheckoutRequestID')}")
-            
-            return JsonResponse({
-                'success': True,
-                'message': 'Payment initiated successfully. Check your phone to enter M-Pesa PIN.',
-                'checkout_request_id': response.get('CheckoutRequestID'),
-                'transaction_id': transaction.id,
-                'merchant_request_id': response.get('MerchantRequestID')
-            })
+            return _start_premium_payment(user, phone_number, key)
             
         except json.JSONDecodeError:
             logger.error("Invalid JSON in payment request")
@@ -430,7 +380,7 @@ def initiate_premium_payment(request):
                 'message': 'Invalid request data'
             }, status=400)
         except Exception as e:
-            logger.error(f"Payment initiation error: {str(e)}")
+            logger.error("Payment initiation error: %s", e)
             return JsonResponse({
                 'success': False,
                 'message': 'An error occurred. Please try again.'
@@ -441,87 +391,148 @@ def initiate_premium_payment(request):
         'message': 'Invalid request method'
     }, status=405)
 
+def _start_premium_payment(user, phone_number, key):
+    """
+    Send the STK push and record it, unless the user already has too many
+    pending or ``key`` belongs to an earlier request.
+
+    The MpesaTransaction is inserted before the push, with the user's row
+    locked, so concurrent requests see each other's rows both in the
+    pending count and in the unique (user, idempotency_key) constraint.
+    Its checkout_request_id stays null until Daraja accepts the push; a
+    failed push deletes it again.
+    """
+    from django.conf import settings
+    from django.db import transaction as db_transaction
+    from django.utils import timezone
+    
+    # Amount for premium activation
+    amount = 79
+    
+    account_reference = f"PREMIUM{user.id}"
+    transaction_desc = f"Premium Activation"
+    
+    # Cap pushes still awaiting a callback; M-Pesa prompts expire within the window
+    window = settings.MPESA_PENDING_WINDOW
+    since = timezone.now() - timezone.timedelta(seconds=window)
+    with db_transaction.atomic():
+        user.lock_for_update('is_premium')
+        if user.is_premium:
+            return JsonResponse({
+                'success': False,
+                'message': 'You are already a premium member!'
+            })
+        
+        # Rows left behind by a request that died before Daraja answered
+        MpesaTransaction.objects.filter(user=user, checkout_request_id__isnull=True, created_at__lt=since).delete()
+        
+        if key:
+            previous = MpesaTransaction.objects.filter(user=user, idempotency_key=key).first()
+            if previous and previous.checkout_request_id is None:
+                return JsonResponse({
+                    'success': False,
+                    'message': 'This payment request is already being processed. Check your phone.'
+                }, status=409)
+            if previous:
+                return JsonResponse(_push_response(previous))
+        
+        pending = MpesaTransaction.objects.filter(user=user, status='PENDING', created_at__gte=since).count()
+        if pending >= settings.MPESA_MAX_PENDING_PUSHES:
+            response = JsonResponse({
+                'success': False,
+                'message': 'You have payment requests waiting on your phone. Complete or cancel them, then try again.'
+            }, status=429)
+            response['Retry-After'] = str(window)
+            return response
+        
+        payment = MpesaTransaction.objects.create(
+            user=user, phone_number=phone_number, amount=amount, account_reference=account_reference,
+            transaction_desc=transaction_desc, idempotency_key=key, status='PENDING',
+        )
+    
+    # Imported lazily so cold starts don't pay for the HTTP client
+    from . import circuit
+    from .mpesa import get_gateway
+    mpesa = get_gateway()
+    
+    # Log the attempt
+    logger.info("Production payment initiation for user %s, phone: %s", user.id, phone_number)
+    
+    # Initiate STK Push
+    try:
+        response, error = mpesa.initiate_stk_push(
+            phone_number=phone_number,
+            amount=amount,
+            account_reference=account_reference,
+            transaction_desc=transaction_desc
+        )
+    except Exception:
+        payment.delete()
+        raise
+    
+    if error:
+        # Nothing was sent; free the key and the pending slot for a retry
+        payment.delete()
+    
+    if error == circuit.DEGRADED_MESSAGE:
+        # Daraja is failing; answer at once and tell the client when to retry
+        response = JsonResponse({'success': False, 'message': error}, status=503)
+        response['Retry-After'] = str(settings.CIRCUIT_OPEN_SECONDS)
+        return response
+    
+    if error:
+        logger.error("Production STK Push failed: %s", error)
+        return JsonResponse({
+            'success': False,
+            'message': error
+        }, status=400)
+    
+    # Journal the push and save the transaction
+    from .payments import record_push
+    payment = record_push(user, phone_number, amount, account_reference, transaction_desc, response, payment)
+    
+    logger.info("Production payment initiated successfully: CheckoutID: %s", payment.checkout_request_id)
+    
+    return JsonResponse(_push_response(payment))
+
+def _push_response(payment):
+    """Response body for an accepted push, also replayed to repeats of its idempotency key"""
+    return {
+        'success': True,
+        'message': 'Payment initiated successfully. Check your phone to enter M-Pesa PIN.',
+        'checkout_request_id': payment.checkout_request_id,
+        'transaction_id': payment.id,
+        'merchant_request_id': payment.merchant_request_id
+    }
+
 # M-Pesa Callback Handler
 @csrf_exempt
 def mpesa_callback(request):
     """Handle Daraja API callback for payment confirmation in production"""
     if request.method == 'POST':
+        from . import journal
+        from .callbacks import CallbackError, parse
+        from .payments import apply_callback
+        
+        # Journal the raw body first, so it can be replayed even if parsing or applying fails
+        journal.record('callback', request.body.decode('utf-8', errors='replace'))
+        
         try:
-            data = json.loads(request.body)
-            logger.info(f"Production callback received: {data}")
-            
-            callback_data = data.get('Body', {}).get('stkCallback', {})
-            
-            checkout_request_id = callback_data.get('CheckoutRequestID')
-            result_code = callback_data.get('ResultCode')
-            result_desc = callback_data.get('ResultDesc')
-            
-            logger.info(f"Production callback - CheckoutID: {checkout_request_id}, Result: {result_code}")
-            
-            # Find transaction
-            try:
-                transaction = MpesaTransaction.objects.get(
-                    checkout_request_id=checkout_request_id
-                )
-                
-                logger.info(f"Found production transaction for user: {transaction.user.id}")
-                
-                if result_code == 0:
-                    # Payment successful
-                    transaction.status = 'COMPLETED'
-                    transaction.result_code = result_code
-                    transaction.result_desc = result_desc
-                    
-                    # Extract M-Pesa receipt details
-                    callback_metadata = callback_data.get('CallbackMetadata', {}).get('Item', [])
-                    receipt_number = None
-                    for item in callback_metadata:
-                        if item.get('Name') == 'MpesaReceiptNumber':
-                            receipt_number = item.get('Value')
-                            transaction.mpesa_receipt = receipt_number
-                        elif item.get('Name') == 'PhoneNumber':
-                            transaction.phone_number = item.get('Value')
-                        elif item.get('Name') == 'Amount':
-                            transaction.amount = item.get('Value')
-                        elif item.get('Name') == 'TransactionDate':
-                            transaction.transaction_date = item.get('Value')
-                    
-                    transaction.save()
-                    
-                    # Activate premium for user
-                    user = transaction.user
-                    if not user.is_premium:
-                        logger.info(f"Activating premium for user in production: {user.id}")
-                        user.activate_premium()
-                        user.save()
-                        
-                        logger.info(f"Production premium activated for user: {user.username}")
-                    
-                    logger.info(f"Production payment completed. Receipt: {receipt_number}")
-                    
-                else:
-                    # Payment failed
-                    transaction.status = 'FAILED'
-                    transaction.result_code = result_code
-                    transaction.result_desc = result_desc
-                    transaction.save()
-                    
-                    logger.warning(f"Production payment failed for user: {transaction.user.username}, Reason: {result_desc}")
-                
-            except MpesaTransaction.DoesNotExist:
-                logger.error(f"Production transaction not found: {checkout_request_id}")
-            except Exception as e:
-                logger.error(f"Error processing production callback: {str(e)}")
-            
-            # Always return success to Daraja API
-            return JsonResponse({'ResultCode': 0, 'ResultDesc': 'Success'})
-            
-        except json.JSONDecodeError as e:
-            logger.error(f"Invalid callback JSON in production: {str(e)}")
-            return JsonResponse({'ResultCode': 1, 'ResultDesc': 'Invalid JSON'}, status=400)
+            callback = parse(request.body)
+        except CallbackError as e:
+            logger.error("Rejected M-Pesa callback: %s", e)
+            return JsonResponse({'ResultCode': 1, 'ResultDesc': 'Invalid callback'}, status=400)
+        
+        logger.info("Production callback - CheckoutID: %s, Result: %s",
+                    callback.checkout_request_id, callback.result_code)
+        
+        try:
+            apply_callback(callback)
         except Exception as e:
-            logger.error(f"Production callback error: {str(e)}")
-            return JsonResponse({'ResultCode': 1, 'ResultDesc': 'Server error'}, status=500)
+            logger.error("Error processing production callback: %s", e)
+        
+        # Always return success to Daraja API for well-formed callbacks
+        return JsonResponse({'ResultCode': 0, 'ResultDesc': 'Success'})
     
     return JsonResponse({'ResultCode': 1, 'ResultDesc': 'Invalid method'}, status=405)
 
@@ -548,7 +559,7 @@ def check_payment_status(request):
                 )
                 
                 # Check if user is already premium (in case callback was successful)
-                if request.user.is_premium:
+                if usercache.fresh(request.user, 'is_premium').is_premium:
                     return JsonResponse({
                         'success': True,
                         'status': 'COMPLETED',
@@ -576,7 +587,7 @@ def check_payment_status(request):
                 'message': 'Invalid request data'
             })
         except Exception as e:
-            logger.error(f"Check payment status error: {str(e)}")
+            logger.error("Check payment status error: %s", e)
             return JsonResponse({
                 'success': False,
                 'message': 'An error occurred'
@@ -592,8 +603,15 @@ def check_payment_status(request):
 def test_mpesa_connection(request):
     """Test M-Pesa connection and credentials"""
     if request.method == 'GET':
-        mpesa = MpesaGateway()
-        token = mpesa.get_access_token()
+        from . import circuit
+        from .mpesa import get_gateway
+        mpesa = get_gateway()
+        try:
+            token = mpesa.get_access_token()
+        except circuit.CircuitOpen as e:
+            response = JsonResponse({'success': False, 'message': circuit.DEGRADED_MESSAGE}, status=503)
+            response['Retry-After'] = str(e.retry_after)
+            return response
         
         if token:
             return JsonResponse({
@@ -0,0 +1,9 @@
+"""
+End-to-end benchmarks for the authapp views.
+
+Run with ``python manage.py bench``; see
+``authapp/management/commands/bench.py`` for the options. The suite
+seeds a throwaway test database, points the M-Pesa gateway at a local
+fake Daraja server and drives every view through the full middleware
+stack.
+"""
@@ -0,0 +1,128 @@
+"""
+Local stand-in for the Safaricom Daraja API.
+
+Serves the OAuth and STK push endpoints the gateway calls, remembers
+every push it accepted and builds the matching ``stkCallback`` bodies
+so the callback view can be driven with realistic payloads.
+"""
+import itertools
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Result codes Daraja sends back in stkCallback, with their descriptions
+RESULT_CODES = {
+    0: 'The service request is processed successfully.',
+    1: 'The balance is insufficient for the transaction.',
+    1032: 'Request cancelled by user.',
+    1037: 'DS timeout user cannot be reached.',
+    2001: 'The initiator information is invalid.',
+}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out as separate writes; don't let Nagle delay them
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path.startswith('/oauth/v1/generate'):
+            self._send(200, {'access_token': 'fake-access-token', 'expires_in': '3599'})
+        else:
+            self._send(404, {'errorMessage': 'Not found'})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        if self.path != '/mpesa/stkpush/v1/processrequest':
+            self._send(404, {'errorMessage': 'Not found'})
+            return
+        self._send(200, self.server.daraja.accept_push(request))
+
+
+class FakeDaraja:
+    """Threaded HTTP server on 127.0.0.1; use as a context manager"""
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.daraja = self
+        self._thread = None
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.pushes = []
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def accept_push(self, request):
+        with self._lock:
+            n = next(self._ids)
+            push = {
+                'MerchantRequestID': f'FAKE-MR-{n}',
+                'CheckoutRequestID': f'ws_CO_FAKE_{n:010d}',
+                'PhoneNumber': request.get('PhoneNumber'),
+                'Amount': request.get('Amount'),
+            }
+            self.pushes.append(push)
+        return {
+            'MerchantRequestID': push['MerchantRequestID'],
+            'CheckoutRequestID': push['CheckoutRequestID'],
+            'ResponseCode': '0',
+            'ResponseDescription': 'Success. Request accepted for processing',
+            'CustomerMessage': 'Success. Request accepted for processing',
+        }
+
+    def callback_for(self, push, result_code=0):
+        """The stkCallback body Daraja would POST for ``push``"""
+        callback = {
+            'MerchantRequestID': push['MerchantRequestID'],
+            'CheckoutRequestID': push['CheckoutRequestID'],
+            'ResultCode': result_code,
+            'ResultDesc': RESULT_CODES.get(result_code, 'Unknown result'),
+        }
+        if result_code == 0:
+            receipt = 'FK' + push['CheckoutRequestID'][-8:]
+            callback['CallbackMetadata'] = {'Item': [
+                {'Name': 'Amount', 'Value': push['Amount']},
+                {'Name': 'MpesaReceiptNumber', 'Value': receipt},
+                {'Name': 'Balance'},
+                {'Name': 'TransactionDate', 'Value': 20260101120000},
+                {'Name': 'PhoneNumber', 'Value': int(push['PhoneNumber'])},
+            ]}
+        return {'Body': {'stkCallback': callback}}
+
+    def emit_callbacks(self, client, path='/auth/mpesa-callback/', result_code=0):
+        """POST a callback for every accepted push through a Django test client"""
+        return [
+            client.post(path, data=self.callback_for(push, result_code), content_type='application/json')
+            for push in list(self.pushes)
+        ]
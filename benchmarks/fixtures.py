@@ -0,0 +1,78 @@
+"""
+Seed data for benchmark runs.
+
+Everything is written with ``bulk_create`` and every user shares one
+precomputed PIN hash, so seeding thousands of rows takes seconds.
+"""
+import random
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.utils import timezone
+
+from authapp.models import CustomUser, Survey, Transaction
+
+PIN = '1234'
+BATCH_SIZE = 1000
+
+
+def phone_for(n):
+    """Deterministic, valid Kenyan number for the n-th seeded user"""
+    return f'+2547{n:08d}'
+
+
+def seed(users=1000, surveys=50, transactions=10000, seed=0):
+    """Insert ``users`` users, ``surveys`` surveys and ``transactions`` ledger rows"""
+    rng = random.Random(seed)
+    now = timezone.now()
+    pin_hash = make_password(PIN)
+
+    CustomUser.objects.bulk_create(
+        [
+            CustomUser(
+                phone_number=phone_for(n),
+                pin=pin_hash,
+                referral_code=f'BENCH{n:05d}'[-10:],
+                is_premium=rng.random() < 0.4,
+                balance=Decimal(rng.randint(0, 5000)),
+                total_earned=Decimal(rng.randint(0, 20000)),
+                date_joined=now - timezone.timedelta(days=rng.randint(0, 365)),
+            )
+            for n in range(users)
+        ],
+        batch_size=BATCH_SIZE,
+    )
+
+    categories = [value for value, _ in Survey.SURVEY_CATEGORIES]
+    difficulties = [value for value, _ in Survey.DIFFICULTY_LEVELS]
+    Survey.objects.bulk_create(
+        [
+            Survey(
+                title=f'Benchmark survey {n}',
+                description='Seeded for benchmarking',
+                reward_amount=Decimal(rng.choice([50, 100, 150, 200, 500])),
+                estimated_time=rng.randint(2, 15),
+                category=rng.choice(categories),
+                difficulty=rng.choice(difficulties),
+                is_premium_only=rng.random() < 0.2,
+                questions_count=rng.randint(5, 20),
+            )
+            for n in range(surveys)
+        ],
+        batch_size=BATCH_SIZE,
+    )
+
+    user_ids = list(CustomUser.objects.values_list('id', flat=True))
+    types = [value for value, _ in Transaction.TRANSACTION_TYPES]
+    for start in range(0, transactions, BATCH_SIZE):
+        Transaction.objects.bulk_create([
+            Transaction(
+                user_id=rng.choice(user_ids),
+                amount=Decimal(rng.randint(10, 1000)),
+                transaction_type=rng.choice(types),
+                description='Seeded for benchmarking',
+            )
+            for _ in range(min(BATCH_SIZE, transactions - start))
+        ])
+
+    return {'users': users, 'surveys': surveys, 'transactions': transactions}
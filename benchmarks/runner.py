@@ -0,0 +1,194 @@
+"""
+Drives each view through the Django test client and collects latency,
+throughput and query counts.
+"""
+import itertools
+import json
+import math
+import platform
+import statistics
+import time
+
+import django
+from django.db import connection
+from django.test import Client
+
+from authapp.models import CustomUser
+from .fixtures import PIN, phone_for
+
+VIEWS = (
+    'landing',
+    'register',
+    'login',
+    'dashboard',
+    'leaderboard',
+    'initiate_payment',
+    'mpesa_callback',
+    'check_payment_status',
+)
+
+# Logged-in clients kept per user group; requests are spread across them
+CLIENT_POOL_SIZE = 20
+
+
+class _QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def _client():
+    # Server errors are counted, not raised
+    return Client(raise_request_exception=False, HTTP_HOST='localhost')
+
+
+def _logged_in(users):
+    clients = []
+    for user in users:
+        client = _client()
+        client.force_login(user, backend='authapp.backends.PhoneAuthBackend')
+        clients.append(client)
+    return itertools.cycle(clients) if clients else None
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not samples:
+        return 0.0
+    index = max(0, min(len(samples) - 1, math.ceil(pct / 100 * len(samples)) - 1))
+    return samples[index]
+
+
+class Suite:
+    """One benchmark run over a seeded database and a running FakeDaraja"""
+
+    def __init__(self, daraja, seeded_users):
+        self.daraja = daraja
+        self.seeded_users = seeded_users
+        self.anonymous = _client()
+        self.premium = _logged_in(CustomUser.objects.filter(is_premium=True)[:CLIENT_POOL_SIZE])
+        self.regular = _logged_in(CustomUser.objects.filter(is_premium=False)[:CLIENT_POOL_SIZE])
+        self.registered = itertools.count(seeded_users)
+        # (client, checkout_request_id) for every payment this run initiated
+        self.payments = []
+
+    # One request per call; each returns the response
+
+    def landing(self, i):
+        return self.anonymous.get('/')
+
+    def register(self, i):
+        phone = phone_for(next(self.registered))[4:]
+        return _client().post(
+            '/auth/register/',
+            data={'phoneNumber': phone, 'pin': PIN, 'confirmPin': PIN},
+            content_type='application/json',
+        )
+
+    def login(self, i):
+        return _client().post(
+            '/auth/login/',
+            data={'phoneNumber': phone_for(i % self.seeded_users), 'pin': PIN},
+            content_type='application/json',
+        )
+
+    def dashboard(self, i):
+        return next(self.premium).get('/auth/dashboard/')
+
+    def leaderboard(self, i):
+        return self.anonymous.get('/auth/leaderboard/', {'board': ('referrers', 'earners')[i % 2]})
+
+    def initiate_payment(self, i):
+        client = next(self.regular)
+        response = client.post(
+            '/auth/initiate-premium-payment/',
+            data={'phone_number': phone_for(i)[1:]},
+            content_type='application/json',
+        )
+        if response.status_code == 200 and response.json().get('success'):
+            self.payments.append((client, response.json()['checkout_request_id']))
+        return response
+
+    def mpesa_callback(self, i):
+        push = self.daraja.pushes[i % len(self.daraja.pushes)]
+        return self.anonymous.post(
+            '/auth/mpesa-callback/',
+            data=self.daraja.callback_for(push, result_code=0 if i % 4 else 1032),
+            content_type='application/json',
+        )
+
+    def check_payment_status(self, i):
+        client, checkout_request_id = self.payments[i % len(self.payments)]
+        return client.post(
+            '/auth/check-payment-status/',
+            data={'checkout_request_id': checkout_request_id},
+            content_type='application/json',
+        )
+
+    def measure(self, view, iterations, warmup):
+        request = getattr(self, view)
+        for i in range(warmup):
+            request(i)
+
+        latencies, queries, errors = [], [], 0
+        started = time.perf_counter()
+        for i in range(warmup, warmup + iterations):
+            counter = _QueryCounter()
+            with connection.execute_wrapper(counter):
+                t0 = time.perf_counter()
+                response = request(i)
+                latencies.append(time.perf_counter() - t0)
+            queries.append(counter.count)
+            if response.status_code >= 400:
+                errors += 1
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        return {
+            'requests': iterations,
+            'errors': errors,
+            'rps': round(iterations / elapsed, 1) if elapsed else 0.0,
+            'mean_ms': round(statistics.fmean(latencies) * 1000, 2),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+            'queries_per_request': round(statistics.fmean(queries), 2),
+        }
+
+    def run(self, views, iterations, warmup):
+        """Measure ``views`` in order; payment views depend on earlier ones"""
+        results = {}
+        for view in views:
+            if view in ('mpesa_callback', 'check_payment_status') and not self.payments:
+                self.measure('initiate_payment', max(1, min(iterations, CLIENT_POOL_SIZE)), 0)
+            results[view] = self.measure(view, iterations, warmup)
+        return results
+
+
+def metadata(**extra):
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        **extra,
+    }
+
+
+def compare(current, baseline_path):
+    """Rows of (view, metric, baseline, current, change %) against a saved run"""
+    with open(baseline_path) as handle:
+        baseline = json.load(handle)['views']
+
+    rows = []
+    for view, metrics in current.items():
+        if view not in baseline:
+            continue
+        for metric in ('rps', 'p50_ms', 'p95_ms', 'queries_per_request'):
+            before, after = baseline[view].get(metric), metrics[metric]
+            change = ((after - before) / before * 100) if before else 0.0
+            rows.append((view, metric, before, after, change))
+    return rows
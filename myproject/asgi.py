@@ -5,5 +5,10 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "myproject.settings")
 
 application = get_asgi_application()
 
+from myproject.startup import warm_up  # noqa: E402
+
+warm_up()
+
 # 🚀 Required for Vercel: expose handler named "app"
 app = application
+
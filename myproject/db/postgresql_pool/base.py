@@ -0,0 +1,88 @@
+"""
+PostgreSQL backend that keeps closed connections in a small per-process
+pool instead of tearing them down.
+
+Django's ``CONN_MAX_AGE`` keeps one connection per thread alive between
+requests; this backend goes further and lets any thread pick up an idle
+connection, which matters under ASGI where requests hop between threads.
+Use it with ``CONN_MAX_AGE = 0`` so Django hands the connection back
+after every request. Pool behaviour is tuned through ``OPTIONS``:
+
+* ``pool_size``: idle connections kept per database alias (default 5)
+* ``pool_check_after``: seconds a connection may sit idle before it is
+  pinged with ``SELECT 1`` on checkout (default 30)
+"""
+import queue
+import threading
+import time
+
+from django.db.backends.postgresql import base
+from django.db.backends.postgresql.psycopg_any import IsolationLevel
+
+POOL_OPTIONS = ('pool_size', 'pool_check_after')
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _pool_for(alias, size):
+    with _pools_lock:
+        if alias not in _pools:
+            _pools[alias] = queue.LifoQueue(maxsize=size)
+        return _pools[alias]
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    @property
+    def _pool(self):
+        return _pool_for(self.alias, self.settings_dict['OPTIONS'].get('pool_size', 5))
+
+    def get_connection_params(self):
+        # Pool settings live in OPTIONS but must not reach psycopg2.connect()
+        params = super().get_connection_params()
+        for option in POOL_OPTIONS:
+            params.pop(option, None)
+        return params
+
+    def _checkout(self):
+        """Return a healthy idle connection from the pool, or None"""
+        check_after = self.settings_dict['OPTIONS'].get('pool_check_after', 30)
+        while True:
+            try:
+                connection, released_at = self._pool.get_nowait()
+            except queue.Empty:
+                return None
+            if connection.closed:
+                continue
+            if time.monotonic() - released_at < check_after:
+                return connection
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                connection.rollback()
+                return connection
+            except self.Database.Error:
+                connection.close()
+
+    def get_new_connection(self, conn_params):
+        connection = self._checkout()
+        if connection is None:
+            return super().get_new_connection(conn_params)
+        self.isolation_level = IsolationLevel(
+            self.settings_dict['OPTIONS'].get('isolation_level', IsolationLevel.READ_COMMITTED)
+        )
+        return connection
+
+    def _close(self):
+        if self.connection is None:
+            return
+        with self.wrap_database_errors:
+            connection = self.connection
+            try:
+                if not connection.closed and not self.in_atomic_block:
+                    connection.rollback()
+                    self._pool.put_nowait((connection, time.monotonic()))
+                    return
+            except (queue.Full, self.Database.Error):
+                pass
+            connection.close()
@@ -0,0 +1,33 @@
+"""
+SQLite backend that applies performance PRAGMAs to every new connection.
+
+Used by the ``local`` settings profile so the whole request path can be
+load-tested on one machine. PRAGMAs come from ``OPTIONS['pragmas']``,
+applied in order, e.g.::
+
+    'OPTIONS': {'pragmas': {'journal_mode': 'WAL', 'synchronous': 'NORMAL'}}
+"""
+from django.db.backends.sqlite3 import base
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,
+}
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        # 'pragmas' is ours; everything else goes to sqlite3.connect()
+        params = super().get_connection_params()
+        params.pop('pragmas', None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        connection = super().get_new_connection(conn_params)
+        pragmas = self.settings_dict['OPTIONS'].get('pragmas', DEFAULT_PRAGMAS)
+        for name, value in pragmas.items():
+            connection.execute(f'PRAGMA {name} = {value}')
+        return connection
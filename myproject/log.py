@@ -0,0 +1,140 @@
+"""
+Logging pipeline: request ids, redaction, JSON output and a background writer.
+
+Request handlers only pay for enqueueing a record: ``BackgroundQueueHandler``
+hands records to a ``QueueListener`` thread, which does the message
+formatting, PIN/phone redaction, JSON encoding and the actual write.
+Messages must use lazy %-style arguments so disabled levels cost nothing.
+"""
+import contextvars
+import copy
+import json
+import logging
+import queue
+import re
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+request_id_var = contextvars.ContextVar('request_id', default='-')
+
+# Keys whose values never reach the log output
+SECRET_KEYS = {'pin', 'confirmpin', 'confirm_pin', 'password', 'passkey', 'consumer_secret'}
+PHONE_KEYS = {'phone', 'phonenumber', 'phone_number', 'mpesa_phone', 'partya', 'partyb'}
+
+# Kenyan mobile numbers in any of the forms the app accepts
+PHONE_RE = re.compile(r'(?<!\d)(\+?254|0)?([17]\d{2})\d{3}(\d{3})(?!\d)')
+PIN_RE = re.compile(r'(?i)(\bpin\b["\']?\s*[:=]\s*["\']?)\d{4}')
+
+# Attributes every LogRecord has; anything else came in through ``extra``
+RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'request_id'}
+
+
+def mask_phone(match):
+    return f'{match.group(1) or ""}{match.group(2)}***{match.group(3)}'
+
+
+def redact_text(text):
+    return PIN_RE.sub(r'\1****', PHONE_RE.sub(mask_phone, text))
+
+
+def redact_value(value, key=None):
+    """Redact a log argument, recursing into dicts and lists"""
+    lowered = key.lower() if isinstance(key, str) else None
+    if lowered in SECRET_KEYS:
+        return '****'
+    if isinstance(value, dict):
+        return {k: redact_value(v, k) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact_value(v) for v in value]
+    if lowered in PHONE_KEYS:
+        return PHONE_RE.sub(mask_phone, str(value))
+    return value
+
+
+def redact_extra(value, key=None):
+    """Redact an ``extra`` field, masking PINs and phone numbers in free text too"""
+    value = redact_value(value, key)
+    if isinstance(value, dict):
+        return {k: redact_extra(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [redact_extra(v) for v in value]
+    return redact_text(value) if isinstance(value, str) else value
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamp records with the id of the request being served"""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class RedactingFilter(logging.Filter):
+    """Mask PINs and phone numbers in the message and its arguments"""
+
+    def filter(self, record):
+        if record.args:
+            if isinstance(record.args, dict):
+                record.args = redact_value(record.args)
+            else:
+                record.args = tuple(redact_value(arg) for arg in record.args)
+        record.msg = redact_text(str(record.msg))
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with ``extra`` fields as redacted top-level keys"""
+
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'request_id': getattr(record, 'request_id', '-'),
+            'message': redact_text(record.getMessage()),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = redact_text(record.exc_text)
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRS:
+                entry.setdefault(key, redact_extra(value, key))
+        return json.dumps(entry, default=str)
+
+
+class BackgroundQueueHandler(QueueHandler):
+    """
+    Queue records for a background thread that redacts, formats and writes
+    them to ``stream`` (stdout by default).
+    """
+
+    def __init__(self, stream=None, maxsize=10000):
+        super().__init__(queue.Queue(maxsize))
+        target = logging.StreamHandler(stream or sys.stdout)
+        target.setFormatter(JsonFormatter())
+        target.addFilter(RedactingFilter())
+        self.listener = QueueListener(self.queue, target, respect_handler_level=True)
+        self.listener.start()
+
+    def prepare(self, record):
+        # Formatting happens on the listener thread; only render the
+        # traceback here, while it is still available
+        record = copy.copy(record)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Drop rather than block the request when the writer falls behind
+            pass
+
+    def close(self):
+        # Called by logging.shutdown() at exit; drains the queue first
+        if self.listener._thread is not None:
+            self.listener.stop()
+        super().close()
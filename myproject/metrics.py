@@ -0,0 +1,145 @@
+"""
+In-process request metrics.
+
+``RequestMetricsMiddleware`` opens a ``RequestStats`` for each sampled
+request; code anywhere in the request path can report into it (see
+``record_cache``). Finished requests are folded into per-view histograms
+that live in process memory and are served to staff by
+``authapp.views.request_metrics_view``.
+"""
+import bisect
+import contextvars
+import threading
+import time
+
+# Upper bounds (ms) of the latency buckets; the last bucket is open-ended
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+_current = contextvars.ContextVar('request_stats', default=None)
+
+
+class RequestStats:
+    __slots__ = ('started', 'queries', 'db_time', 'cache_hits', 'cache_misses', 'connections_opened')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.connections_opened = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        # Installed with connection.execute_wrapper()
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+
+
+def current():
+    """Stats of the request being served, or None when it isn't sampled"""
+    return _current.get()
+
+
+def start():
+    stats = RequestStats()
+    return stats, _current.set(stats)
+
+
+def stop(token):
+    _current.reset(token)
+
+
+def record_cache(hit):
+    stats = _current.get()
+    if stats is not None:
+        if hit:
+            stats.cache_hits += 1
+        else:
+            stats.cache_misses += 1
+
+
+def record_connection():
+    stats = _current.get()
+    if stats is not None:
+        stats.connections_opened += 1
+
+
+class _ViewHistogram:
+    __slots__ = ('count', 'wall_ms', 'db_ms', 'queries', 'cache_hits', 'cache_misses', 'latency', 'query_counts')
+
+    def __init__(self):
+        self.count = 0
+        self.wall_ms = 0.0
+        self.db_ms = 0.0
+        self.queries = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.latency = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.query_counts = [0] * (len(QUERY_BUCKETS) + 1)
+
+    def add(self, stats, wall_ms):
+        self.count += 1
+        self.wall_ms += wall_ms
+        self.db_ms += stats.db_time * 1000
+        self.queries += stats.queries
+        self.cache_hits += stats.cache_hits
+        self.cache_misses += stats.cache_misses
+        self.latency[bisect.bisect_left(LATENCY_BUCKETS_MS, wall_ms)] += 1
+        self.query_counts[bisect.bisect_left(QUERY_BUCKETS, stats.queries)] += 1
+
+    def _percentile(self, pct):
+        """Upper bound of the bucket holding the pct-th percentile"""
+        target, seen = pct / 100 * self.count, 0
+        for index, hits in enumerate(self.latency):
+            seen += hits
+            if seen >= target:
+                return LATENCY_BUCKETS_MS[index] if index < len(LATENCY_BUCKETS_MS) else None
+        return None
+
+    def snapshot(self):
+        return {
+            'requests': self.count,
+            'mean_ms': round(self.wall_ms / self.count, 2),
+            'mean_db_ms': round(self.db_ms / self.count, 2),
+            'queries_per_request': round(self.queries / self.count, 2),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'p50_ms_le': self._percentile(50),
+            'p95_ms_le': self._percentile(95),
+            'p99_ms_le': self._percentile(99),
+            'latency_buckets_ms': dict(zip([*map(str, LATENCY_BUCKETS_MS), 'inf'], self.latency)),
+            'query_buckets': dict(zip([*map(str, QUERY_BUCKETS), 'inf'], self.query_counts)),
+        }
+
+
+class Registry:
+    """Per-view histograms for this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+        self.since = time.time()
+
+    def add(self, view, stats, wall_ms):
+        with self._lock:
+            histogram = self._views.get(view)
+            if histogram is None:
+                histogram = self._views[view] = _ViewHistogram()
+            histogram.add(stats, wall_ms)
+
+    def snapshot(self):
+        with self._lock:
+            return {view: histogram.snapshot() for view, histogram in sorted(self._views.items())}
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+            self.since = time.time()
+
+
+registry = Registry()
@@ -0,0 +1,193 @@
+"""
+Project-wide middleware.
+"""
+import hashlib
+import os
+import random
+import re
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+from . import log, metrics
+
+
+def _record_connection(sender, connection, **kwargs):
+    metrics.record_connection()
+
+
+connection_created.connect(_record_connection)
+
+
+class RequestIdMiddleware:
+    """
+    Give every request an id for log correlation: the caller's
+    ``X-Request-ID`` when it looks sane, otherwise a fresh one. The id is
+    echoed back in the response.
+    """
+
+    VALID_ID = re.compile(r'^[A-Za-z0-9._-]{8,64}$')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request_id = request.headers.get('X-Request-ID', '')
+        if not self.VALID_ID.match(request_id):
+            request_id = uuid.uuid4().hex
+        token = log.request_id_var.set(request_id)
+        try:
+            response = self.get_response(request)
+        finally:
+            log.request_id_var.reset(token)
+        response['X-Request-ID'] = request_id
+        return response
+
+
+class RequestMetricsMiddleware:
+    """
+    Per-view query count, DB time, cache hits and wall time for a sample
+    of requests (``REQUEST_METRICS_SAMPLE_RATE``, 0 to 1).
+
+    Sampled requests are folded into ``myproject.metrics.registry``; their
+    responses carry a ``Server-Timing`` header only for staff users or with
+    ``REQUEST_METRICS_SERVER_TIMING``, since it exposes internal DB and
+    cache timings. Unsampled requests skip all of it, so the cost is one
+    random() call.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'REQUEST_METRICS_SAMPLE_RATE', 1.0)
+        self.server_timing = getattr(settings, 'REQUEST_METRICS_SERVER_TIMING', False)
+
+    def __call__(self, request):
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        stats, token = metrics.start()
+        try:
+            with connections['default'].execute_wrapper(stats):
+                response = self.get_response(request)
+        finally:
+            metrics.stop(token)
+        wall_ms = (time.perf_counter() - stats.started) * 1000
+
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        metrics.registry.add(view, stats, wall_ms)
+
+        if not (self.server_timing or self.is_staff(request)):
+            return response
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={stats.db_time * 1000:.1f};desc="{stats.queries} queries'
+            f'{", new connection" if stats.connections_opened else ""}"',
+            f'cache;desc="{stats.cache_hits} hits, {stats.cache_misses} misses"',
+            f'total;dur={wall_ms:.1f}',
+        ])
+        return response
+
+    def is_staff(self, request):
+        # Set by AuthenticationMiddleware further down, if the request got that far
+        user = getattr(request, 'user', None)
+        return user is not None and user.is_staff
+
+
+class LandingPageCacheMiddleware:
+    """
+    Serve the landing page to anonymous visitors from a prerendered copy.
+
+    The first anonymous GET renders ``/`` through the normal stack; the
+    bytes and headers are kept in the cache under the deploy's
+    ``BUILD_ID``, so a new deploy starts fresh. Later GET/HEAD requests
+    without a session cookie get that copy with an ``ETag`` (content hash)
+    and ``Last-Modified`` (template mtime), and a 304 when the browser
+    already has it, without touching templates, sessions or the database.
+
+    The copy is public but varies on ``Cookie``, so shared caches keep it
+    apart from pages rendered for a session. Requests with a session
+    cookie fall through and their ``/`` is marked private; a render that
+    turns out authenticated or private is never stored.
+
+    Sits above SessionMiddleware; anything it can't serve falls through.
+    """
+
+    PATH = '/'
+    TEMPLATE = 'index.html'
+    CACHE_KEY = 'landing:{build}'
+    # Per-request headers that must not be replayed from the stored copy
+    SKIP_HEADERS = {'content-length', 'vary', 'server-timing', 'x-request-id', 'set-cookie'}
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, 'LANDING_PAGE_CACHE', True)
+        self.max_age = getattr(settings, 'LANDING_PAGE_MAX_AGE', 300)
+        self.cache_key = self.CACHE_KEY.format(build=getattr(settings, 'BUILD_ID', ''))
+
+    def __call__(self, request):
+        if not self.cacheable(request):
+            response = self.get_response(request)
+            if request.path == self.PATH and settings.SESSION_COOKIE_NAME in request.COOKIES:
+                patch_cache_control(response, private=True)
+            return response
+
+        page = cache.get(self.cache_key)
+        if page is None:
+            response = self.get_response(request)
+            page = self.store(request, response)
+            if page is None:
+                return response
+
+        return self.serve(request, page)
+
+    def cacheable(self, request):
+        return (
+            self.enabled
+            and request.method in ('GET', 'HEAD')
+            and request.path == self.PATH
+            and not request.GET
+            and settings.SESSION_COOKIE_NAME not in request.COOKIES
+        )
+
+    def store(self, request, response):
+        if response.status_code != 200 or response.streaming or response.cookies:
+            return None
+        user = getattr(request, 'user', None)
+        if (user is not None and user.is_authenticated) or 'private' in response.get('Cache-Control', ''):
+            return None
+        if hasattr(response, 'render') and not response.is_rendered:
+            response.render()
+
+        from django.template.loader import get_template
+        origin = get_template(self.TEMPLATE).origin.name
+
+        page = {
+            'content': response.content,
+            'headers': [(k, v) for k, v in response.items() if k.lower() not in self.SKIP_HEADERS],
+            'etag': '"%s"' % hashlib.sha256(response.content).hexdigest()[:32],
+            'last_modified': int(os.path.getmtime(origin)),
+        }
+        cache.set(self.cache_key, page, None)
+        return page
+
+    def serve(self, request, page):
+        not_modified = get_conditional_response(
+            request, etag=page['etag'], last_modified=page['last_modified']
+        )
+        response = not_modified or HttpResponse(b'' if request.method == 'HEAD' else page['content'])
+        if not_modified is None:
+            for header, value in page['headers']:
+                response[header] = value
+            response['Content-Length'] = len(page['content'])
+        response['ETag'] = page['etag']
+        response['Last-Modified'] = http_date(page['last_modified'])
+        response['Cache-Control'] = f'public, max-age={self.max_age}'
+        patch_vary_headers(response, ['Cookie'])
+        return response
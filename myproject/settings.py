@@ -29,8 +29,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'myproject.middleware.RequestIdMiddleware',  # Request id for log correlation
+    'myproject.middleware.RequestMetricsMiddleware',  # Sampled per-view DB/cache/wall timings
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # For static files on Vercel
+    'myproject.middleware.LandingPageCacheMiddleware',  # Prerendered '/' for anonymous visitors
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -60,18 +63,61 @@ TEMPLATES = [
 WSGI_APPLICATION = 'myproject.wsgi.application'
 ASGI_APPLICATION = 'myproject.asgi.application'  # Required for Vercel
 
+# Settings profile, selected with DJANGO_PROFILE:
+#   production - Railway PostgreSQL (default)
+#   local      - tuned SQLite (WAL) for running and load-testing on one machine
+PROFILE = os.environ.get('DJANGO_PROFILE', 'production')
+
+if PROFILE not in ('production', 'local'):
+    from django.core.exceptions import ImproperlyConfigured
+    raise ImproperlyConfigured(f"Unknown DJANGO_PROFILE '{PROFILE}' (use 'production' or 'local')")
+
 # Database (PostgreSQL - Railway)
+# Connections are reused across requests (DB_CONN_MAX_AGE seconds, checked
+# before reuse). DB_POOL=1 switches to a pooling backend that shares idle
+# connections between threads; it hands connections back after each request.
+DB_POOL = os.environ.get('DB_POOL', '0') == '1'
 
-DATABASES = {
-     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
-        'NAME': 'railway',
-        'USER': 'postgres',
-        'PASSWORD': 'jLfSCswtWqekMUCXlmmMzzNNfKkpJAxt',
-        'HOST': 'turntable.proxy.rlwy.net',
-        'PORT': '17806',
+if PROFILE == 'production':
+    DATABASES = {
+         'default': {
+            'ENGINE': 'myproject.db.postgresql_pool' if DB_POOL else 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'railway'),
+            'USER': os.environ.get('DB_USER', 'postgres'),
+            'PASSWORD': os.environ.get('DB_PASSWORD', 'jLfSCswtWqekMUCXlmmMzzNNfKkpJAxt'),
+            'HOST': os.environ.get('DB_HOST', 'turntable.proxy.rlwy.net'),
+            'PORT': os.environ.get('DB_PORT', '17806'),
+            'CONN_MAX_AGE': 0 if DB_POOL else int(os.environ.get('DB_CONN_MAX_AGE', '60')),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'connect_timeout': int(os.environ.get('DB_CONNECT_TIMEOUT', '5')),
+                **({
+                    'pool_size': int(os.environ.get('DB_POOL_SIZE', '5')),
+                    'pool_check_after': int(os.environ.get('DB_POOL_CHECK_AFTER', '30')),
+                } if DB_POOL else {}),
+            },
+        }
     }
-}
+else:
+    # Database (SQLite - local). PRAGMAs are applied on every new connection.
+    DATABASES = {
+        'default': {
+            'ENGINE': 'myproject.db.sqlite_wal',
+            'NAME': os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': None,
+            'OPTIONS': {
+                'timeout': 20,
+                'pragmas': {
+                    'journal_mode': 'WAL',
+                    'synchronous': 'NORMAL',
+                    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+                    'temp_store': 'MEMORY',
+                    'busy_timeout': 5000,
+                },
+            },
+        }
+    }
+    ALLOWED_HOSTS += ['testserver', '0.0.0.0']
 
 # Authentication
 AUTHENTICATION_BACKENDS = [
@@ -99,7 +145,26 @@ USE_TZ = True
 STATIC_URL = '/static/'
 STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]  # local static
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles_build', 'static')
-STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+# collectstatic writes content-hashed names plus .gz/.br siblings (brotli
+# needs the Brotli package); WhiteNoise serves hashed files as immutable.
+# The output is committed and vercel.json serves /static/ from it, so run
+# `DJANGO_PROFILE=production python manage.py collectstatic` after changing
+# anything under static/. The local profile serves static/ directly so it
+# runs without collectstatic.
+if PROFILE == 'production':
+    STATICFILES_STORAGE = 'myproject.storage.StaticFilesStorage'
+else:
+    STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage'
+    WHITENOISE_USE_FINDERS = True
+# Cache lifetime (seconds) for static files without a content hash
+WHITENOISE_MAX_AGE = int(os.environ.get('WHITENOISE_MAX_AGE', '3600'))
+
+# Identifies the deployed build; part of template fragment and page cache keys
+BUILD_ID = os.environ.get('BUILD_ID') or os.environ.get('VERCEL_GIT_COMMIT_SHA', 'dev')
+
+# Serve '/' to anonymous visitors from a copy rendered once per build
+LANDING_PAGE_CACHE = os.environ.get('LANDING_PAGE_CACHE', '1') == '1'
+LANDING_PAGE_MAX_AGE = int(os.environ.get('LANDING_PAGE_MAX_AGE', '300'))
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
@@ -109,14 +174,136 @@ LOGIN_URL = '/auth/login/'
 LOGIN_REDIRECT_URL = '/auth/dashboard/'
 LOGOUT_REDIRECT_URL = '/'
 
-# ---------- LOGGING (Optional but helpful) ---------- #
-import logging
+# ---------- M-PESA ---------- #
+MPESA_API_BASE_URL = os.environ.get('MPESA_API_BASE_URL', 'https://api.safaricom.co.ke')
+MPESA_CALLBACK_URL = os.environ.get('MPESA_CALLBACK_URL', 'https://starrlnk.shop/auth/mpesa-callback/')
+# At most this many STK pushes per user may await a callback within the window (seconds)
+MPESA_MAX_PENDING_PUSHES = int(os.environ.get('MPESA_MAX_PENDING_PUSHES', '3'))
+MPESA_PENDING_WINDOW = int(os.environ.get('MPESA_PENDING_WINDOW', '120'))
+# Daraja (connect, read) timeouts in seconds
+MPESA_TIMEOUT = (
+    float(os.environ.get('MPESA_CONNECT_TIMEOUT', '3.05')),
+    float(os.environ.get('MPESA_READ_TIMEOUT', '10')),
+)
+# Circuit breaker per Daraja endpoint (see authapp/circuit.py)
+CIRCUIT_WINDOW = int(os.environ.get('CIRCUIT_WINDOW', '60'))
+CIRCUIT_MIN_CALLS = int(os.environ.get('CIRCUIT_MIN_CALLS', '5'))
+CIRCUIT_FAILURE_RATE = float(os.environ.get('CIRCUIT_FAILURE_RATE', '0.5'))
+CIRCUIT_SLOW_CALL_SECONDS = float(os.environ.get('CIRCUIT_SLOW_CALL_SECONDS', '5'))
+CIRCUIT_OPEN_SECONDS = int(os.environ.get('CIRCUIT_OPEN_SECONDS', '30'))
+
+# ---------- PAYMENT JOURNAL ---------- #
+# Append-only log of M-Pesa callbacks and pushes for manage.py replay_payments;
+# empty disables it. It needs a writable, persistent directory. The deployed
+# bundle is read-only on Vercel, so production only journals when
+# PAYMENT_JOURNAL_DIR is set (manage.py check warns otherwise).
+PAYMENT_JOURNAL_DIR = os.environ.get(
+    'PAYMENT_JOURNAL_DIR', os.path.join(BASE_DIR, 'journal') if PROFILE == 'local' else ''
+)
+PAYMENT_JOURNAL_SEGMENT_BYTES = int(os.environ.get('PAYMENT_JOURNAL_SEGMENT_BYTES', str(64 * 1024 * 1024)))
+# Seconds the writer waits to gather concurrent appends into one fsync
+PAYMENT_JOURNAL_COMMIT_DELAY = float(os.environ.get('PAYMENT_JOURNAL_COMMIT_DELAY', '0.002'))
+
+# ---------- TASK QUEUE ---------- #
+# Slow side effects run as Task rows picked up by manage.py run_workers or, on
+# Vercel, by the cron in vercel.json calling /auth/cron/tasks/ every minute.
+# Eager mode runs them inline in the request instead; it is the local default.
+TASK_QUEUE_EAGER = os.environ.get('TASK_QUEUE_EAGER', '1' if PROFILE == 'local' else '0') == '1'
+# Vercel sends CRON_SECRET as a Bearer token with each cron request; the task
+# endpoint refuses every request while it is unset
+CRON_SECRET = os.environ.get('CRON_SECRET', '')
+# Seconds one cron request spends draining the queue, inside the function's time limit
+TASK_CRON_SECONDS = float(os.environ.get('TASK_CRON_SECONDS', '50'))
+# Seconds a claimed task is reserved before another worker may take it over
+TASK_VISIBILITY_TIMEOUT = int(os.environ.get('TASK_VISIBILITY_TIMEOUT', '300'))
+# Retry delay in seconds, doubled per failed attempt up to the maximum
+TASK_RETRY_BACKOFF = int(os.environ.get('TASK_RETRY_BACKOFF', '10'))
+TASK_RETRY_BACKOFF_MAX = int(os.environ.get('TASK_RETRY_BACKOFF_MAX', '3600'))
+
+# ---------- NOTIFICATIONS ---------- #
+# Events younger than this (seconds) wait for the next dispatch so bursts coalesce
+NOTIFICATION_COALESCE_SECONDS = int(os.environ.get('NOTIFICATION_COALESCE_SECONDS', '30'))
+# Dotted path of the SMS gateway class (an authapp.notifications.SMSProvider).
+# Empty turns SMS off; the local profile logs messages through FakeSMSProvider.
+SMS_PROVIDER = os.environ.get(
+    'SMS_PROVIDER', 'authapp.notifications.FakeSMSProvider' if PROFILE == 'local' else ''
+)
+
+# ---------- LEDGER ARCHIVE ---------- #
+# Compressed monthly archives written by manage.py archive_ledger
+LEDGER_ARCHIVE_DIR = os.environ.get('LEDGER_ARCHIVE_DIR', os.path.join(BASE_DIR, 'archive'))
+
+# ---------- REFERRALS ---------- #
+# Bonus (Ksh) paid per upline level when a referred user activates premium
+REFERRAL_BONUS_LEVELS = ['50.00', '20.00', '10.00']
+
+# ---------- SURVEYS ---------- #
+# Started responses not finished within this many hours are swept to
+# 'abandoned' by manage.py sweep_surveys
+SURVEY_ABANDON_AFTER_HOURS = float(os.environ.get('SURVEY_ABANDON_AFTER_HOURS', '24'))
+
+# ---------- FRAUD SCORING ---------- #
+# Accounts scoring at least this (0-100) are flagged by manage.py score_fraud
+FRAUD_FLAG_SCORE = int(os.environ.get('FRAUD_FLAG_SCORE', '50'))
+
+# ---------- CACHE ---------- #
+# Point this at a shared backend (e.g. Redis) when running several workers
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
+}
+
+# Entries kept on each cached leaderboard, and seconds before the next
+# score update rebuilds them from the database (reads never do)
+LEADERBOARD_SIZE = 20
+LEADERBOARD_MAX_AGE = int(os.environ.get('LEADERBOARD_MAX_AGE', '300'))
+
+# Seconds an authenticated user row is served from the cache (0 disables).
+# Other workers only see invalidations through a shared CACHE_BACKEND;
+# payment and withdrawal checks always read the database.
+USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', '30'))
+
+# ---------- SESSIONS ---------- #
+# db (default), cached_db, cache or signed_cookies. "cache" needs a shared
+# CACHE_BACKEND across workers; signed_cookies needs no server-side storage.
+SESSION_ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'cache': 'django.contrib.sessions.backends.cache',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}
+SESSION_STORE = os.environ.get('SESSION_ENGINE', 'db')
+if SESSION_STORE not in SESSION_ENGINES:
+    from django.core.exceptions import ImproperlyConfigured
+    raise ImproperlyConfigured(f"Unknown SESSION_ENGINE '{SESSION_STORE}' (use {', '.join(SESSION_ENGINES)})")
+SESSION_ENGINE = SESSION_ENGINES[SESSION_STORE]
+
+# ---------- REQUEST METRICS ---------- #
+# Fraction of requests instrumented (0 disables, 1 samples everything)
+REQUEST_METRICS_SAMPLE_RATE = float(os.environ.get('REQUEST_METRICS_SAMPLE_RATE', '0.05'))
+# Send the Server-Timing header to everyone, not just staff (it exposes
+# internal DB and cache timings); on by default only with DEBUG
+REQUEST_METRICS_SERVER_TIMING = os.environ.get('REQUEST_METRICS_SERVER_TIMING', '1' if DEBUG else '0') == '1'
+
+# ---------- LOGGING ---------- #
+# Records are queued and written as JSON lines by a background thread
+# (myproject.log), with PINs and phone numbers redacted. Keep log calls
+# lazy: logger.info("... %s", value), never f-strings.
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
 
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
+    'filters': {
+        'request_id': {'()': 'myproject.log.RequestIdFilter'},
+    },
     'handlers': {
-        'console': {'class': 'logging.StreamHandler'},
+        'console': {
+            'class': 'myproject.log.BackgroundQueueHandler',
+            'filters': ['request_id'],
+        },
     },
     'root': {
         'handlers': ['console'],
@@ -124,7 +311,7 @@ LOGGING = {
     },
     'loggers': {
         'django': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
-        'authapp': {'handlers': ['console'], 'level': 'DEBUG', 'propagate': False},
+        'authapp': {'handlers': ['console'], 'level': LOG_LEVEL, 'propagate': False},
     },
 }
 
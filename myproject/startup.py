@@ -0,0 +1,21 @@
+"""
+Startup helpers for serverless cold starts.
+
+``warm_up`` does the minimum needed before the first request: the app
+registry is already populated by ``get_asgi_application()``/
+``get_wsgi_application()``, so all that is left is importing the URLconf
+and building the resolver. Anything heavier (the M-Pesa gateway, the
+HTTP client) is imported lazily by the views that need it.
+"""
+import os
+
+
+def warm_up():
+    """Build the URL resolver up front unless STARTUP_WARMUP=0"""
+    if os.environ.get('STARTUP_WARMUP', '1') == '0':
+        return
+
+    from django.urls import get_resolver
+
+    # Accessing reverse_dict populates the resolver and imports every view module
+    get_resolver().reverse_dict
@@ -0,0 +1,15 @@
+"""
+Static files storage for the production profile.
+
+Same as WhiteNoise's ``CompressedManifestStaticFilesStorage`` (hashed
+names with .gz/.br siblings), but a file missing from the manifest is
+served under its plain name instead of failing the page with a
+ValueError. That happens when an asset is added without re-running
+collectstatic into ``staticfiles_build/``; ``authapp.tests`` checks the
+committed manifest covers every template reference.
+"""
+from whitenoise.storage import CompressedManifestStaticFilesStorage
+
+
+class StaticFilesStorage(CompressedManifestStaticFilesStorage):
+    manifest_strict = False
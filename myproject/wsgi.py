@@ -7,6 +7,10 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myproject.settings')
 
 application = get_wsgi_application()
 
+from myproject.startup import warm_up  # noqa: E402
+
+warm_up()
+
 app = application
 
 
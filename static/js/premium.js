@@ -0,0 +1,482 @@
+// CSRF Token helper
+function getCookie(name) {
+    let cookieValue = null;
+    if (document.cookie && document.cookie !== '') {
+        const cookies = document.cookie.split(';');
+        for (let i = 0; i < cookies.length; i++) {
+            const cookie = cookies[i].trim();
+            if (cookie.substring(0, name.length + 1) === (name + '=')) {
+                cookieValue = decodeURIComponent(cookie.substring(name.length + 1));
+                break;
+            }
+        }
+    }
+    return cookieValue;
+}
+
+// Variables to track payment state
+let currentCheckoutRequestId = null;
+let statusCheckInterval = null;
+let currentPaymentMethod = null; // 'automatic' or 'manual'
+let paymentAttemptKey = null; // Idempotency key shared by retries of one payment attempt
+
+// Random key identifying one payment attempt
+function newAttemptKey() {
+    if (window.crypto && crypto.randomUUID) {
+        return crypto.randomUUID();
+    }
+    return Date.now().toString(36) + '-' + Math.random().toString(36).slice(2, 12);
+}
+
+// Initialize the page
+document.addEventListener('DOMContentLoaded', function() {
+    // Show payment method selection by default
+    showPaymentMethodSelection();
+
+    // Payment method buttons
+    document.getElementById('automaticPaymentBtn').addEventListener('click', function() {
+        currentPaymentMethod = 'automatic';
+        document.getElementById('paymentMethodSelection').style.display = 'none';
+        document.getElementById('phoneForm').style.display = 'block';
+    });
+
+    document.getElementById('manualPaymentBtn').addEventListener('click', function() {
+        currentPaymentMethod = 'manual';
+        document.getElementById('paymentMethodSelection').style.display = 'none';
+        document.getElementById('manualPaymentSection').style.display = 'block';
+    });
+
+    // Back buttons
+    document.getElementById('backToPaymentMethods').addEventListener('click', showPaymentMethodSelection);
+    document.getElementById('backToPaymentMethods2').addEventListener('click', showPaymentMethodSelection);
+
+    // Phone number validation
+    document.getElementById('phoneNumber').addEventListener('input', function(e) {
+        // Only allow numbers
+        this.value = this.value.replace(/[^0-9]/g, '');
+
+        // Ensure it starts with 7
+        if (this.value.length > 0 && !this.value.startsWith('7')) {
+            this.value = '7' + this.value.slice(1);
+        }
+    });
+
+    // Initiate payment button
+    document.getElementById('initiatePaymentBtn').addEventListener('click', initiatePayment);
+
+    // Verify manual payment button
+    document.getElementById('verifyManualPaymentBtn').addEventListener('click', verifyManualPayment);
+
+    // Check status button
+    document.getElementById('checkStatusBtn').addEventListener('click', checkPaymentStatus);
+
+    // Cancel payment button
+    document.getElementById('cancelPaymentBtn').addEventListener('click', cancelPayment);
+
+    // Prevent zoom on input focus for iOS
+    document.querySelectorAll('input, select, textarea').forEach(element => {
+        element.addEventListener('focus', () => {
+            if (window.innerWidth <= 768) {
+                document.body.style.zoom = "100%";
+            }
+        });
+    });
+});
+
+// Copy till number to clipboard
+function copyTillNumber(elementId) {
+    let tillNumber;
+
+    if (elementId === 'tillNumber') {
+        tillNumber = document.getElementById('tillNumber').textContent;
+    } else if (elementId === 'stepTillNumber') {
+        // Get the till number from the step
+        const stepContainer = document.querySelector('.step-till-container');
+        tillNumber = stepContainer.querySelector('.till-number-small').textContent;
+    } else {
+        tillNumber = '6957778';
+    }
+
+    navigator.clipboard.writeText(tillNumber).then(() => {
+        // Show success feedback
+        const button = event.target.closest('button');
+        const originalHtml = button.innerHTML;
+
+        if (button.classList.contains('btn-copy-till')) {
+            button.innerHTML = '<i class="fas fa-check me-2"></i>Copied!';
+            button.classList.add('btn-success');
+            button.classList.remove('btn-copy-till');
+
+            setTimeout(() => {
+                button.innerHTML = originalHtml;
+                button.classList.remove('btn-success');
+                button.classList.add('btn-copy-till');
+            }, 2000);
+        } else if (button.classList.contains('btn-copy-small')) {
+            button.innerHTML = '<i class="fas fa-check"></i> Copied';
+            button.classList.add('btn-success');
+
+            setTimeout(() => {
+                button.innerHTML = originalHtml;
+                button.classList.remove('btn-success');
+            }, 2000);
+        }
+
+        // Show toast notification
+        showToast('Till number copied to clipboard: ' + tillNumber);
+
+    }).catch(err => {
+        console.error('Failed to copy: ', err);
+        showError('Failed to copy till number. Please copy it manually: ' + tillNumber);
+    });
+}
+
+// Show toast notification
+function showToast(message) {
+    // Create toast element
+    const toast = document.createElement('div');
+    toast.className = 'toast-notification animate__animated animate__fadeInUp';
+    toast.innerHTML = `
+        <div class="toast-content">
+            <i class="fas fa-check-circle me-2"></i>
+            ${message}
+        </div>
+    `;
+
+    // Add styles for toast
+    toast.style.cssText = `
+        position: fixed;
+        bottom: 20px;
+        left: 50%;
+        transform: translateX(-50%);
+        background: var(--success-gradient);
+        color: white;
+        padding: 12px 20px;
+        border-radius: 10px;
+        box-shadow: 0 5px 15px rgba(0,0,0,0.2);
+        z-index: 1000;
+        font-weight: 500;
+        max-width: 90%;
+        text-align: center;
+        animation-duration: 0.3s;
+    `;
+
+    document.body.appendChild(toast);
+
+    // Remove toast after 3 seconds
+    setTimeout(() => {
+        toast.classList.add('animate__fadeOutDown');
+        setTimeout(() => {
+            if (toast.parentNode) {
+                document.body.removeChild(toast);
+            }
+        }, 300);
+    }, 3000);
+}
+
+// Show payment method selection
+function showPaymentMethodSelection() {
+    document.getElementById('paymentMethodSelection').style.display = 'block';
+    document.getElementById('phoneForm').style.display = 'none';
+    document.getElementById('manualPaymentSection').style.display = 'none';
+    document.getElementById('paymentPending').style.display = 'none';
+    document.getElementById('errorMessage').classList.add('d-none');
+
+    // Reset progress
+    updateProgress(1);
+
+    // Clear any intervals
+    if (statusCheckInterval) {
+        clearInterval(statusCheckInterval);
+        statusCheckInterval = null;
+    }
+
+    currentPaymentMethod = null;
+    paymentAttemptKey = null;
+}
+
+// Initiate M-Pesa payment (automatic)
+function initiatePayment() {
+    const phoneInput = document.getElementById('phoneNumber');
+    const phoneNumber = phoneInput.value;
+
+    // Validate phone number
+    if (!phoneNumber || phoneNumber.length !== 9 || !phoneNumber.startsWith('7')) {
+        showError('Please enter a valid Safaricom phone number (7XXXXXXXX)');
+        phoneInput.focus();
+        return;
+    }
+
+    // Show loading state
+    const button = document.getElementById('initiatePaymentBtn');
+    const originalText = button.innerHTML;
+    button.innerHTML = '<span class="spinner-border spinner-border-sm me-2"></span> Initiating payment...';
+    button.disabled = true;
+
+    // Hide any previous errors
+    hideError();
+
+    // Prepare the full phone number (254XXXXXXXXX)
+    const fullPhoneNumber = '254' + phoneNumber;
+
+    // Double taps and retries of this attempt reuse the key, so the server
+    // sends one STK push and returns the same transaction
+    if (!paymentAttemptKey) {
+        paymentAttemptKey = newAttemptKey();
+    }
+
+    // Send request to backend
+    fetch('/auth/initiate-premium-payment/', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'X-CSRFToken': getCookie('csrftoken'),
+            'Idempotency-Key': paymentAttemptKey
+        },
+        body: JSON.stringify({
+            phone_number: fullPhoneNumber
+        })
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.success) {
+            // Payment initiated successfully
+            currentCheckoutRequestId = data.checkout_request_id;
+
+            // Move to step 2
+            updateProgress(2);
+
+            // Show payment pending screen
+            document.getElementById('phoneForm').style.display = 'none';
+            document.getElementById('paymentPending').style.display = 'block';
+
+            // Start checking payment status
+            startStatusChecking();
+
+        } else {
+            // Show error
+            showError(data.message || 'Failed to initiate payment. Please try again.');
+            button.innerHTML = originalText;
+            button.disabled = false;
+        }
+    })
+    .catch(error => {
+        console.error('Error:', error);
+        showError('Network error. Please check your connection and try again.');
+        button.innerHTML = originalText;
+        button.disabled = false;
+    });
+}
+
+// Verify manual payment
+function verifyManualPayment() {
+    // Show loading state
+    const button = document.getElementById('verifyManualPaymentBtn');
+    const originalText = button.innerHTML;
+    button.innerHTML = '<span class="spinner-border spinner-border-sm me-2"></span> Verifying payment...';
+    button.disabled = true;
+
+    // Hide any previous errors
+    hideError();
+
+    // For manual payment, we need to check if payment was made
+    // This would typically involve sending a request to your backend
+    // to check if a payment with the user's phone number was received
+
+    // Show prompt for phone number
+    const phoneNumber = prompt("Please enter your Safaricom phone number (7XXXXXXXX) that you used to make the payment:");
+
+    if (!phoneNumber || phoneNumber.length !== 9 || !phoneNumber.startsWith('7')) {
+        showError('Please enter a valid Safaricom phone number (7XXXXXXXX)');
+        button.innerHTML = originalText;
+        button.disabled = false;
+        return;
+    }
+
+    const fullPhoneNumber = '254' + phoneNumber;
+
+    // Send verification request to backend
+    fetch('/auth/verify-manual-payment/', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'X-CSRFToken': getCookie('csrftoken')
+        },
+        body: JSON.stringify({
+            phone_number: fullPhoneNumber,
+            amount: 79,
+            till_number: '6957778'
+        })
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.success) {
+            if (data.payment_found) {
+                // Payment found and verified
+                paymentSuccess();
+            } else {
+                // Payment not found yet
+                showError('Payment not found yet. Please wait a few minutes and try again, or ensure you entered the correct phone number.');
+                button.innerHTML = originalText;
+                button.disabled = false;
+
+                // Optionally, start checking status
+                // startManualStatusChecking(fullPhoneNumber);
+            }
+        } else {
+            showError(data.message || 'Failed to verify payment. Please try again later.');
+            button.innerHTML = originalText;
+            button.disabled = false;
+        }
+    })
+    .catch(error => {
+        console.error('Error:', error);
+        showError('Network error. Please check your connection and try again.');
+        button.innerHTML = originalText;
+        button.disabled = false;
+    });
+}
+
+// Start checking payment status periodically
+function startStatusChecking() {
+    // Check immediately
+    checkPaymentStatus();
+
+    // Then check every 5 seconds
+    statusCheckInterval = setInterval(checkPaymentStatus, 5000);
+}
+
+// Check payment status
+function checkPaymentStatus() {
+    if (!currentCheckoutRequestId) return;
+
+    fetch('/auth/check-payment-status/', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'X-CSRFToken': getCookie('csrftoken')
+        },
+        body: JSON.stringify({
+            checkout_request_id: currentCheckoutRequestId
+        })
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.success) {
+            if (data.status === 'COMPLETED' || data.premium_active) {
+                // Payment completed successfully
+                paymentSuccess();
+            } else if (data.status === 'FAILED') {
+                // Payment failed
+                paymentFailed();
+            }
+            // If still pending, do nothing - continue checking
+        } else {
+            // Error checking status
+            console.error('Status check error:', data.message);
+        }
+    })
+    .catch(error => {
+        console.error('Status check error:', error);
+    });
+}
+
+// Payment successful
+function paymentSuccess() {
+    // Clear interval
+    if (statusCheckInterval) {
+        clearInterval(statusCheckInterval);
+        statusCheckInterval = null;
+    }
+
+    // Update progress
+    updateProgress(3);
+
+    // Show success message
+    document.getElementById('paymentPending').style.display = 'none';
+    document.getElementById('manualPaymentSection').style.display = 'none';
+    document.getElementById('successMessage').classList.remove('d-none');
+    document.getElementById('successMessage').classList.add('animate__animated', 'animate__pulse');
+
+    // Redirect to dashboard after 3 seconds
+    setTimeout(() => {
+        window.location.href = '/auth/dashboard/';
+    }, 3000);
+}
+
+// Payment failed
+function paymentFailed() {
+    // Clear interval
+    if (statusCheckInterval) {
+        clearInterval(statusCheckInterval);
+        statusCheckInterval = null;
+    }
+
+    // Show error and allow retry
+    showError('Payment failed. Please try again or use a different payment method.');
+
+    // Reset to payment method selection
+    showPaymentMethodSelection();
+}
+
+// Cancel payment
+function cancelPayment() {
+    // Clear interval
+    if (statusCheckInterval) {
+        clearInterval(statusCheckInterval);
+        statusCheckInterval = null;
+    }
+
+    // Reset to payment method selection
+    showPaymentMethodSelection();
+
+    // Show message
+    showError('Payment cancelled. You can try again anytime.');
+}
+
+// Update progress steps
+function updateProgress(step) {
+    // Reset all steps
+    document.getElementById('step1').className = 'progress-step';
+    document.getElementById('step2').className = 'progress-step';
+    document.getElementById('step3').className = 'progress-step';
+    document.getElementById('line1').className = 'progress-line';
+    document.getElementById('line2').className = 'progress-line';
+
+    if (step >= 1) {
+        document.getElementById('step1').className = 'progress-step completed';
+    }
+
+    if (step >= 2) {
+        document.getElementById('step2').className = 'progress-step active';
+        document.getElementById('line1').className = 'progress-line completed';
+    }
+
+    if (step >= 3) {
+        document.getElementById('step2').className = 'progress-step completed';
+        document.getElementById('step3').className = 'progress-step completed';
+        document.getElementById('line2').className = 'progress-line completed';
+    }
+}
+
+// Show error message
+function showError(message) {
+    const errorElement = document.getElementById('errorMessage');
+    const errorText = document.getElementById('errorText');
+
+    errorText.textContent = message;
+    errorElement.classList.remove('d-none');
+    errorElement.classList.add('animate__animated', 'animate__shakeX');
+
+    // Auto-hide after 10 seconds
+    setTimeout(() => {
+        hideError();
+    }, 10000);
+}
+
+// Hide error message
+function hideError() {
+    const errorElement = document.getElementById('errorMessage');
+    errorElement.classList.add('d-none');
+    errorElement.classList.remove('animate__animated', 'animate__shakeX');
+}
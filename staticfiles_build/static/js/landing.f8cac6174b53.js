@@ -0,0 +1,43 @@
+// Navbar scroll effect
+window.addEventListener('scroll', function() {
+    const navbar = document.querySelector('.navbar');
+    if (window.scrollY > 50) {
+        navbar.style.padding = '10px 0';
+        navbar.style.background = 'rgba(44, 44, 44, 0.98)';
+    } else {
+        navbar.style.padding = '15px 0';
+        navbar.style.background = 'rgba(44, 44, 44, 0.95)';
+    }
+});
+
+// Smooth scrolling for anchor links
+document.querySelectorAll('a[href^="#"]').forEach(anchor => {
+    anchor.addEventListener('click', function (e) {
+        e.preventDefault();
+        const target = document.querySelector(this.getAttribute('href'));
+        if (target) {
+            window.scrollTo({
+                top: target.offsetTop - 80,
+                behavior: 'smooth'
+            });
+        }
+    });
+});
+
+// Animation on scroll
+function animateOnScroll() {
+    const elements = document.querySelectorAll('.step-card, .feature-card, .testimonial-card');
+
+    elements.forEach(element => {
+        const elementTop = element.getBoundingClientRect().top;
+        const elementVisible = 150;
+
+        if (elementTop < window.innerHeight - elementVisible) {
+            element.classList.add('animate__fadeInUp');
+        }
+    });
+}
+
+window.addEventListener('scroll', animateOnScroll);
+// Initial check
+animateOnScroll();